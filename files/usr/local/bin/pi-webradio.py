@@ -50,6 +50,10 @@ def get_parser():
     dest='target_dir',
     help='target directory for recordings')
 
+  parser.add_argument('-b', '--backend', metavar='backend',
+    dest='backend', default=None,
+    help="playback-backend: mpg123|fake (overrides config-file)")
+
   parser.add_argument('-d', '--debug', action='store_true',
     dest='debug', default=False,
     help="force debug-mode (overrides config-file)")
@@ -123,7 +127,10 @@ if __name__ == '__main__':
     for channel in channels:
       print(PRINT_CHANNEL_FMT.format(channel['nr'],channel['name']))
   else:
-    ev_queue = app.api._add_consumer("main")
+    if options.quiet:
+      ev_queue = app.api._add_consumer("main",types=['eof','sys'])
+    else:
+      ev_queue = app.api._add_consumer("main")
     threading.Thread(target=process_events,args=(app,options,ev_queue)).start()
     if options.do_record:
       app.api.rec_start(nr=int(options.channel),sync=True)
@@ -146,29 +146,53 @@ class RadioCli(object):
       if ev_data['type'] != 'keep_alive':
         print(ev_data['text'])
 
+  # --- convert arguments   -------------------------------------------------
+
+  def _get_params(self,args):
+    """ convert list of key=value arguments to dict """
+
+    params = {}
+    for a in args:
+      [key,value] = a.split("=",1)
+      params[key] = value
+    return params
+
   # --- process single api   -------------------------------------------------
 
   def process_api(self,api,args=[],sync=True):
     """ process a single API-call """
 
+    params = self._get_params(args)
+
     # execute api
     if api == "get_events":
+      # optional argument types=type1,type2,... (default: all but position)
+      types = params.get('types')
+      if types:
+        types = types.split(',')
+      else:
+        types = ['-position']
       if sync:
-        events = self._cli.get_events()
+        events = self._cli.get_events(types)
         for event in events:
           self.handle_event(event)
       else:
-        self._cli.start_event_processing(callback=self.handle_event)
+        self._cli.start_event_processing(callback=self.handle_event,
+                                         types=types)
     else:
       # use synchronous calls for all other events
-      params = {}
-      for a in args:
-        [key,value] = a.split("=",1)
-        params[key] = value
-
       resp = self._cli.exec(api,params=params)
       self.print_response(resp)
 
+  # --- process list of API-calls   -------------------------------------------
+
+  def process_batch(self,apis):
+    """ process a list of API-calls with a single request """
+
+    calls = [(api[0],self._get_params(api[1:])) for api in apis]
+    resp  = self._cli.exec_many(calls)
+    self.print_response(resp)
+
   # --- process stdin   ------------------------------------------------------
 
   def process_stdin(self):
@@ -242,7 +266,10 @@ class RadioCli(object):
           self.msg("webradio_cli: voice-support not installed",force=True)
           return
       for api in ctrl.api_from_key():
-        if api[0] == "_quit":
+        if isinstance(api[0],list):
+          # list of API-calls
+          self.process_batch(api)
+        elif api[0] == "_quit":
           return
         elif api[0] == "_help":
           ctrl.print_mapping()
@@ -251,7 +278,7 @@ class RadioCli(object):
         if api[0] == 'sys_stop':
           return
     elif self.interactive:
-      self._api_list = self._cli.get_api_list()
+      self._api_list = [api['name'] for api in self._cli.get_api_list()]
       readline.set_completer(lambda text,state: self.completer(text,state))
       readline.parse_and_bind("tab: complete")
       while True:
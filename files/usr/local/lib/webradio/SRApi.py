@@ -12,25 +12,200 @@
 #
 # ----------------------------------------------------------------------------
 
+import json, threading, time, inspect, types
+
 from webradio import Base
 
+# --- convert query-string value to bool   -----------------------------------
+
+def _to_bool(value):
+  """ convert query-string value to bool """
+
+  if isinstance(value,bool):
+    return value
+  value = str(value).lower()
+  if value in ['1','true','yes','on']:
+    return True
+  elif value in ['0','false','no','off','']:
+    return False
+  raise ValueError("invalid boolean %s" % value)
+
+# argument-types (derived from default values) and their conversion
+ARG_TYPES = {'bool': _to_bool, 'int': int, 'float': float}
+
 class Api(Base):
   """ The class holds References to all API-functions """
 
   def __init__(self,app):
     """ initialization """
 
+    # response-cache (must exist before the first public attribute is set)
+    self._cache_lock   = threading.Lock()
+    self._cache_epoch  = "%x" % int(time.time())
+    self._cache_scopes = {}                 # api-name -> scope
+    self._cache_vers   = {}                 # scope -> version
+    self._cache        = {}                 # api-name -> (version,json)
+
+    # dispatch-table: replaced (never modified) for every new API
+    self._apis         = types.MappingProxyType({})
+    self._api_list     = []
+
     self._app          = app
     self.debug         = app.debug
+    self._metrics      = app.metrics
+    self._metrics.histogram("webradio_api_duration_seconds",
+                            "duration of API-calls")
+    self._metrics.counter("webradio_api_errors_total",
+                          "number of failed API-calls")
+    self._metrics.counter("webradio_api_cache_hits_total",
+                          "number of API-calls served from the cache")
+    self._cache_api("get_api_list","apis")
+    self._register("get_api_list",self.get_api_list)
+
+  # --- register public APIs   -----------------------------------------------
+
+  def __setattr__(self,name,value):
+    """ set attribute, register public APIs """
+
+    super().__setattr__(name,value)
+    if not name.startswith("_") and callable(value):
+      self._register(name,value)
+
+  # --- create argument-schema of an API   -----------------------------------
+
+  def _get_schema(self,func):
+    """ introspect signature: return tuple (schema,varargs). The
+        type of an argument is derived from its default value.
+    """
+
+    schema  = []
+    varargs = False
+    for p in inspect.signature(func).parameters.values():
+      if p.kind == p.VAR_KEYWORD:
+        varargs = True
+        continue
+      elif p.kind == p.VAR_POSITIONAL:
+        continue
+      arg = {'name': p.name}
+      if p.default is p.empty:
+        arg['type']     = 'str'
+        arg['required'] = True
+      else:
+        arg['type']     = type(p.default).__name__
+        if arg['type'] not in ARG_TYPES:
+          arg['type'] = 'str'
+        arg['required'] = False
+        if p.default is None or arg['type'] != 'str' or isinstance(p.default,str):
+          arg['default'] = p.default
+      schema.append(arg)
+    return (schema,varargs)
+
+  # --- add API to dispatch-table   ------------------------------------------
+
+  def _register(self,name,func):
+    """ add API to a copy of the dispatch-table and replace the table """
+
+    schema, varargs = self._get_schema(func)
+    apis = dict(self._apis)
+    apis[name] = (func,{a['name']: a for a in schema},varargs)
+    self._api_list = sorted(
+      [{'name': n, 'args': list(e[1].values())} for n,e in apis.items()],
+      key=lambda a: a['name'])
+    self._apis = types.MappingProxyType(apis)
+    self._invalidate("apis")
+
+  # --- coerce and validate arguments   --------------------------------------
+
+  def _coerce(self,name,schema,varargs,args):
+    """ check arguments against the schema and convert them """
+
+    result = {}
+    for key,value in args.items():
+      arg = schema.get(key)
+      if not arg:
+        if not varargs:
+          raise ValueError("API %s: unknown argument %s" % (name,key))
+        result[key] = value
+        continue
+      if arg['type'] == 'str' or value is None:
+        result[key] = value
+        continue
+      try:
+        result[key] = ARG_TYPES[arg['type']](value)
+      except (ValueError,TypeError):
+        raise ValueError("API %s: invalid value for %s: %r" % (name,key,value))
+    for arg in schema.values():
+      if arg['required'] and arg['name'] not in result:
+        raise ValueError("API %s: missing argument %s" % (name,arg['name']))
+    return result
+
+  # --- declare API as cacheable   -------------------------------------------
+
+  def _cache_api(self,name,scope):
+    """ cache results of the API (without arguments) until the owning
+        subsystem invalidates the given scope
+    """
+
+    with self._cache_lock:
+      self._cache_scopes[name] = scope
+      self._cache_vers.setdefault(scope,0)
+
+  # --- invalidate cached results   ------------------------------------------
+
+  def _invalidate(self,scope):
+    """ bump version of scope """
+
+    with self._cache_lock:
+      self._cache_vers[scope] = self._cache_vers.get(scope,0) + 1
+
+  # --- execute API using the response-cache   -------------------------------
+
+  def _exec_cached(self,name,if_none_match=None):
+    """ execute a cacheable API, return tuple (etag,json) or None if the
+        API is not cacheable. json is None if if_none_match is current.
+    """
+
+    scope = self._cache_scopes.get(name)
+    if not scope:
+      return None
+    with self._cache_lock:
+      version = self._cache_vers[scope]
+      entry   = self._cache.get(name)
+    etag = '"%s-%s-%d"' % (self._cache_epoch,scope,version)
+
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(',')]:
+      self._metrics.inc("webradio_api_cache_hits_total",api=name)
+      return (etag,None)
+    if entry and entry[0] == version:
+      self._metrics.inc("webradio_api_cache_hits_total",api=name)
+      return (etag,entry[1])
+
+    # note: a concurrent invalidation leaves an outdated entry, which is
+    # replaced by the next call
+    body = json.dumps(self._exec(name))
+    with self._cache_lock:
+      self._cache[name] = (version,body)
+    return (etag,body)
 
   # --- execute API by name   ------------------------------------------------
 
   def _exec(self,name,**args):
     """ execute an API by name """
 
-    if hasattr(self,name):
-      self.msg("executing: %s(%r)" % (name,dict(**args)))
-      return getattr(self,name)(**args)
+    entry = self._apis.get(name)
+    if entry:
+      func, schema, varargs = entry
+      start = time.perf_counter()
+      try:
+        args = self._coerce(name,schema,varargs,args)
+        self.msg("executing: %s(%r)" % (name,args))
+        return func(**args)
+      except:
+        self._metrics.inc("webradio_api_errors_total",api=name)
+        raise
+      finally:
+        self._metrics.observe("webradio_api_duration_seconds",
+                              time.perf_counter()-start,api=name)
     else:
       self.msg("unknown API-method %s" % name)
       raise NotImplementedError("API %s not implemented" % name)
@@ -38,8 +213,6 @@ class Api(Base):
   # --- return list of APIs   ------------------------------------------------
 
   def get_api_list(self):
-    """ return list of APIs """
+    """ return list of APIs with their argument-schemas """
 
-    return [func for func in dir(self)
-            if callable(getattr(self, func)) and not func.startswith("_")
-            and func not in Base.__dict__ ]
+    return self._api_list
@@ -0,0 +1,344 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Class AsyncWebServer: serve gui and process API-requests using asyncio
+#
+# This is an alternative to the threaded WebServer: all connections
+# (including SSE-streams) are served from a single event-loop, API-calls
+# are dispatched to a small thread-pool. Select it with 'server: asyncio'
+# in section [WEB] of the configuration-file.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# ----------------------------------------------------------------------------
+
+# --- System-Imports   -------------------------------------------------------
+
+import json, queue, traceback, threading, asyncio
+import urllib.parse, concurrent.futures, http
+import jinja2
+
+from webradio import WebServer
+from webradio import RadioEvents
+
+# --- parsed HTTP-request   --------------------------------------------------
+
+class HttpRequest(object):
+  """ minimal HTTP-request """
+
+  def __init__(self,method,target,version,headers,body):
+    """ constructor """
+
+    url          = urllib.parse.urlsplit(target)
+    self.method  = method
+    self.path    = urllib.parse.unquote(url.path)
+    self.args    = {k: v[0] for k,v in
+                    urllib.parse.parse_qs(url.query,
+                                          keep_blank_values=True).items()}
+    self.version = version
+    self.headers = headers                  # lower-case names
+    self.body    = body
+
+  # --- check for persistent connection   ----------------------------------
+
+  def keep_alive(self):
+    """ check if client wants to keep the connection open """
+
+    conn = self.headers.get('connection','').lower()
+    if self.version == 'HTTP/1.0':
+      return conn == 'keep-alive'
+    else:
+      return conn != 'close'
+
+# --- asyncio-based web-server   ---------------------------------------------
+
+class AsyncWebServer(WebServer):
+  """ Serve GUI and process API-requests from a single event-loop """
+
+  MAX_HEADERS   = 64                        # max. number of header-lines
+  MAX_BODY      = 65536                     # max. size of request-body
+  IDLE_TIMEOUT  = 60                        # close idle connections (s)
+  STATIC_DIRS   = ['css','webfonts','images','js']
+
+  # --- create web-application   ---------------------------------------------
+
+  def _setup(self):
+    """ read additional configuration and render main-page """
+
+    self._workers = int(self.get_value(self._app.parser,"WEB","workers",4))
+    self._loop    = None
+    self._server  = None
+    self._streams = {}                      # consumer: tick (asyncio.Event)
+
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(self._web_root))
+    env.globals['asset_url'] = self._static.asset_url
+    self._main_page = env.get_template("index.html").render().encode('utf-8')
+
+  # --- service-loop   -----------------------------------------------------
+
+  def run(self):
+    """ start and run the webserver """
+
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+      max_workers=self._workers,thread_name_prefix="AsyncWebServer")
+    self._loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self._loop)
+
+    self.msg("WebServer: starting the asyncio web-server")
+    self.msg("WebServer: listening on port %s" % self._port)
+    self.msg("WebServer: using web-root: %s" % self._web_root)
+    try:
+      self._loop.run_until_complete(self._serve())
+    finally:
+      self._executor.shutdown(wait=False)
+      self._loop.close()
+    self.msg("WebServer: finished")
+
+  # --- stop web-server   --------------------------------------------------
+
+  def stop(self):
+    """ stop the web-server """
+
+    self.msg("WebServer: process stop-request")
+    if self._loop and self._server:
+      self._loop.call_soon_threadsafe(self._server.close)
+
+  # --- serve until server is closed   -------------------------------------
+
+  async def _serve(self):
+    """ start server and bridge for events """
+
+    self._server = await asyncio.start_server(self._handle_client,
+                                              self._host,self._port)
+    threading.Thread(target=self._bridge_events,name="AsyncWebServer-events",
+                     daemon=True).start()
+    try:
+      await self._server.serve_forever()
+    except asyncio.CancelledError:
+      pass
+
+    # cancel open connections (e.g. SSE-streams)
+    current = asyncio.current_task()
+    tasks   = [t for t in asyncio.all_tasks() if t is not current]
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks,return_exceptions=True)
+
+  # --- wake up SSE-clients for every new event   --------------------------
+
+  def _bridge_events(self):
+    """ wait for events in a single thread and notify the event-loop """
+
+    consumer = self._api._add_consumer("_async_web_server")
+    while True:
+      event = consumer.get()
+      try:
+        self._loop.call_soon_threadsafe(self._notify,
+                                        event['type'] if event else None)
+      except RuntimeError:
+        break                               # event-loop already closed
+      if event is None:
+        break
+    self._api._del_consumer("_async_web_server")
+
+  # --- notify waiting SSE-clients (called within event-loop)   ------------
+
+  def _notify(self,type):
+    """ set ticks of streams subscribed to the event-type (None: all
+        streams) and replace them with fresh ones
+    """
+
+    for consumer,tick in list(self._streams.items()):
+      if type is None or consumer.wants(type):
+        self._streams[consumer] = asyncio.Event()
+        tick.set()
+
+  # --- process requests of a single connection   --------------------------
+
+  async def _handle_client(self,reader,writer):
+    """ read and process requests of a connection """
+
+    try:
+      while True:
+        request = await self._read_request(reader)
+        if not request:
+          break
+        if not await self._dispatch(request,writer):
+          break
+    except (ConnectionError,asyncio.IncompleteReadError,
+            asyncio.TimeoutError,asyncio.LimitOverrunError,ValueError,
+            asyncio.CancelledError):
+      pass
+    except:
+      traceback.print_exc()
+    finally:
+      writer.close()
+
+  # --- read a single request   --------------------------------------------
+
+  async def _read_request(self,reader):
+    """ read request-line, headers and body """
+
+    line = await asyncio.wait_for(reader.readline(),
+                                  AsyncWebServer.IDLE_TIMEOUT)
+    if not line:
+      return None
+    method, target, version = line.decode('latin-1').split()
+
+    headers = {}
+    for _ in range(AsyncWebServer.MAX_HEADERS):
+      line = await reader.readline()
+      if line in [b'\r\n',b'\n',b'']:
+        break
+      name, value = line.decode('latin-1').split(':',1)
+      headers[name.strip().lower()] = value.strip()
+    else:
+      raise ValueError("too many headers")
+
+    length = int(headers.get('content-length',0))
+    if length > AsyncWebServer.MAX_BODY:
+      raise ValueError("request-body too large")
+    body = await reader.readexactly(length) if length else b''
+    return HttpRequest(method,target,version,headers,body)
+
+  # --- write response   ---------------------------------------------------
+
+  async def _send(self,writer,request,status,body=b'',
+                  content_type='application/json',headers=None):
+    """ write response, return True if the connection stays open """
+
+    keep_alive = request.keep_alive()
+    if isinstance(body,str):
+      body = body.encode('utf-8')
+    lines = ["HTTP/1.1 %d %s" % (status,http.HTTPStatus(status).phrase),
+             "Content-Type: %s" % content_type,
+             "Content-Length: %d" % len(body),
+             "Connection: %s" % ("keep-alive" if keep_alive else "close")]
+    if headers:
+      lines.extend(["%s: %s" % h for h in headers.items()])
+    writer.write(("\r\n".join(lines)+"\r\n\r\n").encode('latin-1'))
+    if request.method != 'HEAD':
+      writer.write(body)
+    await writer.drain()
+    return keep_alive
+
+  # --- dispatch request   -------------------------------------------------
+
+  async def _dispatch(self,request,writer):
+    """ dispatch request to handler, return True if connection stays open """
+
+    path  = request.path
+    parts = path.strip('/').split('/',1)
+    if request.method not in ['GET','HEAD','POST']:
+      return await self._send(writer,request,405,
+                              json.dumps({"msg": "method not allowed"}))
+    elif path == '/':
+      return await self._send(writer,request,200,self._main_page,
+                              'text/html; charset=utf-8')
+    elif parts[0] in AsyncWebServer.STATIC_DIRS and len(parts) == 2:
+      return await self._send_static(writer,request,path.lstrip('/'))
+    elif path == '/metrics':
+      body = await self._loop.run_in_executor(self._executor,
+                                              self._app.metrics.render)
+      return await self._send(writer,request,200,body,
+                              'text/plain; version=0.0.4; charset=utf-8')
+    elif path == '/api/get_events':
+      await self._stream_events(request,writer)
+      return False
+    elif path == '/api/player_get_cover':
+      return await self._get_cover(request,writer)
+    elif path == '/api/update_state' and request.method == 'POST':
+      return await self._post_state(request,writer)
+    elif path == '/api/batch' and request.method == 'POST':
+      status, body = await self._loop.run_in_executor(
+        self._executor,self._exec_batch,request.body)
+      return await self._send(writer,request,status,body)
+    elif parts[0] == 'api' and len(parts) == 2:
+      status, body, headers = await self._loop.run_in_executor(
+        self._executor,self._exec_api,parts[1],request.args,
+        request.headers.get('if-none-match'))
+      return await self._send(writer,request,status,body,headers=headers)
+    else:
+      return await self._send(writer,request,404,
+                              json.dumps({"msg": "not found"}))
+
+  # --- send (precompressed) static file   --------------------------------
+
+  async def _send_static(self,writer,request,relpath):
+    """ send static file from the in-memory cache """
+
+    status, headers, body = await self._loop.run_in_executor(
+      self._executor,self._static.response,relpath,
+      request.headers.get('accept-encoding',''),
+      request.headers.get('if-none-match'),request.args.get('v'))
+    content_type = headers.pop('Content-Type','application/octet-stream')
+    return await self._send(writer,request,status,body,content_type,headers)
+
+  # --- return cover   -----------------------------------------------------
+
+  async def _get_cover(self,request,writer):
+    """ return cover if available """
+
+    status, headers, body = await self._loop.run_in_executor(
+      self._executor,self._cover_response,request.args.get('size'),
+      request.headers.get('if-none-match'))
+    content_type = headers.pop('Content-Type','application/octet-stream')
+    return await self._send(writer,request,status,body,content_type,headers)
+
+  # --- publish state   ----------------------------------------------------
+
+  async def _post_state(self,request,writer):
+    """ update state and redistribute """
+
+    try:
+      state = json.loads(request.body.decode('utf-8'))
+      await self._loop.run_in_executor(self._executor,
+                                       self._update_state,state)
+      return await self._send(writer,request,200,b'','text/html')
+    except:
+      self.msg("WebRadio: exception while calling: /api/update_state")
+      traceback.print_exc()
+      return await self._send(writer,request,500,
+                              json.dumps({"msg": "internal server error"}))
+
+  # --- stream SSE (server sent events)   ----------------------------------
+
+  async def _stream_events(self,request,writer):
+    """ stream SSE until client disconnects or event-processing stops """
+
+    # adding a consumer creates the snapshot and might toggle position-events
+    # of the backend, so don't block the event-loop
+    id, consumer = await self._loop.run_in_executor(
+      self._executor,self._add_consumer,
+      request.headers.get('last-event-id',request.args.get('lastEventId')),
+      request.args.get('types'))
+    self._streams[consumer] = asyncio.Event()
+    try:
+      writer.write(b"HTTP/1.1 200 OK\r\n"
+                   b"Content-Type: text/event-stream\r\n"
+                   b"Cache-Control: no-cache\r\n"
+                   b"Connection: close\r\n\r\n")
+      while True:
+        # take tick before reading, so we don't miss a notification
+        tick = self._streams[consumer]
+        while True:
+          try:
+            frame = consumer.get_frame(block=False)
+          except queue.Empty:
+            break
+          if not frame:
+            return
+          writer.write(frame)
+        await writer.drain()
+        try:
+          await asyncio.wait_for(tick.wait(),RadioEvents.KEEP_ALIVE_INTERVAL)
+        except asyncio.TimeoutError:
+          # SSE-comment: detects broken connections of filtered consumers
+          writer.write(b": keep-alive\n\n")
+    finally:
+      del self._streams[consumer]
+      await self._loop.run_in_executor(self._executor,
+                                       self._api._del_consumer,id)
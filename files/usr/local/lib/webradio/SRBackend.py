@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class Backend
+#
+# The class Backend defines the interface of playback-backends used by
+# Radio and Player. It implements the volume-control and the management of
+# frame-listeners common to all backends. Backends publish the events
+# play, pause, eof, position, icy_name, icy_meta and id3.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# -----------------------------------------------------------------------------
+
+import threading, abc
+
+from webradio import Base
+
+class Backend(Base,abc.ABC):
+  """ base class of playback-backends """
+
+  SECTION = None                            # config-section of the backend
+
+  def __init__(self,app):
+    """ initialization """
+
+    self._app       = app
+    self._api       = app.api
+    self.debug      = app.debug
+    self._lock      = threading.RLock()       # serializes command-sequences
+    self._frame_listeners = []
+    self._tracking  = False                   # position-events are consumed
+    self._volume    = -1
+    self._mute      = False
+
+    self.read_config()
+    self.register_apis()
+    self._metrics = app.metrics
+
+  # --- read configuration   --------------------------------------------------
+
+  def read_config(self):
+    """ read configuration from config-file """
+
+    self._vol_default = int(self.get_value(self._app.parser,self.SECTION,
+                                       "vol_default",30))
+    self._volume      = self._vol_default
+    self._vol_delta   = int(self.get_value(self._app.parser,self.SECTION,
+                                       "vol_delta",5))
+    self._position_interval = float(self.get_value(self._app.parser,
+                                       self.SECTION,"position_interval",1))
+
+  # --- register APIs   ------------------------------------------------------
+
+  def register_apis(self):
+    """ register API-functions """
+
+    self._api.vol_up          = self.vol_up
+    self._api.vol_down        = self.vol_down
+    self._api.vol_set         = self.vol_set
+    self._api.vol_mute_on     = self.vol_mute_on
+    self._api.vol_mute_off    = self.vol_mute_off
+    self._api.vol_mute_toggle = self.vol_mute_toggle
+    self._api._track_position = self.track_position
+
+  # --- return persistent state of this class   -------------------------------
+
+  def get_persistent_state(self):
+    """ return persistent state (overrides SRBase.get_pesistent_state()) """
+    return {
+      'volume': self._volume if not self._mute else self._vol_old
+      }
+
+  # --- restore persistent state of this class   ------------------------------
+
+  def set_persistent_state(self,state_map):
+    """ restore persistent state (overrides SRBase.set_pesistent_state()) """
+
+    self.msg("%s: restoring persistent state" % self.__class__.__name__)
+    if 'volume' in state_map:
+      self._volume = state_map['volume']
+    else:
+      self._volume = self._vol_default
+    self.msg("%s: volume is: %d" % (self.__class__.__name__,self._volume))
+
+  # --- methods implemented by backends   -------------------------------------
+  # (a backend missing one of these methods cannot be instantiated)
+
+  @abc.abstractmethod
+  def create(self):
+    """ start the backend """
+
+  @abc.abstractmethod
+  def destroy(self):
+    """ stop the backend """
+
+  @abc.abstractmethod
+  def is_active(self):
+    """ return True if the backend is running """
+
+  @abc.abstractmethod
+  def play(self,url,last=True):
+    """ start playing, return True if a new file/url is started """
+
+  @abc.abstractmethod
+  def enqueue(self,files):
+    """ play files after the current file without a gap (replaces
+        previously queued files). Every file publishes play and eof.
+    """
+
+  @abc.abstractmethod
+  def stop(self,last=True):
+    """ stop playing (publishes eof) """
+
+  @abc.abstractmethod
+  def pause(self):
+    """ pause playing """
+
+  @abc.abstractmethod
+  def resume(self):
+    """ continue playing """
+
+  @abc.abstractmethod
+  def toggle(self):
+    """ toggle playing """
+
+  @abc.abstractmethod
+  def _set_volume(self,val):
+    """ set volume of backend, return False if the backend is not running """
+
+  def _enable_frame_info(self,enable):
+    """ start/stop calling frame-listeners """
+    pass
+
+  def _enable_position(self,enable):
+    """ start/stop publishing position-events """
+    pass
+
+  def preload(self,url):
+    """ prepare playing url (optional) """
+    pass
+
+  # --- start/stop position-events   ------------------------------------------
+
+  def track_position(self,enable):
+    """ publish position-events only while a consumer receives them
+        (called by RadioEvents)
+    """
+
+    with self._lock:
+      if enable != self._tracking:
+        self.msg("%s: position-events %s" % (self.__class__.__name__,
+                                             "on" if enable else "off"))
+        self._tracking = enable
+        self._enable_position(enable)
+
+  # --- add listener for frame-info   -----------------------------------------
+
+  def add_frame_listener(self,func):
+    """ add listener for frame-info. The listener is called with
+        (frame,frames_left,secs,secs_left) every position_interval seconds.
+    """
+
+    with self._lock:
+      self._frame_listeners.append(func)
+      if len(self._frame_listeners) == 1:
+        self._enable_frame_info(True)
+
+  # --- remove listener for frame-info   --------------------------------------
+
+  def remove_frame_listener(self,func):
+    """ remove listener for frame-info """
+
+    with self._lock:
+      if func in self._frame_listeners:
+        self._frame_listeners.remove(func)
+        if not self._frame_listeners:
+          self._enable_frame_info(False)
+
+  # --- increase volume   ----------------------------------------------------
+
+  def vol_up(self,by=0):
+    """ increase volume by amount or the pre-configured value """
+
+    if by:
+      amount = max(0,by)          # only accept positive values
+    else:
+      amount = self._vol_delta        # use default
+    self._volume = min(100,self._volume + amount)
+    return self.vol_set(self._volume)
+
+  # --- decrease volume   ----------------------------------------------------
+
+  def vol_down(self,by=0):
+    """ decrease volume by amount or the pre-configured value """
+
+    if by:
+      amount = max(0,by)          # only accept positive values
+    else:
+      amount = self._vol_delta        # use default
+    self._volume = max(0,self._volume - amount)
+    return self.vol_set(self._volume)
+
+  # --- set volume   ---------------------------------------------------------
+
+  def vol_set(self,val):
+    """ set volume """
+
+    val = min(max(0,int(val)),100)
+    self._volume = val
+    with self._lock:
+      running = self._set_volume(val)
+    if running:
+      self._api._push_event({'type': 'vol_set',
+                              'value': self._volume})
+      return self._volume
+
+  # --- mute on  -------------------------------------------------------------
+
+  def vol_mute_on(self):
+    """ activate mute (i.e. set volume to zero) """
+
+    if not self._mute:
+      self._vol_old = self._volume
+      self._mute    = True
+      return self.vol_set(0)
+
+  # --- mute off  ------------------------------------------------------------
+
+  def vol_mute_off(self):
+    """ deactivate mute (i.e. set volume to last value) """
+
+    if self._mute:
+      self._mute = False
+      return self.vol_set(self._vol_old)
+
+  # --- mute toggle   --------------------------------------------------------
+
+  def vol_mute_toggle(self):
+    """ toggle mute """
+
+    if self._mute:
+      return self.vol_mute_off()
+    else:
+      return self.vol_mute_on()
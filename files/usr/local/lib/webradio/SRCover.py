@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class Cover
+#
+# The class Cover creates size-bounded thumbnails of cover-images (cover.jpg
+# or embedded ID3-pictures) and keeps them in an on-disk LRU-cache.
+# The ETag only depends on the source-file and the size, so revalidation
+# does not read the image. Files without a picture are remembered.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# -----------------------------------------------------------------------------
+
+import os, io, hashlib, threading, tempfile, collections
+
+from webradio import Base, Mp3Info
+
+# Pillow is optional: without it, covers are cached in original size
+have_pil = False
+try:
+  from PIL import Image
+  have_pil = True
+except:
+  pass
+
+class Cover(Base):
+  """ cover-thumbnails with on-disk LRU-cache """
+
+  SIZE_STEP   = 100                         # round requested sizes up
+  MAX_MISSING = 1000                        # remembered files without picture
+
+  def __init__(self,app):
+    """ initialization """
+
+    self._app     = app
+    self.debug    = app.debug
+    self._mp3info = Mp3Info(self.debug)
+    self._lock    = threading.Lock()
+    self._usage   = None                    # bytes in cache (lazy)
+    self._missing = collections.OrderedDict()  # sources without picture
+    self.read_config()
+
+  # --- read configuration   --------------------------------------------------
+
+  def read_config(self):
+    """ read configuration from config-file """
+
+    # section [COVER]
+    self._cache_dir = self.get_value(self._app.parser,"COVER","cover_cache_dir",
+              os.path.expanduser(os.path.join("~",".cache","pi-webradio")))
+    self._cache_dir = os.path.join(self._cache_dir,"covers")
+    self._max_cache = 1024*1024*int(self.get_value(self._app.parser,"COVER",
+                                                   "cover_cache_size",20))
+    self._def_size  = int(self.get_value(self._app.parser,"COVER",
+                                         "cover_size",400))
+    self._max_size  = int(self.get_value(self._app.parser,"COVER",
+                                         "cover_max_size",800))
+    self._quality   = int(self.get_value(self._app.parser,"COVER",
+                                         "cover_quality",85))
+    try:
+      os.makedirs(self._cache_dir,exist_ok=True)
+    except OSError:
+      self.msg("[WARNING] Cover: cannot create %s, caching disabled" %
+               self._cache_dir,True)
+      self._cache_dir = None
+    if not have_pil:
+      self.msg("[WARNING] Cover: PIL not available, not scaling covers",True)
+
+  # --- normalize requested size   -------------------------------------------
+
+  def _get_size(self,size):
+    """ limit size and round it up to a multiple of SIZE_STEP """
+
+    try:
+      size = int(size) if size else self._def_size
+    except ValueError:
+      size = self._def_size
+    size = max(Cover.SIZE_STEP,min(size,self._max_size))
+    return -(-size // Cover.SIZE_STEP) * Cover.SIZE_STEP
+
+  # --- identify source and thumbnail   -------------------------------------
+
+  def _get_key(self,path,size):
+    """ return tuple (source,key) for path and requested size or None.
+        Without PIL, all sizes share the original image.
+    """
+
+    try:
+      st = os.stat(path)
+    except OSError:
+      return None
+    size   = self._get_size(size) if have_pil else 0
+    source = "%s:%d:%d" % (path,st.st_mtime_ns,st.st_size)
+    key    = hashlib.sha1(("%s:%d" % (source,size)).encode('utf-8')).hexdigest()
+    return (source,key)
+
+  # --- read source-image   --------------------------------------------------
+
+  def _read_source(self,path):
+    """ read image or embedded picture, return data or None """
+
+    if path.lower().endswith(".mp3"):
+      picture = self._mp3info.get_picture(path)
+      return picture[1] if picture else None
+    try:
+      with open(path,"rb") as f:
+        return f.read()
+    except OSError:
+      return None
+
+  # --- create thumbnail   ---------------------------------------------------
+
+  def _scale(self,data,size):
+    """ scale image to fit into size x size, return jpeg-data """
+
+    if not have_pil:
+      return data
+    try:
+      img = Image.open(io.BytesIO(data))
+      if img.width <= size and img.height <= size and img.format == 'JPEG':
+        return data
+      img.thumbnail((size,size))
+      if img.mode not in ['RGB','L']:
+        img = img.convert('RGB')
+      out = io.BytesIO()
+      img.save(out,'JPEG',quality=self._quality,optimize=True)
+      return out.getvalue()
+    except Exception as ex:
+      self.msg("[WARNING] Cover: cannot scale image: %s" % ex,True)
+      return data
+
+  # --- remove least recently used entries   ---------------------------------
+
+  def _evict(self):
+    """ remove oldest cache-entries until cache is within limits """
+
+    if self._usage is not None and self._usage <= self._max_cache:
+      return
+    entries = []
+    for entry in os.scandir(self._cache_dir):
+      if entry.is_file():
+        st = entry.stat()
+        entries.append((st.st_mtime,st.st_size,entry.path))
+    self._usage = sum([e[1] for e in entries])
+    entries.sort()
+    for mtime, size, path in entries:
+      if self._usage <= self._max_cache:
+        break
+      try:
+        os.unlink(path)
+        self._usage -= size
+        self.msg("Cover: evicted %s" % path)
+      except OSError:
+        pass
+
+  # --- write cache-entry   --------------------------------------------------
+
+  def _store(self,path,data):
+    """ write entry atomically """
+
+    fd, tmp = tempfile.mkstemp(dir=self._cache_dir,suffix=".tmp")
+    with os.fdopen(fd,"wb") as f:
+      f.write(data)
+    os.replace(tmp,path)
+    with self._lock:
+      if self._usage is not None:
+        self._usage += len(data)
+      self._evict()
+
+  # --- return thumbnail   ---------------------------------------------------
+
+  def get(self,path,size=None):
+    """ return tuple (etag,data) of thumbnail for path or None """
+
+    keys = self._get_key(path,size)
+    return self._get_cover(path,size,*keys) if keys else None
+
+  def _get_cover(self,path,size,source,key):
+    """ return tuple (etag,data) of thumbnail for the given keys or None """
+
+    etag = key[:16]
+    with self._lock:
+      if source in self._missing:
+        self._missing.move_to_end(source)
+        return None
+
+    # check cache (and update LRU-timestamp)
+    if self._cache_dir:
+      cache_file = os.path.join(self._cache_dir,key+".jpg")
+      try:
+        with open(cache_file,"rb") as f:
+          data = f.read()
+        os.utime(cache_file)
+        self.msg("Cover: using cached cover for %s" % path)
+        return (etag,data)
+      except OSError:
+        pass
+
+    # create thumbnail
+    data = self._read_source(path)
+    if not data:
+      with self._lock:
+        self._missing[source] = True
+        if len(self._missing) > Cover.MAX_MISSING:
+          self._missing.popitem(last=False)
+      return None
+    size = self._get_size(size)
+    self.msg("Cover: creating %dpx-cover for %s" % (size,path))
+    data = self._scale(data,size)
+    if self._cache_dir:
+      try:
+        self._store(cache_file,data)
+      except OSError as ex:
+        self.msg("[WARNING] Cover: cannot cache cover: %s" % ex,True)
+    return (etag,data)
+
+  # --- create response   --------------------------------------------------
+
+  def response(self,path,size=None,if_none_match=None):
+    """ return tuple (status,headers,body) or None if there is no cover """
+
+    keys = self._get_key(path,size) if path else None
+    if not keys:
+      return None
+
+    # revalidation: the ETag is known without reading the image
+    etag    = keys[1][:16]
+    headers = {'ETag': '"%s"' % etag, 'Cache-Control': 'no-cache'}
+    if if_none_match:
+      tags = [t.strip().strip('"') for t in if_none_match.split(',')]
+      if '*' in tags or etag in tags:
+        return (304,headers,b'')
+
+    cover = self._get_cover(path,size,*keys)
+    if not cover:
+      return None
+    etag, data = cover
+    headers['Content-Type'] = (
+      'image/png' if data.startswith(b'\x89PNG') else 'image/jpeg')
+    return (200,headers,data)
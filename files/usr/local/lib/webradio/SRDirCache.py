@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class DirCache
+#
+# The class DirCache keeps the dir-infos of recently used directories in an
+# LRU-cache, bounded by the number of entries and their (estimated) memory.
+# Cached directories are watched with inotify and invalidated on changes.
+# Without inotify, an entry is revalidated with the modification-time of
+# the directory if it is older than a few seconds.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# -----------------------------------------------------------------------------
+
+import os, sys, time, threading, collections, select, struct
+
+from webradio import Base
+
+# inotify is used through ctypes (Linux only)
+have_inotify = False
+try:
+  import ctypes, ctypes.util
+  _libc = ctypes.CDLL(ctypes.util.find_library("c"),use_errno=True)
+  _libc.inotify_init1.argtypes     = [ctypes.c_int]
+  _libc.inotify_add_watch.argtypes = [ctypes.c_int,ctypes.c_char_p,
+                                      ctypes.c_uint32]
+  _libc.inotify_rm_watch.argtypes  = [ctypes.c_int,ctypes.c_int]
+  have_inotify = True
+except:
+  pass
+
+# --- a cached directory   -----------------------------------------------------
+
+class DirCacheEntry(object):
+  """ dir-info of a directory with its watch """
+
+  def __init__(self,dirinfo,mtime,size,wd):
+    """ initialization """
+
+    self.dirinfo = dirinfo
+    self.mtime   = mtime                    # mtime of directory (ns)
+    self.size    = size                     # estimated memory in bytes
+    self.wd      = wd                       # inotify watch or None
+    self.checked = time.monotonic()
+
+# --- the cache   --------------------------------------------------------------
+
+class DirCache(Base):
+  """ LRU-cache of dir-infos """
+
+  IN_CLOSE_WRITE = 0x00000008
+  IN_MOVED_FROM  = 0x00000040
+  IN_MOVED_TO    = 0x00000080
+  IN_CREATE      = 0x00000100
+  IN_DELETE      = 0x00000200
+  IN_DELETE_SELF = 0x00000400
+  IN_MOVE_SELF   = 0x00000800
+  IN_Q_OVERFLOW  = 0x00004000
+  IN_IGNORED     = 0x00008000
+  IN_ONLYDIR     = 0x01000000
+  IN_CLOEXEC     = 0o2000000
+
+  WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+  def __init__(self,app,on_invalidate=None):
+    """ initialization """
+
+    self._app           = app
+    self.debug          = app.debug
+    self._on_invalidate = on_invalidate     # called with the directory
+    self._lock          = threading.Lock()
+    self._entries       = collections.OrderedDict()  # dir -> entry (LRU first)
+    self._wds           = {}                # watch -> dir
+    self._usage         = 0                 # estimated memory of entries
+    self._fd            = None
+    self.read_config()
+
+    self._metrics = app.metrics
+    self._metrics.counter("webradio_dircache_lookups_total",
+                          "lookups of dir-infos by result")
+    self._metrics.gauge("webradio_dircache_bytes",
+                        "estimated memory of cached dir-infos")
+
+    if self._max_entries > 0 and self._inotify:
+      self._init_inotify()
+
+  # --- read configuration   --------------------------------------------------
+
+  def read_config(self):
+    """ read configuration from config-file """
+
+    # section [PLAYER]
+    self._max_entries = int(self.get_value(self._app.parser,"PLAYER",
+                                           "player_dircache_entries",32))
+    self._max_usage   = 1024*1024*int(self.get_value(self._app.parser,
+                                      "PLAYER","player_dircache_size",4))
+    self._ttl         = int(self.get_value(self._app.parser,"PLAYER",
+                                           "player_dircache_ttl",10))
+    self._inotify     = self.get_value(self._app.parser,"PLAYER",
+                                       "player_dircache_inotify","1") == "1"
+
+  # --- setup inotify   -------------------------------------------------------
+
+  def _init_inotify(self):
+    """ create inotify-instance and start watcher-thread """
+
+    if not have_inotify:
+      self.msg("[WARNING] DirCache: inotify not available, revalidating " +
+               "entries after %d seconds" % self._ttl,True)
+      return
+    fd = _libc.inotify_init1(DirCache.IN_CLOEXEC)
+    if fd < 0:
+      self.msg("[WARNING] DirCache: inotify_init1 failed: %s" %
+               os.strerror(ctypes.get_errno()),True)
+      return
+    self._fd = fd
+    threading.Thread(target=self._process_events,name="DirCache").start()
+
+  # --- process inotify-events   ----------------------------------------------
+
+  def _process_events(self):
+    """ read inotify-events and invalidate directories """
+
+    fd = self._fd
+    while not self._app.stop_event.is_set():
+      ready, _, _ = select.select([fd],[],[],1)
+      if not ready:
+        continue
+      try:
+        data = os.read(fd,65536)
+      except OSError as ex:
+        self.msg("[WARNING] DirCache: reading events failed: %s" % ex,True)
+        break
+      pos = 0
+      while pos+16 <= len(data):
+        wd, mask, cookie, length = struct.unpack_from("iIII",data,pos)
+        pos += 16+length
+        if mask & DirCache.IN_Q_OVERFLOW:
+          self.msg("DirCache: event-queue overflow, clearing cache")
+          with self._lock:
+            dirs = list(self._entries.keys())
+          for dir in dirs:
+            self.invalidate(dir)
+        elif mask & DirCache.IN_IGNORED:
+          self._forget_watch(wd)
+        else:
+          dir = self._wds.get(wd)
+          if dir:
+            self.msg("DirCache: %s changed" % dir)
+            self.invalidate(dir)
+
+    with self._lock:
+      self._fd = None
+    os.close(fd)
+
+  # --- watch handling   ------------------------------------------------------
+
+  def _add_watch(self,dir):
+    """ add watch for directory, return watch or None """
+
+    if self._fd is None:
+      return None
+    wd = _libc.inotify_add_watch(self._fd,os.fsencode(dir),
+                                 DirCache.WATCH_MASK)
+    if wd < 0:
+      self.msg("DirCache: cannot watch %s: %s" %
+               (dir,os.strerror(ctypes.get_errno())))
+      return None
+    self._wds[wd] = dir
+    return wd
+
+  def _rm_watch(self,wd):
+    """ remove watch (the kernel then sends IN_IGNORED) """
+
+    if wd is not None and self._wds.pop(wd,None) and self._fd is not None:
+      _libc.inotify_rm_watch(self._fd,wd)
+
+  def _forget_watch(self,wd):
+    """ watch was removed by the kernel (e.g. directory deleted) """
+
+    with self._lock:
+      dir = self._wds.pop(wd,None)
+      if dir and dir in self._entries:
+        self._entries[dir].wd = None
+    if dir:
+      self.invalidate(dir)
+
+  # --- estimate memory of dir-info   -----------------------------------------
+
+  def _sizeof(self,dirinfo):
+    """ return estimated memory of dir-info in bytes """
+
+    size = sys.getsizeof(dirinfo)
+    for key in ['dirs','files']:
+      size += (sys.getsizeof(dirinfo[key]) +
+               sum([sys.getsizeof(name) for name in dirinfo[key]]))
+    size += sys.getsizeof(dirinfo['dur'])
+    size += sum([sys.getsizeof(dur)+sys.getsizeof(dur[1])
+                 for dur in dirinfo['dur']])
+    return size
+
+  # --- query dir-info   ------------------------------------------------------
+
+  def get(self,dir):
+    """ return dir-info of directory or None """
+
+    with self._lock:
+      entry = self._entries.get(dir)
+      if entry:
+        self._entries.move_to_end(dir)
+        now = time.monotonic()
+        if entry.wd is None and now-entry.checked > self._ttl:
+          try:
+            mtime = os.stat(dir).st_mtime_ns
+          except OSError:
+            mtime = None
+          if mtime == entry.mtime:
+            entry.checked = now
+          else:
+            entry = None
+    if entry:
+      self._metrics.inc("webradio_dircache_lookups_total",result="hit")
+      return entry.dirinfo
+    self.invalidate(dir)
+    self._metrics.inc("webradio_dircache_lookups_total",result="miss")
+    return None
+
+  # --- add dir-info   --------------------------------------------------------
+
+  def put(self,dir,dirinfo,mtime):
+    """ add dir-info of directory. mtime is the modification-time of the
+        directory before it was read: if it changed meanwhile, the dir-info
+        is not cached.
+    """
+
+    if self._max_entries <= 0:
+      return
+    self.invalidate(dir)
+    size = self._sizeof(dirinfo)
+    with self._lock:
+      wd = self._add_watch(dir)
+      try:
+        changed = os.stat(dir).st_mtime_ns != mtime
+      except OSError:
+        changed = True
+      if changed:
+        self._rm_watch(wd)
+        return
+      self._entries[dir] = DirCacheEntry(dirinfo,mtime,size,wd)
+      self._usage += size
+
+      # evict least recently used entries (but keep the new entry)
+      while len(self._entries) > 1 and (len(self._entries) > self._max_entries
+                                        or self._usage > self._max_usage):
+        old_dir, entry = self._entries.popitem(last=False)
+        self._usage -= entry.size
+        self._rm_watch(entry.wd)
+        self.msg("DirCache: evicted %s" % old_dir)
+      self._metrics.set("webradio_dircache_bytes",self._usage)
+
+  # --- invalidate dir-info   -------------------------------------------------
+
+  def invalidate(self,dir):
+    """ remove dir-info of directory """
+
+    with self._lock:
+      entry = self._entries.pop(dir,None)
+      if entry:
+        self._usage -= entry.size
+        self._rm_watch(entry.wd)
+        self._metrics.set("webradio_dircache_bytes",self._usage)
+    if entry and self._on_invalidate:
+      self._on_invalidate(dir)
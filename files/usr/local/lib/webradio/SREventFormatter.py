@@ -27,11 +27,17 @@ class EventFormatter(object):
     'radio_play_channel': 'start playing channel {nr} ({name})',
     'play': 'playing {value}',
     'pause': 'pausing {value}',
+    'position': 'position {elapsed}s of {total}s',
     'file_info': '{name}: {total_pretty}',
     'id3': '{tag}: {value}',
     'keep_alive': 'current time: {value}',
     'eof': '{name} finished',
-    'dir_select': 'current directory: {value}'
+    'dir_select': 'current directory: {value}',
+    'dir_changed': 'directory {value} changed',
+    'dir_info_progress': '{dir}: probed {done} of {total} files',
+    'lagged': 'missed {missed} events, resyncing',
+    'backend_restart': 'backend restarted ({reason}, {count}. time)',
+    'state_delta': 'state version {version}'
     }
 
   # --- format event   --------------------------------------------------------
@@ -40,7 +46,11 @@ class EventFormatter(object):
     """ format given event """
 
     key = event['type']
-    if key in EventFormatter._FMT_MAP:
+    if key in EventFormatter._FMT_MAP and isinstance(event['value'],list):
+      # batched events: format every value on a separate line
+      return "\n".join([self.format({'type': key, 'value': v})
+                        for v in event['value']])
+    elif key in EventFormatter._FMT_MAP:
       if isinstance(event['value'],dict):
         return EventFormatter._FMT_MAP[key].format(**event['value'])
       else:
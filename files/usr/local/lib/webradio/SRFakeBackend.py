@@ -0,0 +1,338 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class FakeBackend
+#
+# The class FakeBackend is an in-process backend without audio. It emits
+# the events of a real backend (play, pause, eof, position, icy_*) with
+# realistic timing, so the rest of the system can be tested and benchmarked
+# without audio-hardware. With speed > 1, time runs faster (e.g. files
+# finish earlier).
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# -----------------------------------------------------------------------------
+
+import threading, os, time, heapq, itertools, collections
+from threading import Thread
+
+from webradio import Backend
+
+class FakeBackend(Backend):
+  """ scripted backend without audio """
+
+  SECTION    = "FAKE"
+  FRAME_RATE = 38.28                        # mp3-frames per second (44.1kHz)
+
+  def __init__(self,app):
+    """ initialization """
+
+    super().__init__(app)
+    self._running    = False
+    self._timers     = []                   # heap of (time,seq,gen,func,args)
+    self._timer_seq  = itertools.count()
+    self._timer_cond = threading.Condition()
+    self._generation = 0                    # invalidates timers of last url
+
+    self._play       = False
+    self._pause      = False
+    self._url        = None
+    self._last       = True
+    self._start_time = 0                    # start-time (fake seconds)
+    self._pause_time = 0
+    self._duration   = 0
+    self._playlist   = collections.deque()  # (path,last) of queued files
+
+  # --- read configuration   --------------------------------------------------
+
+  def read_config(self):
+    """ read configuration from config-file """
+
+    # section [FAKE]
+    super().read_config()
+    self._speed        = float(self.get_value(self._app.parser,"FAKE",
+                                              "speed",1.0))
+    self._connect_time = float(self.get_value(self._app.parser,"FAKE",
+                                              "connect_time",0.3))
+    self._load_time    = float(self.get_value(self._app.parser,"FAKE",
+                                              "load_time",0.02))
+    self._file_duration = float(self.get_value(self._app.parser,"FAKE",
+                                               "duration",180))
+    self._icy_interval = float(self.get_value(self._app.parser,"FAKE",
+                                              "icy_interval",30))
+
+  # --- fake clock   ----------------------------------------------------------
+
+  def _now(self):
+    """ return fake time (real time multiplied by speed) """
+
+    return time.monotonic()*self._speed
+
+  # --- scheduler   -----------------------------------------------------------
+
+  def _schedule(self,delay,func,*args):
+    """ call func(*args) after delay fake seconds (if url did not change) """
+
+    with self._timer_cond:
+      heapq.heappush(self._timers,(self._now()+delay,next(self._timer_seq),
+                                   self._generation,func,args))
+      self._timer_cond.notify()
+
+  def _run_timers(self):
+    """ timer-thread: execute scheduled functions """
+
+    self.msg("FakeBackend: starting timer-thread")
+    while True:
+      with self._timer_cond:
+        while self._running:
+          if self._timers:
+            delay = (self._timers[0][0] - self._now())/self._speed
+            if delay <= 0:
+              break
+            self._timer_cond.wait(delay)
+          else:
+            self._timer_cond.wait()
+        if not self._running:
+          break
+        _, _, generation, func, args = heapq.heappop(self._timers)
+      with self._lock:
+        if generation == self._generation:
+          func(*args)
+    self.msg("FakeBackend: stopping timer-thread")
+
+  # --- start backend   -------------------------------------------------------
+
+  def create(self):
+    """ start timer-thread """
+
+    self._running = True
+    self._timer_thread = Thread(target=self._run_timers)
+    self._timer_thread.start()
+    self.vol_set(self._volume)
+
+  # --- stop backend   --------------------------------------------------------
+
+  def destroy(self):
+    """ stop timer-thread """
+
+    with self._timer_cond:
+      self._running = False
+      self._timer_cond.notify()
+
+  # --- active-state   --------------------------------------------------------
+
+  def is_active(self):
+    """ return active (running) state """
+
+    return self._running
+
+  # --- current position   ----------------------------------------------------
+
+  def _position(self):
+    """ return elapsed fake seconds """
+
+    if self._pause:
+      return self._pause_time - self._start_time
+    elif self._play:
+      return self._now() - self._start_time
+    else:
+      return 0
+
+  # --- timed events   --------------------------------------------------------
+
+  def _on_eof(self):
+    """ end of file reached """
+
+    self._api._push_event({'type': 'eof',
+                           'value': {'name': self._url, 'last': self._last}})
+    self._generation += 1
+    self._play  = False
+    self._pause = False
+    self._url   = None
+    if self._playlist:
+      self._start(*self._playlist.popleft())   # next file without a gap
+
+  def _on_icy_meta(self,nr):
+    """ new title of stream """
+
+    self._api._push_event({'type': 'icy_meta',
+                           'value': "Artist %d - Title %d" % (nr,nr)})
+    self._schedule(self._icy_interval,self._on_icy_meta,nr+1)
+
+  def _push_position(self):
+    """ publish current position """
+
+    if self._tracks_position() and self._url:
+      self._api._push_event({'type': 'position',
+                             'value': {'elapsed': round(self._position(),1),
+                                       'total':   self._duration,
+                                       'pause':   self._pause}})
+
+  def _tracks_position(self):
+    """ return True if position-events are published """
+
+    return self._position_interval > 0 and self._tracking
+
+  def _needs_ticks(self):
+    """ return True if frame-ticks are needed """
+
+    return self._tracks_position() or bool(self._frame_listeners)
+
+  def _on_frame_tick(self):
+    """ publish position and call frame-listeners """
+
+    if not self._needs_ticks():
+      return
+    if not self._pause:
+      secs  = self._position()
+      total = self._duration or secs
+      frame = int(secs*FakeBackend.FRAME_RATE)
+      self._push_position()
+      for func in list(self._frame_listeners):
+        func(frame,max(0,int(total*FakeBackend.FRAME_RATE)-frame),
+             secs,max(0.0,total-secs))
+    self._schedule((self._position_interval or 0.1)*self._speed,
+                   self._on_frame_tick)
+
+  def _enable_frame_info(self,enable):
+    """ start calling frame-listeners (they stop without listeners) """
+
+    if enable and self._play and not self._tracks_position():
+      self._schedule(0,self._on_frame_tick)
+
+  def _enable_position(self,enable):
+    """ start frame-ticks for position-events (they stop if not needed) """
+
+    if (enable and self._play and self._position_interval > 0 and
+        not self._frame_listeners):
+      self._schedule(0,self._on_frame_tick)
+
+  # --- play URL/file   -------------------------------------------------------
+
+  def play(self,url,last=True):
+    """ start playing, return True if a new file/url is started """
+
+    if not self._running:
+      return False
+    with self._lock:
+      check_url = url if url.startswith("http") else os.path.basename(url)
+      if self._play and check_url == self._url:   # already playing
+        self._push_position()
+        return False
+      self._playlist.clear()
+      if self._play:
+        self._last = False
+        self._on_eof()
+      self._generation += 1
+
+    # simulate connection-setup or loading of file
+    delay = self._connect_time if url.startswith("http") else self._load_time
+    time.sleep(delay/self._speed)
+
+    with self._lock:
+      self._start(url,last)
+    return True
+
+  # --- start url/file (called with lock held)   ------------------------------
+
+  def _start(self,url,last):
+    """ start playing url or file """
+
+    self.msg("FakeBackend: starting to play %s" % url)
+    self._url   = url if url.startswith("http") else os.path.basename(url)
+    self._last  = last
+    self._play  = True
+    self._pause = False
+    self._start_time = self._now()
+    self._api._push_event({'type': 'play', 'value': self._url})
+    if url.startswith("http"):
+      self._duration = 0
+      self._api._push_event({'type': 'icy_name', 'value': 'Fake Radio'})
+      self._on_icy_meta(1)
+    else:
+      self._duration = self._file_duration
+      self._schedule(self._duration,self._on_eof)
+    if self._needs_ticks():
+      self._schedule(0,self._on_frame_tick)
+
+  # --- queue files   ---------------------------------------------------------
+
+  def enqueue(self,files):
+    """ play files after the current file """
+
+    with self._lock:
+      self._playlist.clear()
+      for index,path in enumerate(files):
+        self._playlist.append((path,index == len(files)-1))
+      if files:
+        self._last = False
+        if not self._play and not self._pause:
+          self._start(*self._playlist.popleft())
+
+  # --- stop playing current URL/file   ---------------------------------------
+
+  def stop(self,last=True):
+    """ stop playing """
+
+    with self._lock:
+      self._playlist.clear()
+      if not self._play:
+        return
+      self.msg("FakeBackend: stopping current url/file: %s" % self._url)
+      self._last = last
+      self._on_eof()
+
+  # --- pause playing   -------------------------------------------------------
+
+  def pause(self):
+    """ pause playing """
+
+    with self._lock:
+      if not self._url or self._pause:
+        return
+      self._pause      = True
+      self._pause_time = self._now()
+      self._generation += 1                 # cancel eof and icy-timers
+      self._api._push_event({'type': 'pause', 'value': self._url})
+      self._push_position()
+
+  # --- continue playing   ----------------------------------------------------
+
+  def resume(self):
+    """ continue playing """
+
+    with self._lock:
+      if not self._pause:
+        return
+      self._start_time += self._now() - self._pause_time
+      self._pause  = False
+      self._api._push_event({'type': 'play', 'value': self._url})
+      if self._duration:
+        self._schedule(self._duration-self._position(),self._on_eof)
+      else:
+        self._schedule(self._icy_interval,self._on_icy_meta,1)
+      if self._needs_ticks():
+        self._schedule(0,self._on_frame_tick)
+
+  # --- toggle playing   ------------------------------------------------------
+
+  def toggle(self):
+    """ toggle playing """
+
+    with self._lock:
+      if not self._play:
+        return
+      if self._pause:
+        self.resume()
+      else:
+        self.pause()
+
+  # --- set volume   ---------------------------------------------------------
+
+  def _set_volume(self,val):
+    """ set volume (nothing to do) """
+
+    return self._running
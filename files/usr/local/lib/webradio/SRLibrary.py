@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class Library
+#
+# The class Library crawls all directories below the root-directory of the
+# player in the background and keeps the metadata of all files in the
+# MetaStore. Only new or changed files (size or mtime) are probed. Files
+# changed in place do not change the mtime of their directory, so every
+# crawl compares all files with the MetaStore (one query per directory).
+# Searching uses the full-text index of the MetaStore.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# -----------------------------------------------------------------------------
+
+import os, re, time, threading
+
+from webradio import Base
+
+class Library(Base):
+  """ index of all files below the root-directory """
+
+  START_DELAY = 10                          # first crawl after startup
+  MAX_RESULTS = 200
+
+  def __init__(self,app,meta,root_dir):
+    """ initialization """
+
+    self._app      = app
+    self.debug     = app.debug
+    self._meta     = meta
+    self._root_dir = root_dir
+    self.read_config()
+
+    self._metrics = app.metrics
+    self._metrics.gauge("webradio_library_files","number of indexed files")
+    self._metrics.gauge("webradio_library_crawl_seconds",
+                        "duration of the last crawl of the library")
+
+    if self._interval > 0 and self._meta.enabled():
+      threading.Thread(target=self._run,name="Library").start()
+
+  # --- read configuration   --------------------------------------------------
+
+  def read_config(self):
+    """ read configuration from config-file """
+
+    # section [PLAYER]
+    self._interval = 60*int(self.get_value(self._app.parser,"PLAYER",
+                                           "player_index_interval",60))
+
+  # --- crawler-thread   ------------------------------------------------------
+
+  def _run(self):
+    """ crawl library periodically """
+
+    delay = Library.START_DELAY
+    while not self._app.stop_event.wait(delay):
+      self.crawl()
+      delay = self._interval
+
+  # --- crawl library   -------------------------------------------------------
+
+  def crawl(self):
+    """ walk all directories below the root-directory (without hidden
+        directories and symbolic links to directories) and update the
+        metadata of new or changed files
+    """
+
+    if not os.path.isdir(self._root_dir):
+      self.msg("[WARNING] Library: %s does not exist" % self._root_dir,True)
+      return
+
+    start   = time.perf_counter()
+    known   = self._meta.get_dirs(self._root_dir)
+    visited = set()
+    stack   = [self._root_dir]
+    changed = 0
+    while stack:
+      if self._app.stop_event.is_set():
+        return
+      dir = stack.pop()
+      try:
+        mtime = os.stat(dir).st_mtime_ns
+        with os.scandir(dir) as entries:
+          entries = list(entries)
+      except OSError as ex:
+        self.msg("Library: cannot read %s: %s" % (dir,ex))
+        continue
+      visited.add(dir)
+      files = []                            # tuples (name,size,mtime)
+      for entry in entries:
+        try:
+          if entry.is_dir(follow_symlinks=False):
+            if not entry.name.startswith('.'):
+              stack.append(entry.path)
+          elif entry.name.endswith(".mp3") and entry.is_file():
+            st = entry.stat()
+            files.append((entry.name,st.st_size,st.st_mtime_ns))
+        except OSError:
+          pass
+      if known.get(dir) != mtime:
+        self._meta.get_dir(dir,files)
+        self._meta.set_dir(dir,mtime)
+        changed += 1
+      elif not self._meta.is_current(dir,files):
+        self._meta.get_dir(dir,files)       # file(s) changed in place
+        changed += 1
+
+    self._meta.remove_dirs([dir for dir in known if dir not in visited])
+    secs  = time.perf_counter()-start
+    count = self._meta.count_files(self._root_dir)
+    self._metrics.set("webradio_library_files",count)
+    self._metrics.set("webradio_library_crawl_seconds",secs)
+    self.msg("Library: %d files in %d directories (%d changed, %.1fs)" %
+             (count,len(visited),changed,secs))
+
+  # --- search library   -----------------------------------------------------
+
+  def search(self,q,limit):
+    """ return list of tuples (dir,name,metadata) of files matching all
+        words of q
+    """
+
+    tokens = re.findall(r"\w+",q.lower())
+    limit  = max(1,min(limit,Library.MAX_RESULTS))
+    return self._meta.search(tokens,self._root_dir,limit)
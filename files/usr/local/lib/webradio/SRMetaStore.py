@@ -0,0 +1,405 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class MetaStore
+#
+# The class MetaStore keeps metadata of media-files (duration and tags) in
+# an SQLite-database. Entries are keyed by directory and name and are only
+# valid as long as size and mtime of the file are unchanged, so a directory
+# is read with a single query and only new or changed files are probed.
+#
+# Names, tags and the name of the directory are indexed in a contentless
+# FTS5-table (if supported by SQLite) for searching the library.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# -----------------------------------------------------------------------------
+
+import os, threading, sqlite3
+
+from webradio import Base, Mp3Info
+
+class MetaStore(Base):
+  """ persistent metadata-cache of media-files """
+
+  VERSION = 2                               # version of the schema
+
+  SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS files (
+      id       INTEGER PRIMARY KEY,
+      dir      TEXT NOT NULL,
+      name     TEXT NOT NULL,
+      size     INTEGER NOT NULL,
+      mtime    INTEGER NOT NULL,
+      duration REAL,
+      title    TEXT,
+      artist   TEXT,
+      album    TEXT,
+      UNIQUE (dir,name))""",
+    """CREATE TABLE IF NOT EXISTS dirs (
+      dir      TEXT PRIMARY KEY,
+      mtime    INTEGER NOT NULL
+    ) WITHOUT ROWID"""
+    ]
+
+  # last component of the directory (SQLite has no basename-function)
+  FOLDER = "replace({0}.dir,rtrim({0}.dir,replace({0}.dir,'/','')),'')"
+  FTS_COLUMNS = "name,title,artist,album,folder"
+  FTS_VALUES  = "{0}.name,{0}.title,{0}.artist,{0}.album," + FOLDER
+
+  FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE search USING fts5(%s,content='',prefix='2 3',
+         tokenize='unicode61 remove_diacritics 2')""" % FTS_COLUMNS,
+    """CREATE TRIGGER files_ai AFTER INSERT ON files BEGIN
+         INSERT INTO search(rowid,%s) VALUES (new.id,%s);
+       END""" % (FTS_COLUMNS,FTS_VALUES.format("new")),
+    """CREATE TRIGGER files_ad AFTER DELETE ON files BEGIN
+         INSERT INTO search(search,rowid,%s) VALUES ('delete',old.id,%s);
+       END""" % (FTS_COLUMNS,FTS_VALUES.format("old")),
+    """CREATE TRIGGER files_au AFTER UPDATE ON files BEGIN
+         INSERT INTO search(search,rowid,%s) VALUES ('delete',old.id,%s);
+         INSERT INTO search(rowid,%s) VALUES (new.id,%s);
+       END""" % (FTS_COLUMNS,FTS_VALUES.format("old"),
+                  FTS_COLUMNS,FTS_VALUES.format("new")),
+    """INSERT INTO search(rowid,%s) SELECT id,%s FROM files""" %
+      (FTS_COLUMNS,FTS_VALUES.format("files"))
+    ]
+
+  COLUMNS = "name,size,mtime,duration,title,artist,album"
+  RANK_MAX = 1000                 # only rank searches with fewer matches
+
+  def __init__(self,app):
+    """ initialization """
+
+    self._app     = app
+    self.debug    = app.debug
+    self._mp3info = Mp3Info(self.debug)
+    self._lock    = threading.Lock()
+    self._db      = None
+    self._fts     = False                   # full-text index available
+    self.read_config()
+    self._open()
+
+    self._metrics = app.metrics
+    self._metrics.counter("webradio_meta_lookups_total",
+                          "lookups of file-metadata by result")
+
+  # --- read configuration   --------------------------------------------------
+
+  def read_config(self):
+    """ read configuration from config-file """
+
+    # section [PLAYER]
+    self._db_file = self.get_value(self._app.parser,"PLAYER","player_meta_db",
+        os.path.expanduser(os.path.join("~",".cache","pi-webradio",
+                                        "metadata.db")))
+
+  # --- open database   -------------------------------------------------------
+
+  def _open(self):
+    """ open (and create) database """
+
+    if not self._db_file or self._db_file == "none":
+      return
+    try:
+      os.makedirs(os.path.dirname(self._db_file),exist_ok=True)
+      self._db = sqlite3.connect(self._db_file,check_same_thread=False)
+      self._db.execute("PRAGMA journal_mode=WAL")
+      self._db.execute("PRAGMA synchronous=NORMAL")
+      with self._db:
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != (
+                                                          MetaStore.VERSION):
+          # the database is only a cache: recreate it
+          for table in ['search','dirs','files']:
+            self._db.execute("DROP TABLE IF EXISTS %s" % table)
+          self._db.execute("PRAGMA user_version=%d" % MetaStore.VERSION)
+        for statement in MetaStore.SCHEMA:
+          self._db.execute(statement)
+    except (OSError,sqlite3.Error) as ex:
+      self.msg("[WARNING] MetaStore: cannot open %s (%s), cache disabled" %
+               (self._db_file,ex),True)
+      self._db = None
+      return
+    self._open_fts()
+
+  # --- create full-text index   ----------------------------------------------
+
+  def _open_fts(self):
+    """ create full-text index (if it does not exist) """
+
+    try:
+      with self._db:
+        if not self._db.execute(
+          "SELECT 1 FROM sqlite_master WHERE name='search'").fetchone():
+          for statement in MetaStore.FTS_SCHEMA:
+            self._db.execute(statement)
+      self._fts = True
+    except sqlite3.Error as ex:
+      self.msg("[WARNING] MetaStore: no full-text index (%s)" % ex,True)
+
+  # --- check database   ------------------------------------------------------
+
+  def enabled(self):
+    """ return True if the database is available """
+
+    return self._db is not None
+
+  # --- convert row to entry   ------------------------------------------------
+
+  def _entry(self,row):
+    """ convert row (without name, size and mtime) to metadata-dict """
+
+    entry = {'duration': row[0]}
+    for key,value in zip(['title','artist','album'],row[1:]):
+      if value is not None:
+        entry[key] = value
+    return entry
+
+  # --- query entries   ------------------------------------------------------
+
+  def _lookup(self,dir,name=None):
+    """ return dict name -> (size,mtime,metadata) of the directory (or only
+        of the given file)
+    """
+
+    if not self._db:
+      return {}
+    query = "SELECT %s FROM files WHERE dir=?" % MetaStore.COLUMNS
+    args  = (dir,)
+    if name:
+      query += " AND name=?"
+      args  += (name,)
+    with self._lock:
+      try:
+        rows = self._db.execute(query,args).fetchall()
+      except sqlite3.Error as ex:
+        self.msg("[WARNING] MetaStore: query failed: %s" % ex,True)
+        return {}
+    return {row[0]: (row[1],row[2],self._entry(row[3:])) for row in rows}
+
+  # --- probe file   ----------------------------------------------------------
+
+  def probe(self,path):
+    """ read metadata from the file (without cache) """
+
+    info = self._mp3info.get_info(path)
+    if not info:
+      return {'duration': None}
+    return info
+
+  # --- lookup metadata of directory   ----------------------------------------
+
+  def lookup_dir(self,dir,files,complete=True):
+    """ return list of cached metadata for files (tuples (name,size,mtime))
+        of the directory, with None for new or changed files. If the list
+        is complete, entries of removed files are deleted.
+    """
+
+    single = files[0][0] if not complete and len(files) == 1 else None
+    cached = self._lookup(dir,single)
+    result = []
+    for name, size, mtime in files:
+      entry = cached.pop(name,None)
+      if entry and entry[0] == size and entry[1] == mtime:
+        result.append(entry[2])
+      else:
+        result.append(None)
+    misses = result.count(None)
+    self._metrics.inc("webradio_meta_lookups_total",len(files)-misses,
+                      result="hit")
+    self._metrics.inc("webradio_meta_lookups_total",misses,result="miss")
+    if complete and cached:
+      self.update(dir,[],list(cached))
+    return result
+
+  # --- check entries of directory   -----------------------------------------
+
+  def is_current(self,dir,files):
+    """ return True if the entries of the directory match files (tuples
+        (name,size,mtime)), i.e. no file is new, changed or removed
+    """
+
+    if not self._db:
+      return True
+    with self._lock:
+      try:
+        rows = self._db.execute(
+          "SELECT name,size,mtime FROM files WHERE dir=?",(dir,)).fetchall()
+      except sqlite3.Error as ex:
+        self.msg("[WARNING] MetaStore: query failed: %s" % ex,True)
+        return True
+    return set(rows) == set(files)
+
+  # --- return metadata of directory   ----------------------------------------
+
+  def get_dir(self,dir,files,complete=True):
+    """ return list of metadata for files (tuples (name,size,mtime)) of the
+        directory. Only new or changed files are probed and saved.
+    """
+
+    result = self.lookup_dir(dir,files,complete)
+    update = []
+    for i, (name, size, mtime) in enumerate(files):
+      if result[i] is None:
+        result[i] = self.probe(os.path.join(dir,name))
+        update.append((name,size,mtime,result[i]))
+    self.update(dir,update)
+    return result
+
+  # --- return metadata of file   ---------------------------------------------
+
+  def get(self,path):
+    """ return metadata of a single file """
+
+    try:
+      st = os.stat(path)
+    except OSError:
+      return {'duration': None}
+    dir, name = os.path.split(path)
+    return self.get_dir(dir,[(name,st.st_size,st.st_mtime_ns)],False)[0]
+
+  # --- update entries   ------------------------------------------------------
+
+  def update(self,dir,entries,removed=[]):
+    """ save entries (tuples (name,size,mtime,metadata)) and delete the
+        entries of removed files
+    """
+
+    if not self._db or (not entries and not removed):
+      return
+    rows = [(dir,name,size,mtime,meta.get('duration'),meta.get('title'),
+             meta.get('artist'),meta.get('album'))
+            for name,size,mtime,meta in entries]
+    with self._lock:
+      try:
+        with self._db:                      # single transaction
+          # note: REPLACE would not fire the delete-trigger of the index
+          self._db.executemany(
+            """INSERT INTO files(dir,%s) VALUES (?,?,?,?,?,?,?,?)
+               ON CONFLICT(dir,name) DO UPDATE SET size=excluded.size,
+                 mtime=excluded.mtime,duration=excluded.duration,
+                 title=excluded.title,artist=excluded.artist,
+                 album=excluded.album""" % MetaStore.COLUMNS,rows)
+          self._db.executemany("DELETE FROM files WHERE dir=? AND name=?",
+                               [(dir,name) for name in removed])
+      except sqlite3.Error as ex:
+        self.msg("[WARNING] MetaStore: update failed: %s" % ex,True)
+
+  # --- directories of library   ---------------------------------------------
+
+  def _subtree(self,root):
+    """ return condition and arguments for dir within root """
+
+    prefix = os.path.join(root,"")          # with trailing separator
+    return ("(dir=? OR (dir>=? AND dir<?))",
+            (root,prefix,prefix[:-1]+chr(ord(os.path.sep)+1)))
+
+  def get_dirs(self,root):
+    """ return dict dir -> mtime of all indexed directories below root """
+
+    if not self._db:
+      return {}
+    cond, args = self._subtree(root)
+    with self._lock:
+      return dict(self._db.execute(
+        "SELECT dir,mtime FROM dirs WHERE " + cond,args).fetchall())
+
+  def set_dir(self,dir,mtime):
+    """ save mtime of an indexed directory """
+
+    if not self._db:
+      return
+    with self._lock:
+      try:
+        with self._db:
+          self._db.execute("INSERT OR REPLACE INTO dirs VALUES (?,?)",
+                           (dir,mtime))
+      except sqlite3.Error as ex:
+        self.msg("[WARNING] MetaStore: update failed: %s" % ex,True)
+
+  def remove_dirs(self,dirs):
+    """ delete directories and the entries of their files """
+
+    if not self._db or not dirs:
+      return
+    args = [(dir,) for dir in dirs]
+    with self._lock:
+      try:
+        with self._db:
+          self._db.executemany("DELETE FROM files WHERE dir=?",args)
+          self._db.executemany("DELETE FROM dirs WHERE dir=?",args)
+      except sqlite3.Error as ex:
+        self.msg("[WARNING] MetaStore: update failed: %s" % ex,True)
+
+  def count_files(self,root):
+    """ return number of files below root """
+
+    if not self._db:
+      return 0
+    cond, args = self._subtree(root)
+    with self._lock:
+      return self._db.execute("SELECT count(*) FROM files WHERE " + cond,
+                              args).fetchone()[0]
+
+  # --- search files   --------------------------------------------------------
+
+  def search(self,tokens,root,limit):
+    """ return list of tuples (dir,name,metadata) of files below root
+        matching all tokens (as prefix of a word of name, tags or name of
+        the directory). Ranking is expensive, so results are only ranked
+        if there are at most RANK_MAX matches.
+    """
+
+    if not self._db or not tokens:
+      return []
+    cond, args = self._subtree(root)
+    cond = cond.replace("dir","f.dir")
+    if self._fts:
+      query = " ".join(['"%s"*' % t.replace('"','""') for t in tokens])
+      sql   = ("""SELECT f.dir,f.name,f.duration,f.title,f.artist,f.album
+                   FROM search JOIN files f ON f.id=search.rowid
+                   WHERE search MATCH ? AND %s %%s LIMIT ?""" % cond)
+      args  = (query,)+args
+    else:
+      # without full-text index: substring-match of every token
+      match = " AND ".join(["(f.name||' '||ifnull(f.title,'')||' '||" +
+                            "ifnull(f.artist,'')||' '||ifnull(f.album,'')||" +
+                            "' '||f.dir) LIKE ? ESCAPE '\\'"]*len(tokens))
+      sql   = ("""SELECT f.dir,f.name,f.duration,f.title,f.artist,f.album
+                   FROM files f WHERE %s AND %s
+                   ORDER BY f.dir,f.name LIMIT ?""" % (match,cond))
+      like  = []
+      for t in tokens:
+        for c in "\\%_":                    # LIKE-wildcards match literally
+          t = t.replace(c,"\\"+c)
+        like.append("%"+t+"%")
+      args  = tuple(like)+args+(limit,)
+    with self._lock:
+      try:
+        if self._fts:
+          rows = self._db.execute(sql % "",
+                                  args+(MetaStore.RANK_MAX+1,)).fetchall()
+          if len(rows) <= MetaStore.RANK_MAX:
+            rows = self._db.execute(sql % "ORDER BY search.rank",
+                                    args+(limit,)).fetchall()
+          else:
+            rows = rows[:limit]
+        else:
+          rows = self._db.execute(sql,args).fetchall()
+      except sqlite3.Error as ex:
+        self.msg("[WARNING] MetaStore: search failed: %s" % ex,True)
+        return []
+    return [(row[0],row[1],self._entry(row[2:])) for row in rows]
+
+  # --- close database   ------------------------------------------------------
+
+  def close(self):
+    """ close database """
+
+    with self._lock:
+      if self._db:
+        self._db.close()
+        self._db = None
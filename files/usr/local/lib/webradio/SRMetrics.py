@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class Metrics
+#
+# The class Metrics collects counters, gauges and histograms and renders
+# them in the text-format of Prometheus. Updating a metric only costs a
+# dict-lookup under a lock, so metrics are always enabled.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# -----------------------------------------------------------------------------
+
+import threading, bisect, math
+
+from webradio import Base
+
+class Metrics(Base):
+  """ collect and render metrics """
+
+  # default buckets of histograms (seconds)
+  BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)
+
+  def __init__(self,app):
+    """ initialization """
+
+    self.debug       = app.debug
+    self._lock       = threading.Lock()
+    self._meta       = {}                   # name -> (type,help,buckets)
+    self._values     = {}                   # name -> {labels: value}
+    self._collectors = []
+
+  # --- declare metrics   ----------------------------------------------------
+
+  def _declare(self,name,type,help,buckets=None):
+    """ declare a metric (declaring it again is a no-op) """
+
+    with self._lock:
+      if name not in self._meta:
+        self._meta[name]   = (type,help,buckets)
+        self._values[name] = {}
+
+  def counter(self,name,help):
+    """ declare a counter """
+    self._declare(name,'counter',help)
+
+  def gauge(self,name,help):
+    """ declare a gauge """
+    self._declare(name,'gauge',help)
+
+  def histogram(self,name,help,buckets=None):
+    """ declare a histogram """
+    self._declare(name,'histogram',help,buckets or Metrics.BUCKETS)
+
+  # --- update metrics   -----------------------------------------------------
+
+  def inc(self,name,value=1,**labels):
+    """ increment counter """
+
+    key = tuple(sorted(labels.items()))
+    with self._lock:
+      values = self._values[name]
+      values[key] = values.get(key,0) + value
+
+  def set(self,name,value,**labels):
+    """ set gauge """
+
+    key = tuple(sorted(labels.items()))
+    with self._lock:
+      self._values[name][key] = value
+
+  def observe(self,name,value,**labels):
+    """ add observation to histogram """
+
+    key     = tuple(sorted(labels.items()))
+    buckets = self._meta[name][2]
+    index   = bisect.bisect_left(buckets,value)
+    with self._lock:
+      values = self._values[name]
+      hist   = values.get(key)
+      if not hist:
+        hist = values[key] = [[0]*(len(buckets)+1),0.0]
+      hist[0][index] += 1
+      hist[1]        += value
+
+  def clear(self,name):
+    """ remove all values of a metric (e.g. of gauges for removed objects) """
+
+    with self._lock:
+      self._values[name].clear()
+
+  # --- add collector   ------------------------------------------------------
+
+  def add_collector(self,func):
+    """ add function called for every scrape. The function updates
+        metrics (e.g. gauges for queue-depths) using set()
+    """
+
+    self._collectors.append(func)
+
+  # --- render metrics   -----------------------------------------------------
+
+  def _format_labels(self,key,extra=None):
+    """ format labels """
+
+    labels = list(key) + ([extra] if extra else [])
+    if not labels:
+      return ""
+    return "{%s}" % ",".join(['%s="%s"' % (k,str(v).replace('\\','\\\\')
+                                             .replace('"','\\"')
+                                             .replace('\n','\\n'))
+                              for k,v in labels])
+
+  def _format_value(self,value):
+    """ format value """
+
+    if isinstance(value,float) and math.isinf(value):
+      return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value,float) else str(value)
+
+  def render(self):
+    """ return all metrics in the text-format of Prometheus """
+
+    for func in self._collectors:
+      try:
+        func()
+      except Exception as ex:
+        self.msg("Metrics: collector failed: %s" % ex)
+
+    with self._lock:
+      snapshot = [(name,self._meta[name],
+                   {k: [list(v[0]),v[1]] if isinstance(v,list) else v
+                    for k,v in self._values[name].items()})
+                  for name in sorted(self._meta.keys())]
+
+    lines = []
+    for name,(type,help,buckets),values in snapshot:
+      lines.append("# HELP %s %s" % (name,help))
+      lines.append("# TYPE %s %s" % (name,type))
+      for key in sorted(values.keys()):
+        value = values[key]
+        if type != 'histogram':
+          lines.append("%s%s %s" % (name,self._format_labels(key),
+                                    self._format_value(value)))
+          continue
+        counts, total = value
+        cumulative = 0
+        for bound,count in zip(list(buckets)+[float('inf')],counts):
+          cumulative += count
+          lines.append("%s_bucket%s %d" %
+                       (name,self._format_labels(
+                         key,('le',self._format_value(float(bound)))),
+                        cumulative))
+        lines.append("%s_sum%s %s" % (name,self._format_labels(key),
+                                      repr(total)))
+        lines.append("%s_count%s %d" % (name,self._format_labels(key),
+                                        cumulative))
+    return "\n".join(lines)+"\n"
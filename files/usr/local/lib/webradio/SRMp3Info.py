@@ -0,0 +1,385 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class Mp3Info
+#
+# The class Mp3Info reads information directly from mp3-files: the
+# embedded cover, the duration (from a Xing/Info- or VBRI-header, or
+# computed from the bitrate of the first frame for CBR-files) and the
+# tags title, artist and album. Only the first few KB of a file are read.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# -----------------------------------------------------------------------------
+
+import os, struct, threading
+
+from webradio import Base
+
+class Mp3Info(Base):
+  """ read information from mp3-files """
+
+  PIC_FRONT = 3                             # picture-type of front-cover
+  BUF_SIZE  = 8192                          # bytes read to find first frame
+  MAX_READS = 4                             # give up after this many reads
+
+  # bitrates (kbit/s) for (mpeg1,layer) and sample-rates for version
+  BITRATES = {
+    (True,1):  (0,32,64,96,128,160,192,224,256,288,320,352,384,416,448),
+    (True,2):  (0,32,48,56,64,80,96,112,128,160,192,224,256,320,384),
+    (True,3):  (0,32,40,48,56,64,80,96,112,128,160,192,224,256,320),
+    (False,1): (0,32,48,56,64,80,96,112,128,144,160,176,192,224,256),
+    (False,2): (0,8,16,24,32,40,48,56,64,80,96,112,128,144,160),
+    (False,3): (0,8,16,24,32,40,48,56,64,80,96,112,128,144,160)
+    }
+  SAMPLE_RATES = {3: (44100,48000,32000),   # MPEG1
+                  2: (22050,24000,16000),   # MPEG2
+                  0: (11025,12000,8000)}    # MPEG2.5
+
+  # text-frames of tags (ID3v2.2 and ID3v2.3/4)
+  TAG_FRAMES = {b'TT2': 'title', b'TP1': 'artist', b'TAL': 'album',
+                b'TIT2': 'title', b'TPE1': 'artist', b'TALB': 'album'}
+  TEXT_ENCODINGS = ['latin-1','utf-16','utf-16-be','utf-8']
+
+  def __init__(self,debug=False):
+    """ initialization """
+
+    self.debug  = debug
+    self._local = threading.local()         # read-buffer per thread
+
+  # --- return read-buffer of current thread   -------------------------------
+
+  def _buffer(self):
+    """ return (reused) buffer of the current thread """
+
+    try:
+      return self._local.buf
+    except AttributeError:
+      self._local.buf = bytearray(Mp3Info.BUF_SIZE)
+      return self._local.buf
+
+  # --- decode syncsafe integer   --------------------------------------------
+
+  def _syncsafe(self,data):
+    """ decode 4-byte syncsafe integer """
+
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+  # --- read ID3v2-tag   -----------------------------------------------------
+
+  def _read_id3(self,f):
+    """ read ID3v2-tag, return tuple (version,data) or (None,None) """
+
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+      return (None,None)
+    version = header[3]
+    flags   = header[5]
+    data    = f.read(self._syncsafe(header[6:10]))
+
+    if version < 4 and flags & 0x80:
+      # tag-level unsynchronisation (v2.4 uses frame-level)
+      data = data.replace(b'\xff\x00',b'\xff')
+    if version == 3 and flags & 0x40:
+      # skip extended header
+      data = data[4+struct.unpack(">I",data[:4])[0]:]
+    elif version == 4 and flags & 0x40:
+      data = data[self._syncsafe(data[:4]):]
+    return (version,data)
+
+  # --- iterate over frames of ID3v2-tag   -----------------------------------
+
+  def _frames(self,version,data):
+    """ yield tuples (frame-id,frame-flags,frame-data) of complete frames """
+
+    pos = 0
+    if version == 2:
+      while pos+6 <= len(data) and data[pos] != 0:
+        size = int.from_bytes(data[pos+3:pos+6],'big')
+        if pos+6+size > len(data):
+          break
+        yield (data[pos:pos+3],0,data[pos+6:pos+6+size])
+        pos += 6+size
+    else:
+      while pos+10 <= len(data) and data[pos] != 0:
+        if version == 4:
+          size = self._syncsafe(data[pos+4:pos+8])
+        else:
+          size = struct.unpack(">I",data[pos+4:pos+8])[0]
+        flags = struct.unpack(">H",data[pos+8:pos+10])[0]
+        if pos+10+size > len(data):
+          break
+        yield (data[pos:pos+4],flags,data[pos+10:pos+10+size])
+        pos += 10+size
+
+  # --- split terminated string   --------------------------------------------
+
+  def _split_string(self,data,encoding):
+    """ return remaining data after a terminated string """
+
+    if encoding in [1,2]:
+      # UTF-16: two null-bytes, aligned
+      for i in range(0,len(data)-1,2):
+        if data[i:i+2] == b'\x00\x00':
+          return data[i+2:]
+      return b''
+    else:
+      i = data.find(b'\x00')
+      return data[i+1:] if i >= 0 else b''
+
+  # --- parse picture-frame   ------------------------------------------------
+
+  def _parse_picture(self,version,flags,frame):
+    """ parse APIC/PIC-frame, return tuple (type,mime,data) """
+
+    if version == 4 and flags & 0x0002:
+      # frame-level unsynchronisation
+      frame = frame.replace(b'\xff\x00',b'\xff')
+    if version == 4 and flags & 0x0001:
+      frame = frame[4:]                    # data-length indicator
+
+    encoding = frame[0]
+    if version == 2:
+      fmt  = frame[1:4].decode('latin-1').lower()
+      mime = 'image/png' if fmt == 'png' else 'image/jpeg'
+      rest = frame[4:]
+    else:
+      i    = frame.find(b'\x00',1)
+      mime = frame[1:i].decode('latin-1').lower() or 'image/jpeg'
+      if '/' not in mime:
+        mime = 'image/'+mime                # some taggers only write 'jpg'
+      if mime == 'image/jpg':
+        mime = 'image/jpeg'
+      rest = frame[i+1:]
+    ptype = rest[0]
+    data  = self._split_string(rest[1:],encoding)
+    return (ptype,mime,data)
+
+  # --- return embedded picture   --------------------------------------------
+
+  def get_picture(self,path):
+    """ return embedded cover as tuple (mime,data) or None """
+
+    try:
+      with open(path,"rb") as f:
+        version, data = self._read_id3(f)
+    except OSError:
+      return None
+    if not version or version < 2 or version > 4:
+      return None
+
+    picture = None
+    pic_id  = b'PIC' if version == 2 else b'APIC'
+    for frame_id, flags, frame in self._frames(version,data):
+      if frame_id != pic_id or len(frame) < 4:
+        continue
+      try:
+        ptype, mime, img = self._parse_picture(version,flags,frame)
+      except (IndexError,UnicodeDecodeError):
+        continue
+      if not img:
+        continue
+      if ptype == Mp3Info.PIC_FRONT:
+        return (mime,img)
+      elif not picture:
+        picture = (mime,img)
+    return picture
+
+  # --- parse frame-header   -------------------------------------------------
+
+  def _parse_header(self,buf,pos):
+    """ parse frame-header at pos, return tuple
+        (version,layer,bitrate,sample_rate,frame_length,samples,mono)
+        or None if there is no valid header
+    """
+
+    h = int.from_bytes(buf[pos:pos+4],'big')
+    if h >> 21 != 0x7FF:
+      return None
+    version = (h >> 19) & 3                 # 3: MPEG1, 2: MPEG2, 0: MPEG2.5
+    layer   = 4 - ((h >> 17) & 3)           # 1, 2 or 3 (4: reserved)
+    br_idx  = (h >> 12) & 15
+    sr_idx  = (h >> 10) & 3
+    if version == 1 or layer == 4 or br_idx in [0,15] or sr_idx == 3:
+      return None
+
+    mpeg1   = version == 3
+    bitrate = Mp3Info.BITRATES[(mpeg1,layer)][br_idx]*1000
+    rate    = Mp3Info.SAMPLE_RATES[version][sr_idx]
+    padding = (h >> 9) & 1
+    mono    = (h >> 6) & 3 == 3
+    if layer == 1:
+      samples = 384
+      length  = (12*bitrate//rate + padding)*4
+    elif layer == 2 or mpeg1:
+      samples = 1152
+      length  = 144*bitrate//rate + padding
+    else:
+      samples = 576
+      length  = 72*bitrate//rate + padding
+    return (version,layer,bitrate,rate,length,samples,mono)
+
+  # --- find first frame   ---------------------------------------------------
+
+  def _find_frame(self,buf,start,size):
+    """ return (pos,header) of the first frame in buf or (-1,None) """
+
+    pos = buf.find(b'\xff',start,size-3)
+    while pos >= 0:
+      header = self._parse_header(buf,pos)
+      if header:
+        # check next frame to skip false sync-words (if it is in the buffer)
+        nxt = pos + header[4]
+        if nxt+4 > size:
+          return (pos,header)
+        next_header = self._parse_header(buf,nxt)
+        if next_header and next_header[0] == header[0] and (
+            next_header[1] == header[1] and next_header[3] == header[3]):
+          return (pos,header)
+      pos = buf.find(b'\xff',pos+1,size-3)
+    return (-1,None)
+
+  # --- return number of frames from VBR-header   ----------------------------
+
+  def _vbr_frames(self,buf,size,pos,header):
+    """ return number of frames from Xing/Info- or VBRI-header or None """
+
+    version, layer, _, _, _, _, mono = header
+    if layer != 3:
+      return None
+
+    # Xing/Info-header: after the side-information of the first frame
+    if version == 3:
+      offset = pos + 4 + (17 if mono else 32)
+    else:
+      offset = pos + 4 + (9 if mono else 17)
+    if offset+12 <= size and buf[offset:offset+4] in [b'Xing',b'Info']:
+      flags = int.from_bytes(buf[offset+4:offset+8],'big')
+      if flags & 0x1:
+        return int.from_bytes(buf[offset+8:offset+12],'big')
+      return None
+
+    # VBRI-header (Fraunhofer): fixed offset of 32 bytes after the header
+    offset = pos + 36
+    if offset+18 <= size and buf[offset:offset+4] == b'VBRI':
+      return int.from_bytes(buf[offset+14:offset+18],'big')
+    return None
+
+  # --- parse text-frames of ID3v2-tag in buffer   ---------------------------
+
+  def _parse_tags(self,buf,size,info):
+    """ parse title, artist and album of the ID3v2-tag at the start of the
+        buffer (frames beyond the buffer are ignored)
+    """
+
+    version = buf[3]
+    if version < 2 or version > 4:
+      return
+    end  = min(size,10+self._syncsafe(buf[6:10]))
+    data = bytes(buf[10:end])
+    if version == 3 and buf[5] & 0x40:
+      data = data[4+struct.unpack(">I",data[:4])[0]:]
+    elif version == 4 and buf[5] & 0x40:
+      data = data[self._syncsafe(data[:4]):]
+    for frame_id, flags, frame in self._frames(version,data):
+      key = Mp3Info.TAG_FRAMES.get(frame_id)
+      if not key or len(frame) < 2 or frame[0] > 3:
+        continue
+      info[key] = frame[1:].decode(Mp3Info.TEXT_ENCODINGS[frame[0]],
+                                   'replace').split('\x00')[0].strip()
+
+  # --- parse ID3v1-tag   ----------------------------------------------------
+
+  def _parse_id3v1(self,tag,info):
+    """ parse title, artist and album of an ID3v1-tag """
+
+    for key,start in [('title',3),('artist',33),('album',63)]:
+      if key not in info:
+        value = tag[start:start+30].split(b'\x00')[0]
+        value = value.decode('latin-1').strip()
+        if value:
+          info[key] = value
+
+  # --- return duration   ----------------------------------------------------
+
+  def get_duration(self,path):
+    """ return duration in seconds (float) or None """
+
+    info = self._read_info(path,False)
+    return info['duration'] if info else None
+
+  # --- return duration and tags   -------------------------------------------
+
+  def get_info(self,path):
+    """ return dict with duration (seconds) and tags (title, artist, album;
+        only if present) or None
+    """
+
+    return self._read_info(path,True)
+
+  # --- read duration and optionally tags   ----------------------------------
+
+  def _read_info(self,path,tags):
+    """ read duration and optionally tags, return dict or None """
+
+    info = {}
+    buf  = self._buffer()
+    try:
+      with open(path,"rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        size  = f.readinto(buf)
+        base  = 0                           # file-offset of buffer
+        first = 0                           # start of audio-data in buffer
+
+        # skip ID3v2-tag (re-read the buffer if the tag is larger)
+        if size >= 10 and buf[:3] == b'ID3':
+          if tags:
+            try:
+              self._parse_tags(buf,size,info)
+            except (IndexError,struct.error,LookupError):
+              pass
+          first = 10 + self._syncsafe(buf[6:10])
+          if buf[5] & 0x10:
+            first += 10                     # footer
+          if first+4 > size:
+            f.seek(first)
+            base, first = first, 0
+            size = f.readinto(buf)
+
+        # search first frame (continue after e.g. padding of the tag)
+        for i in range(Mp3Info.MAX_READS):
+          pos, header = self._find_frame(buf,first,size)
+          if header or size < len(buf):
+            break
+          base += size-3                    # header might span the boundary
+          f.seek(base)
+          first = 0
+          size  = f.readinto(buf)
+        if not header:
+          return None
+        _, _, bitrate, rate, _, samples, _ = header
+
+        frames = self._vbr_frames(buf,size,pos,header)
+        if frames:
+          info['duration'] = frames*samples/rate
+        if frames and (not tags or len(info) == 4):
+          return info
+
+        # CBR: audio-data (without ID3v1-tag) divided by bitrate
+        audio_end = file_size
+        if file_size >= 128:
+          f.seek(-128,os.SEEK_END)
+          tag = f.read(128)
+          if tag[:3] == b'TAG':
+            audio_end -= 128
+            if tags:
+              self._parse_id3v1(tag,info)
+        if not frames:
+          info['duration'] = max(0,audio_end-base-pos)*8/bitrate
+        return info
+    except OSError as ex:
+      self.msg("Mp3Info: cannot read %s: %s" % (path,ex))
+      return None
@@ -4,6 +4,11 @@
 # Pi-Webradio: implementation of class Mpg123
 #
 # The class Mpg123 encapsulates the mpg123-process for playing MP3s.
+# A second (standby) process preloads the next queued file paused, so
+# directory playback has no gaps. Optionally, it also preloads the likely
+# next channel muted, so switching to this channel is only a volume-swap.
+# The position of the active process is synchronized with sampled
+# frame-info (@F).
 #
 # Author: Bernhard Bablok
 # License: GPL3
@@ -15,328 +20,918 @@
 import threading, subprocess, signal, os, shlex, re, traceback
 from threading import Thread
 import queue, collections, time
+import concurrent.futures
 
-from webradio import Base
+from webradio import Base, Backend
 
-class Mpg123(Base):
-  """ mpg123 control-object """
+# --- a queued command   -------------------------------------------------------
 
-  def __init__(self,app):
+class Mpg123Command(object):
+  """ command for mpg123 with its expected response and a future """
+
+  def __init__(self,cmd,expect,attrs):
     """ initialization """
 
-    self._app       = app
-    self._api       = app.api
-    self.debug      = app.debug
+    self.cmd    = cmd
+    self.name   = cmd.split()[0]
+    self.expect = expect                    # tuple of response-prefixes
+    self.attrs  = attrs                     # state applied with the response
+    self.future = concurrent.futures.Future()
+    self.start  = time.perf_counter()
+
+# --- a single mpg123-process   ------------------------------------------------
+
+class Mpg123Process(Base):
+  """ mpg123-process with command-queue and reader-thread """
+
+  # expected responses of commands (commands not listed have no response)
+  RESPONSES = {
+    'LOAD':       (b'@P 2',b'@E'),
+    'LOADLIST':   (b'@P 2',b'@E'),
+    'LOADPAUSED': (b'@P 1',b'@E'),
+    'STOP':       (b'@P 0',),
+    'PAUSE':      (b'@P 1',b'@P 2'),
+    'SAMPLE':     (b'@SAMPLE',)
+    }
+  RESPONSE_KEYS = frozenset([b'@P',b'@SAMPLE',b'@E'])
+  FRAME_RATE    = 38.28                     # @F-lines per second (44.1kHz)
+
+  # ICY-META: @I ICY-META: StreamTitle='artist - title';
+  ICY_TITLE = re.compile(rb"'(.*?)';")
+
+  def __init__(self,app,nr,opts,cmd_timeout,load_timeout,listeners,
+               frame_interval):
+    """ initialization """
+
+    self.debug        = app.debug
+    self._metrics     = app.metrics
+    self._nr          = nr
+    self._opts        = opts
+    self._cmd_timeout = cmd_timeout
+    self._load_timeout = load_timeout       # LOAD of an URL (connect)
+    self._listeners   = listeners           # shared list of frame-listeners
+    self._frame_skip  = max(0,int(frame_interval*Mpg123Process.FRAME_RATE)-1)
+                                            # @F-lines between samples
+    self.track        = False               # publish position-events
+    self.on_event     = None                # events are dropped if None
+    self.on_failure   = None                # called with (self,generation,reason)
+    self.on_next      = None                # called with self at end of track
+    self.info         = {}                  # last icy-events of the stream
+                                            # (and tags of a preloaded file)
+    self.playlist     = collections.deque() # (path,last) of queued files
+    self.failures     = 0                   # number of consecutive failures
+    self.started      = 0                   # time of last start
+
     self._process   = None
-    self._op_event  = threading.Event()
-    self._play      = False
-    self._pause     = False
-    self._volume    = -1
-    self._mute      = False
-    self._url       = None
+    self._cmd_queue = None
+    self._pending   = collections.deque()     # commands waiting for response
+    self._pending_lock = threading.Lock()
+    self._down      = True                    # no process, or process died
+    self._quit      = False                   # process is stopped on purpose
+    self._generation = 0                      # incremented for every start
+    self._reset()
+
+    # dispatch-table for the reader-thread: message-type -> handler
+    self._handlers = {
+      b'@I':      self._on_info,
+      b'@P':      self._on_status,
+      b'@S':      self._on_stream,
+      b'@SAMPLE': self._on_sample,
+      b'@E':      self._on_error,
+      b'@F':      self._on_frame
+      }
 
-    self.read_config()
-    self.register_apis()
+  # --- reset playback-state   --------------------------------------------------
 
-  # --- read configuration   --------------------------------------------------
+  def _reset(self):
+    """ reset playback-state """
 
-  def read_config(self):
-    """ read configuration from config-file """
+    self._play        = False
+    self._pause       = False
+    self._url         = None                # url or basename of file
+    self._path        = None                # url or complete path of file
+    self._last        = True
+    self._zap_start   = None
+    self._clock_start = 0                   # now-_clock_start is the position
+    self._clock_pause = 0                   # start of pause
+    self._clock_offset = 0                  # start-position of next LOAD
+    self._total       = 0                   # total seconds of file (0: url)
 
-    # section [MPG123]
-    self._vol_default = int(self.get_value(self._app.parser,"MPG123",
-                                       "vol_default",30))
-    self._volume      = self._vol_default
-    self._vol_delta   = int(self.get_value(self._app.parser,"MPG123",
-                                       "vol_delta",5))
-    self._mpg123_opts = self.get_value(self._app.parser,"MPG123",
-                                       "mpg123_opts","")
+  # --- active-state (return true if running)   --------------------------------
 
-  # --- register APIs   ------------------------------------------------------
+  def is_active(self):
+    """ return active (running) state """
 
-  def register_apis(self):
-    """ register API-functions """
+    return self._process is not None and self._process.poll() is None
 
-    self._api.vol_up          = self.vol_up
-    self._api.vol_down        = self.vol_down
-    self._api.vol_set         = self.vol_set
-    self._api.vol_mute_on     = self.vol_mute_on
-    self._api.vol_mute_off    = self.vol_mute_off
-    self._api.vol_mute_toggle = self.vol_mute_toggle
+  # --- create process in the background in remote-mode   ---------------------
 
-  # --- return persistent state of this class   -------------------------------
+  def create(self):
+    """ spawn new mpg123 process """
 
-  def get_persistent_state(self):
-    """ return persistent state (overrides SRBase.get_pesistent_state()) """
-    return {
-      'volume': self._volume if not self._mute else self._vol_old
-      }
+    args = ["mpg123","-R"]
+    opts = shlex.split(self._opts)
+    args += opts
+
+    self.msg("Mpg123(%d): starting mpg123 with args %r" % (self._nr,args))
+    self._generation += 1
+    self._quit        = False
+    self.started      = time.monotonic()
+    self._reset()
+    # start process with binary pipes (the reader decodes only what it needs)
+    self._process = subprocess.Popen(args,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT)
+    self._down          = False
+    self._cmd_queue     = queue.Queue()
+    self._writer_thread = Thread(target=self._process_stdin,
+                                 args=(self._process,self._cmd_queue))
+    self._writer_thread.start()
+    self._reader_thread = Thread(target=self._process_stdout)
+    self._reader_thread.start()
+    if not self.needs_frames():
+      self.send("SILENCE")                  # no @F-lines unless needed
+
+  # --- check if frame-info is needed   -----------------------------------------
+
+  def needs_frames(self):
+    """ return True if the process should send @F-lines """
+
+    return self.track or bool(self._listeners)
+
+  # --- stop process   ---------------------------------------------------------
+
+  def destroy(self):
+    """ stop mpg123-process """
+
+    if self._process:
+      self.msg("Mpg123(%d): stopping mpg123 ..." % self._nr)
+      self._quit = True
+      try:
+        self.send("QUIT")
+        self._process.wait(5)
+        self.msg("Mpg123(%d): ... done" % self._nr)
+      except:
+        # can't do anything about it
+        self.msg("Mpg123(%d): ... exception during destroy of mpg123" %
+                 self._nr)
+        pass
+
+  # --- kill process   ---------------------------------------------------------
+
+  def kill(self):
+    """ kill (stalled) process and wait for the reader-thread """
+
+    self._down = True
+    try:
+      self._process.kill()
+      self._process.wait(5)
+    except:
+      pass
+    self._reader_thread.join(5)
+
+  # --- report failure   -------------------------------------------------------
+
+  def _report(self,reason):
+    """ report failure (exit or stall) to the supervisor """
+
+    if self.on_failure and not self._quit:
+      self.on_failure(self,self._generation,reason)
 
-  # --- restore persistent state of this class   ------------------------------
+  # --- publish position   -----------------------------------------------------
 
-  def set_persistent_state(self,state_map):
-    """ restore persistent state (overrides SRBase.set_pesistent_state()) """
+  def _push_position(self):
+    """ publish current position (only if tracking is enabled) """
+
+    if self.track and self._url:
+      self._push_event({'type': 'position',
+                        'value': {'elapsed': round(self.position(),1),
+                                  'total':   round(self._total,1),
+                                  'pause':   self._pause}})
+
+  # --- current position   -----------------------------------------------------
+
+  def position(self):
+    """ return elapsed seconds of the current file/url """
+
+    if self._pause:
+      return self._clock_pause - self._clock_start
+    elif self._play:
+      return time.monotonic() - self._clock_start
+    else:
+      return 0
+
+  # --- queue command   ------------------------------------------------------
+
+  def send(self,cmd,attrs=None):
+    """ queue command for the writer-thread and return the command-object.
+        attrs are attributes of this object set by the reader-thread
+        when the response arrives (i.e. in order with previous commands)
+    """
+
+    command = Mpg123Command(cmd,
+                            Mpg123Process.RESPONSES.get(cmd.split()[0],()),
+                            attrs or {})
+    if self._down:
+      # fail fast while the supervisor restarts the process
+      command.future.set_exception(RuntimeError("mpg123 is not running"))
+    else:
+      self._cmd_queue.put(command)
+    return command
+
+  # --- wait for response of command   ---------------------------------------
+
+  def wait(self,command):
+    """ wait for the response, return response-line or None on errors """
+
+    # loading an URL includes connecting to the server
+    timeout = self._cmd_timeout
+    verb, _, arg = command.cmd.partition(" ")
+    if verb in ['LOAD','LOADLIST'] and arg.startswith("http"):
+      timeout = max(timeout,self._load_timeout)
+    try:
+      return command.future.result(timeout)
+    except concurrent.futures.TimeoutError:
+      self.msg("[WARNING] Mpg123(%d): no response for command %s" %
+               (self._nr,command.cmd),True)
+      if not command.future.cancel():
+        self._flush(command)
+      self._report("stall")
+    except concurrent.futures.CancelledError:
+      pass
+    except Exception as ex:
+      self.msg("[WARNING] Mpg123(%d): command %s failed: %s" %
+               (self._nr,command.cmd,ex),True)
+    return None
+
+  # --- fail pending commands   -----------------------------------------------
+
+  def _flush(self,command=None):
+    """ fail pending commands up to and including the given command
+        (all pending commands if command is None). Since responses arrive
+        in order, the response of an older command is lost too.
+    """
+
+    with self._pending_lock:
+      if command and command not in self._pending:
+        return
+      while self._pending:
+        cmd = self._pending.popleft()
+        cmd.future.set_exception(
+          concurrent.futures.TimeoutError("no response for %s" % cmd.cmd))
+        if cmd is command:
+          break
+
+  # --- match response and pending command   ----------------------------------
+
+  def _match(self,line):
+    """ return oldest pending command expecting this line (or None) """
+
+    with self._pending_lock:
+      if self._pending and line.startswith(self._pending[0].expect):
+        command = self._pending.popleft()
+      else:
+        return None
+    for key,value in command.attrs.items():
+      setattr(self,key,value)
+    return command
+
+  # --- complete command   ----------------------------------------------------
+
+  def _complete(self,command,line):
+    """ complete command after the response was processed """
+
+    if not command:
+      return
+    self._metrics.observe("webradio_backend_command_seconds",
+                          time.perf_counter()-command.start,cmd=command.name)
+    command.future.set_result(line)
+
+  # --- write commands to mpg123   --------------------------------------------
+
+  def _process_stdin(self,process,cmd_queue):
+    """ single writer: send queued commands without waiting for responses """
+
+    self.msg("Mpg123(%d): starting mpg123 writer-thread" % self._nr)
+    while True:
+      command = cmd_queue.get()
+      if command is None:
+        break
+      if not command.future.set_running_or_notify_cancel():
+        continue                            # cancelled while queued
+      if command.expect:
+        with self._pending_lock:
+          self._pending.append(command)
+      try:
+        process.stdin.write((command.cmd+"\n").encode('utf-8'))
+        process.stdin.flush()
+      except Exception as ex:
+        with self._pending_lock:
+          if command in self._pending:
+            self._pending.remove(command)
+        command.future.set_exception(ex)
+        continue
+      if not command.expect:
+        for key,value in command.attrs.items():
+          setattr(self,key,value)
+        self._complete(command,None)
+    self.msg("Mpg123(%d): stopping mpg123 writer-thread" % self._nr)
+
+  # --- publish event   -------------------------------------------------------
+
+  def _push_event(self,event):
+    """ pass event to the listener (if this is the active process) """
+
+    on_event = self.on_event
+    if on_event:
+      on_event(event)
+
+  # --- handlers of mpg123-messages   ------------------------------------------
+
+  def _on_info(self,rest):
+    """ @I: stream- and tag-info """
+
+    if rest.startswith(b"ICY-META"):
+      match = Mpg123Process.ICY_TITLE.search(rest)
+      value = match.group(1) if match else rest
+      event = {'type': 'icy_meta', 'value': value.decode('utf-8','replace')}
+    elif rest.startswith(b"ICY-NAME"):
+      event = {'type': 'icy_name', 'value': rest[10:].decode('utf-8','replace')}
+    elif rest.startswith(b"ID3v2"):
+      tag, _, value = rest[6:].decode('utf-8','replace').partition(":")
+      event = {'type': 'id3', 'value': {'tag': tag, 'value': value}}
+      if not self.on_event:
+        self.info["id3:"+tag] = event       # preloaded: publish on switch
+      self._push_event(event)
+      return
+    else:
+      return
+    self.info[event['type']] = event
+    self._push_event(event)
+
+  def _on_status(self,rest):
+    """ @P: playback-status """
+
+    status = rest[:1]
+    if status == b"0":
+      # @P 0 is not reliable
+      if self._play:
+        self._push_event({'type': 'eof',
+                          'value': {'name': self._url,
+                                    'last': self._last}})
+        self._url   = None
+        self._pause = False
+        self._play  = False
+        if self.playlist:
+          if self.on_next:
+            self.on_next(self)              # backend switches to next file
+          else:
+            self._load_next()
+    elif status == b"1":
+      self._pause = True
+      self._clock_pause = time.monotonic()
+      self._push_event({'type': 'pause',
+                        'value': self._url})
+      self._push_position()
+    elif status == b"2":
+      if self._pause:
+        self._clock_start += time.monotonic() - self._clock_pause
+      else:
+        self._clock_start  = time.monotonic() - self._clock_offset
+        self._clock_offset = 0
+        self._total        = 0
+      self._play  = True
+      self._pause = False
+      self._push_event({'type': 'play',
+                        'value': self._url})
+      self._push_position()
+
+  def _load_next(self):
+    """ load next queued file (end of track, called by the reader) """
+
+    try:
+      path, last = self.playlist.popleft()
+    except IndexError:
+      return                                # cleared concurrently
+    self.msg("Mpg123(%d): loading queued file %s" % (self._nr,path))
+    self.send("LOAD %s" % path,
+              {'_last': last, '_url': os.path.basename(path), '_path': path,
+               '_pause': False, '_clock_offset': 0})
+
+  def _on_stream(self,rest):
+    """ @S: stream-info, i.e. the first frame is decoded """
+
+    if self._zap_start:
+      self._metrics.observe("webradio_zap_seconds",
+                            time.perf_counter()-self._zap_start,mode="cold")
+      self._zap_start = None
+
+  def _on_sample(self,rest):
+    """ @SAMPLE: current sample and total number of samples """
+
+    sample = rest.split()
+    self._push_event({'type': 'sample',
+                      'value': {'elapsed': int(sample[0])/int(sample[1]),
+                                'pause': self._pause}})
+
+  def _on_error(self,rest):
+    """ @E: error message """
+
+    self.msg("[WARNING] Mpg123(%d): %s" %
+             (self._nr,rest.decode('utf-8','replace')),True)
+
+  def _on_frame(self,rest):
+    """ @F: frame-info (sampled every frame_interval seconds) """
+
+    frame, frames_left, secs, secs_left = rest.split()
+    frame_info = (int(frame),int(frames_left),float(secs),float(secs_left))
+    if not self._pause:
+      # resynchronize clock (mpg123 knows the real position)
+      self._clock_start = time.monotonic() - frame_info[2]
+      if not self._path.startswith("http"):
+        self._total = frame_info[2] + frame_info[3]
+    self._push_position()
+    for func in self._listeners:
+      func(*frame_info)
+
+  # --- process output of mpg123   --------------------------------------------
+
+  def _process_stdout(self):
+    """ read mpg123-output and dispatch it to the handlers """
+
+    self.msg("Mpg123(%d): starting mpg123 reader-thread" % self._nr)
+    stdout    = self._process.stdout
+    handlers  = self._handlers
+    skip      = 0                           # @F-lines until the next sample
+    while True:
+      try:
+        line = stdout.readline()
+      except (OSError,ValueError):
+        break
+      if not line:
+        break
+      if line.startswith(b"@F"):
+        # frame-info is only sampled (mpg123 sends ~38 lines per second),
+        # counting lines is cheaper than reading the clock
+        if skip:
+          skip -= 1
+          continue
+        if not self.on_event or not self._path:
+          continue
+        skip = self._frame_skip
+      elif line.startswith(b"@P"):
+        skip = 0                            # new status: sample next @F-line
+      key, _, rest = line.rstrip(b"\r\n").partition(b" ")
+      handler = handlers.get(key)
+      if not handler:
+        continue
+      if self.debug and key != b'@F':
+        self.msg("Mpg123(%d): processing line: %r" % (self._nr,line))
+      command = (self._match(line) if key in Mpg123Process.RESPONSE_KEYS
+                 else None)
+      try:
+        handler(rest)
+      except (IndexError,ValueError,ZeroDivisionError) as ex:
+        self.msg("[WARNING] Mpg123(%d): cannot parse %r: %s" %
+                 (self._nr,line,ex),True)
+      self._complete(command,line)
+
+    self._down = True
+    self._flush()
+    self._cmd_queue.put(None)               # also stop writer-thread
+    self.msg("Mpg123(%d): stopping mpg123 reader-thread" % self._nr)
+    self._report("exit")
+
+# --- mpg123 control-object   --------------------------------------------------
+
+class Mpg123(Backend):
+  """ mpg123 control-object """
+
+  SECTION     = "MPG123"
+
+  BACKOFF     = [0,0.5,1,2,4,8,16,30]      # delays of consecutive restarts
+  STABLE_TIME = 60                          # reset backoff after this time
+
+  def __init__(self,app):
+    """ initialization """
 
-    self.msg("Mpg123: restoring persistent state")
-    if 'volume' in state_map:
-      self._volume = state_map['volume']
+    self._tasks     = queue.Queue()           # failed processes, next track
+    self._shutdown  = threading.Event()
+    super().__init__(app)
+    self._metrics.histogram("webradio_backend_command_seconds",
+                            "round-trip time of mpg123-commands")
+    self._metrics.histogram("webradio_zap_seconds",
+                            "time from play-request to first audio")
+    self._metrics.counter("webradio_backend_restarts_total",
+                          "restarts of mpg123-processes")
+
+    self._active = Mpg123Process(app,1,self._mpg123_opts,
+                                 self._cmd_timeout,self._load_timeout,
+                                 self._frame_listeners,
+                                 self._position_interval)
+    self._active.on_event = self._api._push_event
+    self._active.on_failure = self._on_failure
+    if self._use_standby:
+      self._standby = Mpg123Process(app,2,self._mpg123_opts,
+                                    self._cmd_timeout,self._load_timeout,
+                                    self._frame_listeners,
+                                    self._position_interval)
+      self._standby.track = False
+      self._standby.on_failure = self._on_failure
+      self._active.on_next  = self._on_next
+      self._standby.on_next = self._on_next
     else:
-      self._volume = self._vol_default
-    self.msg("Mpg123: volume is: %d" % self._volume)
+      self._standby = None
+
+  # --- read configuration   --------------------------------------------------
+
+  def read_config(self):
+    """ read configuration from config-file """
+
+    # section [MPG123]
+    super().read_config()
+    self._mpg123_opts = self.get_value(self._app.parser,"MPG123",
+                                       "mpg123_opts","")
+    self._cmd_timeout = float(self.get_value(self._app.parser,"MPG123",
+                                       "cmd_timeout",5))
+    self._load_timeout = float(self.get_value(self._app.parser,"MPG123",
+                                       "load_timeout",30))
+    standby = self.get_value(self._app.parser,"MPG123","standby","files")
+    self._use_standby   = standby in ["1","files"]
+    self._preload_radio = standby == "1"
 
   # --- active-state (return true if playing)   --------------------------------
 
   def is_active(self):
     """ return active (playing) state """
 
-    return self._process is not None and self._process.poll() is None
+    return self._active.is_active()
 
   # --- create player in the background in remote-mode   ----------------------
 
   def create(self):
-    """ spawn new mpg123 process """
-
-    args = ["mpg123","-R"]
-    opts = shlex.split(self._mpg123_opts)
-    args += opts
+    """ spawn new mpg123 process(es) """
 
-    self.msg("Mpg123: starting mpg123 with args %r" % (args,))
-    # start process with line-buffered stdin/stdout
-    self._process = subprocess.Popen(args,bufsize=1,
-                                     universal_newlines=True,
-                                     stdin=subprocess.PIPE,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.STDOUT,
-                                     errors='replace')
-    self._reader_thread = Thread(target=self._process_stdout)
-    self._reader_thread.start()
+    self._active.create()
     self.vol_set(self._volume)
+    if self._standby:
+      self._standby.create()
+      self._standby.send("VOLUME 0")
+    self._supervisor = Thread(target=self._supervise)
+    self._supervisor.start()
+
+  # --- failure of a process   ------------------------------------------------
+
+  def _on_failure(self,process,generation,reason):
+    """ called from the process (any thread) if it died or stalled """
+
+    self._tasks.put((process,generation,reason))
+
+  # --- end of track   ---------------------------------------------------------
+
+  def _on_next(self,process):
+    """ called from the reader-thread at the end of a track if files are
+        queued (only with a standby-process)
+    """
+
+    self._tasks.put((process,process._generation,"next"))
+
+  # --- supervisor-thread   ---------------------------------------------------
+
+  def _supervise(self):
+    """ restart failed processes and switch to the next queued file """
+
+    self.msg("Mpg123: starting supervisor-thread")
+    while True:
+      task = self._tasks.get()
+      if task is None or self._shutdown.is_set():
+        break
+      process, generation, reason = task
+      if generation != process._generation:
+        continue                            # already restarted
+      if reason == "next":
+        self._next_track(process)
+      else:
+        self._restart(process,reason)
+    self.msg("Mpg123: stopping supervisor-thread")
+
+  # --- restart process   -----------------------------------------------------
+
+  def _restart(self,process,reason):
+    """ restart process and restore its state """
+
+    if time.monotonic() - process.started > Mpg123.STABLE_TIME:
+      process.failures = 0
+    delay = Mpg123.BACKOFF[min(process.failures,len(Mpg123.BACKOFF)-1)]
+    process.failures += 1
+    self.msg("[WARNING] Mpg123(%d): process %s, restarting in %.1fs" %
+             (process._nr,"died" if reason == "exit" else "stalled",delay),True)
+
+    with self._lock:
+      state = (process._path,process._url,process._last,
+               process._play or process._pause,process._pause,
+               process.position())
+      process.kill()
+    if self._shutdown.wait(delay):
+      return
+
+    with self._lock:
+      try:
+        process.create()
+      except OSError as ex:
+        self.msg("[ERROR] Mpg123(%d): cannot start mpg123: %s" %
+                 (process._nr,ex),True)
+        self._tasks.put((process,process._generation,reason))
+        return
+      self._metrics.inc("webradio_backend_restarts_total",reason=reason)
+      if process is not self._active:
+        process.send("VOLUME 0")            # standby: wait for next preload
+        self._preload_next()
+        return
+
+      # restore volume (includes mute) and the current url/file
+      process.send("VOLUME %d" % self._volume)
+      path, url, last, playing, paused, position = state
+      if path and playing:
+        self.msg("Mpg123(%d): restoring %s at %ds" %
+                 (process._nr,path,position))
+        attrs = {'_url': url, '_path': path, '_last': last}
+        if path.endswith(".m3u"):
+          process.send("LOADLIST 0 %s" % path,attrs)
+        else:
+          if not path.startswith("http") and position >= 1:
+            attrs['_clock_offset'] = int(position)
+            process.send("LOAD %s" % path,attrs)
+            process.send("JUMP %ds" % int(position))
+          else:
+            process.send("LOAD %s" % path,attrs)
+        if paused:
+          process.send("PAUSE")
+      self._api._push_event({'type': 'backend_restart',
+                             'value': {'reason': reason,
+                                       'count': process.failures,
+                                       'url': url}})
+
+  # --- start/stop frame-info   ----------------------------------------------
+
+  def _enable_frame_info(self,enable):
+    """ start/stop @F-lines of the active process """
+
+    active = self._active
+    if active._process and not active.track:
+      active.send("PROGRESS" if enable else "SILENCE")
+
+  def _enable_position(self,enable):
+    """ start/stop position-events (and @F-lines) of the active process """
+
+    active = self._active
+    track  = enable and self._position_interval > 0
+    if track == active.track:
+      return
+    active.track = track
+    if active._process and not self._frame_listeners:
+      active.send("PROGRESS" if track else "SILENCE")
+    active._push_position()
 
   # --- play URL/file   -------------------------------------------------------
 
   def play(self,url,last=True):
     """ start playing, return True if a new file/url is started """
 
-    if self._process:
-      if self._play:
-        check_url = url if url.startswith("http") else os.path.basename(url)
-        if check_url == self._url:   # already playing
-          if not url.startswith("http"):
-            self._op_event.clear()
-            self._process.stdin.write("SAMPLE\n")
-            self._op_event.wait()
-          return False
-        self.stop(last=False)        # since we are about to play another file
+    start  = time.perf_counter()
+    active = self._active
+    if not active._process:
+      return False
+    with self._lock:
+      check_url = url if url.startswith("http") else os.path.basename(url)
+      if active._play and check_url == active._url:   # already playing
+        active._push_position()
+        return False
+      active.playlist.clear()               # no queued file after a STOP
+
+      standby = self._standby
+      if standby and standby._play and standby._url == url:
+        self._swap(start)
+        return True
+      elif (standby and (standby._play or standby._pause) and
+            not url.startswith("http")):
+        standby.send("STOP",{'_pause': False}) # no radio, no preload
+
+      if active._play:
+        active.send("STOP",{'_last': False}) # pipelined with the LOAD
       self.msg("Mpg123: starting to play %s" % url)
-      self._last = last
-      if url.startswith("http"):
-        self._url   = url
-      else:
-        self._url   = os.path.basename(url)
-      self._op_event.clear()
+      attrs = {'_last': last, '_url': check_url, '_path': url,
+               '_pause': False, '_clock_offset': 0, '_zap_start': start}
       if url.endswith(".m3u"):
-        self._process.stdin.write("LOADLIST 0 %s\n" % url)
+        command = active.send("LOADLIST 0 %s" % url,attrs)
       else:
-        self._process.stdin.write("LOAD %s\n" % url)
-      self._op_event.wait()
-      return True
-    else:
-      return False
+        command = active.send("LOAD %s" % url,attrs)
+    line = active.wait(command)
+    return line is not None and not line.startswith(b"@E")
+
+  # --- switch to the standby-process   ---------------------------------------
+
+  def _swap(self,start):
+    """ make the (playing) standby-process the active process """
+
+    old, new = self._active, self._standby
+    self.msg("Mpg123: switching to preloaded %s" % new._url)
+    old.send("VOLUME 0")
+    command = new.send("VOLUME %d" % self._volume)
+
+    # the old process continues muted as standby-process, i.e. switching
+    # back is also fast (unless the next preload replaces it)
+    old.on_event = None
+    if old._play:
+      self._api._push_event({'type': 'eof',
+                             'value': {'name': old._url, 'last': False}})
+    new.track, old.track = old.track, False
+    if new.needs_frames():
+      old.send("SILENCE")
+      new.send("PROGRESS")
+    self._active, self._standby = new, old
+
+    # publish events the active process would have published
+    new.on_event = self._api._push_event
+    self._api._push_event({'type': 'play', 'value': new._url})
+    for event in list(new.info.values()):
+      self._api._push_event(event)
+    new._push_position()
+
+    new.wait(command)
+    self._metrics.observe("webradio_zap_seconds",
+                          time.perf_counter()-start,mode="standby")
+
+  # --- preload URL   ---------------------------------------------------------
+
+  def preload(self,url):
+    """ load url muted into the standby-process (only with standby: 1) """
+
+    standby = self._standby
+    if (not self._preload_radio or not standby or not standby._process or
+        not url.startswith("http")):
+      return
+    with self._lock:
+      if (standby._play and standby._url == url) or url == self._active._url:
+        return
+      self.msg("Mpg123: preloading %s" % url)
+      standby.info = {}
+      standby.send("LOAD %s" % url,{'_url': url, '_path': url,
+                                    '_pause': False})
+
+  # --- queue files   ---------------------------------------------------------
+
+  def enqueue(self,files):
+    """ play files after the current file. With a standby-process, the
+        next file is loaded paused into the standby-process and started as
+        soon as mpg123 reports the end of the current file. Otherwise the
+        reader-thread loads the next file at the end of the current file.
+    """
+
+    active = self._active
+    with self._lock:
+      active.playlist.clear()
+      for index,path in enumerate(files):
+        active.playlist.append((path,index == len(files)-1))
+      if files:
+        active._last = False                # current file is not the last
+        if not active._play and not active._pause:
+          active._load_next()               # current file already finished
+        self._preload_next()
+
+  # --- preload next queued file   --------------------------------------------
+
+  def _preload_next(self):
+    """ load the next queued file paused into the standby-process
+        (called with the lock held)
+    """
+
+    active, standby = self._active, self._standby
+    if not standby or not standby._process or not active.playlist:
+      return
+    path, last = active.playlist[0]
+    if standby._pause and standby._path == path:
+      return
+    self.msg("Mpg123: preloading next file %s" % path)
+    standby.info = {}
+    standby.send("LOADPAUSED %s" % path,
+                 {'_url': os.path.basename(path), '_path': path,
+                  '_last': last, '_play': False})
+
+  # --- switch to the next queued file   --------------------------------------
+
+  def _next_track(self,old):
+    """ the active process finished its file: resume the preloaded
+        standby-process (or load the file if it is not preloaded)
+    """
+
+    with self._lock:
+      if old is not self._active or not old.playlist:
+        return                              # stopped or replaced meanwhile
+      new = self._standby
+      path, last = old.playlist[0]
+      if not (new._pause and new._path == path):
+        old._load_next()
+        self._preload_next()
+        return
+
+      self.msg("Mpg123: starting preloaded %s" % path)
+      old.playlist.popleft()
+      new.playlist, old.playlist = old.playlist, collections.deque()
+      new._pause = False                    # @P 2 then starts a new file
+      new._clock_offset = 0
+      old.on_event = None
+      new.on_event = self._api._push_event
+      new.track, old.track = old.track, False
+      new.send("VOLUME %d" % self._volume)
+      new.send("PAUSE")                     # @P 2 publishes play
+      old.send("VOLUME 0")
+      if new.needs_frames():
+        old.send("SILENCE")
+        new.send("PROGRESS")
+      self._active, self._standby = new, old
+      for event in list(new.info.values()):
+        self._api._push_event(event)
+      self._preload_next()
 
   # --- stop playing current URL/file   ---------------------------------------
 
   def stop(self,last=True):
     """ stop playing """
 
-    if not self._play:
+    active = self._active
+    active.playlist.clear()
+    if self._standby and (self._standby._play or self._standby._pause):
+      self._standby.send("STOP",{'_pause': False})
+    if not active._play or not active._process:
       return
-    if self._process:
-      self.msg("Mpg123: stopping current url/file: %s" % self._url)
-      self._last = last
-      self._op_event.clear()
-      self._process.stdin.write("STOP\n")
-      self._op_event.wait()
+    with self._lock:
+      self.msg("Mpg123: stopping current url/file: %s" % active._url)
+      command = active.send("STOP",{'_last': last})
+    active.wait(command)
 
   # --- pause playing   -------------------------------------------------------
 
   def pause(self):
     """ pause playing """
 
-    if not self._url or self._pause:
+    active = self._active
+    if not active._url or active._pause:
       return
-    if self._process:
+    if active._process:
       self.msg("Mpg123: pausing playback")
-      if not self._pause:
-        self._op_event.clear()
-        self._process.stdin.write("PAUSE\n")
-        self._op_event.wait()
+      with self._lock:
+        command = active.send("PAUSE")
+      active.wait(command)
 
   # --- continue playing   ----------------------------------------------------
 
   def resume(self):
     """ continue playing """
 
-    if not self._play and not self._pause:
+    active = self._active
+    if not active._play and not active._pause:
       return
-    if self._process:
+    if active._process:
       self.msg("Mpg123: resuming playback")
-      if self._pause:
-        self._op_event.clear()
-        self._process.stdin.write("PAUSE\n")
-        self._op_event.wait()
+      if active._pause:
+        with self._lock:
+          command = active.send("PAUSE")
+        active.wait(command)
 
   # --- toggle playing   ------------------------------------------------------
 
   def toggle(self):
     """ toggle playing """
 
-    if not self._play:
+    active = self._active
+    if not active._play:
       return
-    if self._process:
+    if active._process:
       self.msg("Mpg123: toggle playback")
-      self._op_event.clear()
-      self._process.stdin.write("PAUSE\n")
-      self._op_event.wait()
+      with self._lock:
+        command = active.send("PAUSE")
+      active.wait(command)
 
   # --- stop player   ---------------------------------------------------------
 
   def destroy(self):
     """ destroy current player """
 
-    if self._process:
-      self.msg("Mpg123: stopping mpg123 ...")
-      try:
-        self._process.stdin.write("QUIT\n")
-        self._process.wait(5)
-        self.msg("Mpg123: ... done")
-      except:
-        # can't do anything about it
-        self.msg("Mpg123: ... exception during destroy of mpg123")
-        pass
-
-  # --- process output of mpg123   --------------------------------------------
-
-  def _process_stdout(self):
-    """ read mpg123-output and process it """
-
-    self.msg("Mpg123: starting mpg123 reader-thread")
-    regex = re.compile(r".*ICY-META.*?'([^']*)';?.*\n")
-    while True:
-      try:
-        line = self._process.stdout.readline()
-        if not line:
-          break;
-      except:
-        # catch e.g. decode-error
-        continue
-      if line.startswith("@F"):
-        continue
-      self.msg("Mpg123: processing line: %s" % line)
-      if line.startswith("@I ICY-META"):
-        (line,_) = regex.subn(r'\1',line)
-        self._api._push_event({'type': 'icy_meta',
-                              'value': line})
-      elif line.startswith("@I ICY-NAME"):
-        self._api._push_event({'type': 'icy_name',
-                              'value': line[13:].rstrip("\n")})
-      elif line.startswith("@I ID3v2"):
-        tag = line[9:].rstrip("\n").split(":")
-        self._api._push_event({'type': 'id3',
-                               'value': {'tag': tag[0],
-                                         'value': tag[1]}})
-      elif line.startswith("@P 0"):
-        # @P 0 is not reliable
-        if self._play:
-          self._api._push_event({'type': 'eof',
-                                 'value': {'name': self._url,
-                                           'last': self._last}})
-          self._url   = None
-          self._pause = False
-          self._play  = False
-          self._op_event.set()
-      elif line.startswith("@P 1"):
-        self._pause = True
-        self._api._push_event({'type': 'pause',
-                              'value': self._url})
-        self._op_event.set()
-      elif line.startswith("@P 2"):
-        self._play  = True
-        self._pause = False
-        self._api._push_event({'type': 'play',
-                              'value': self._url})
-        self._op_event.set()
-      elif line.startswith("@SAMPLE"):
-        sample = line.split()
-        self._api._push_event({'type': 'sample',
-                              'value': {'elapsed': int(sample[1])/int(sample[2]),
-                                        'pause': self._pause}})
-        self._op_event.set()
-
-    self.msg("Mpg123: stopping mpg123 reader-thread")
-
-  # --- increase volume   ----------------------------------------------------
-
-  def vol_up(self,by=None):
-    """ increase volume by amount or the pre-configured value """
-
-    if by:
-      amount = max(0,int(by))     # only accept positive values
-    else:
-      amount = self._vol_delta        # use default
-    self._volume = min(100,self._volume + amount)
-    return self.vol_set(self._volume)
-
-  # --- decrease volume   ----------------------------------------------------
-
-  def vol_down(self,by=None):
-    """ decrease volume by amount or the pre-configured value """
-
-    if by:
-      amount = max(0,int(amount))     # only accept positive values
-    else:
-      amount = self._vol_delta        # use default
-    self._volume = max(0,self._volume - amount)
-    return self.vol_set(self._volume)
+    self._shutdown.set()
+    self._tasks.put(None)
+    self._active.destroy()
+    if self._standby:
+      self._standby.destroy()
 
   # --- set volume   ---------------------------------------------------------
 
-  def vol_set(self,val):
-    """ set volume """
+  def _set_volume(self,val):
+    """ set volume of the active process """
 
-    val = min(max(0,int(val)),100)
-    self._volume = val
-    if self._process:
+    if self._active._process:
       self.msg("Mpg123: setting current volume to: %d%%" % val)
-      self._process.stdin.write("VOLUME %d\n" % val)
-      self._api._push_event({'type': 'vol_set',
-                              'value': self._volume})
-      return self._volume
-
-  # --- mute on  -------------------------------------------------------------
-
-  def vol_mute_on(self):
-    """ activate mute (i.e. set volume to zero) """
-
-    if not self._mute:
-      self._vol_old = self._volume
-      self._mute    = True
-      return self.vol_set(0)
-
-  # --- mute off  ------------------------------------------------------------
-
-  def vol_mute_off(self):
-    """ deactivate mute (i.e. set volume to last value) """
-
-    if self._mute:
-      self._mute = False
-      return self.vol_set(self._vol_old)
-
-  # --- mute toggle   --------------------------------------------------------
-
-  def vol_mute_toggle(self):
-    """ toggle mute """
-
-    if self._mute:
-      return self.vol_mute_off()
-    else:
-      return self.vol_mute_on()
+      self._active.send("VOLUME %d" % val)
+      return True
+    return False
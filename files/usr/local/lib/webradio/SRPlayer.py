@@ -12,13 +12,42 @@
 #
 # -----------------------------------------------------------------------------
 
-import os, time, datetime, subprocess, threading, copy, queue
+import os, time, datetime, threading, copy, queue
+import concurrent.futures
 
-from webradio import Base
+from webradio import Base, MetaStore, DirCache, Library
+
+# --- a running scan of a directory   ------------------------------------------
+
+class PlayerDirScan(object):
+  """ probing of the files of a directory with the worker-pool """
+
+  def __init__(self,dir,cur_dir,dirinfo,total,start):
+    """ initialization """
+
+    self.dir     = dir
+    self.cur_dir = cur_dir                  # directory relative to root_dir
+    self.dirinfo = dirinfo
+    self.total   = total                    # number of files to probe
+    self.done    = 0
+    self.start   = start
+    self._lock   = threading.Lock()
+
+  def add(self,n):
+    """ add number of probed files, return total number of probed files """
+
+    with self._lock:
+      self.done += n
+      return self.done
+
+# --- the player   -------------------------------------------------------------
 
 class Player(Base):
   """ Player-controller """
 
+  SCAN_CHUNK = 16                           # max. files per task of the pool
+  RELOAD_DELAY = 0.5                        # coalesce changes of current dir
+
   def __init__(self,app):
     """ initialization """
 
@@ -33,9 +62,20 @@ class Player(Base):
     self._dirplay     = None
     self._dirstop     = threading.Event()
     self._init_thread = None
+    self._scan        = None                # running scan
+    self._reload      = None                # timer re-reading current dir
 
     self.read_config()
+    self._pool = concurrent.futures.ThreadPoolExecutor(
+      max_workers=self._scan_workers,thread_name_prefix="Player")
     self.register_apis()
+    self._metrics = app.metrics
+    self._meta    = MetaStore(app)
+    self._dircache = DirCache(app,self._dir_changed)
+    self._library  = Library(app,self._meta,self._root_dir)
+    self._metrics.histogram("webradio_dirinfo_scan_seconds",
+                            "duration of directory-scans",
+                            (0.01,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60))
 
   # --- read configuration   --------------------------------------------------
 
@@ -55,6 +95,9 @@ class Player(Base):
                                     self._root_dir)
     self._def_dir = os.path.abspath(self._def_dir)
 
+    self._scan_workers = int(self.get_value(self._app.parser,"PLAYER",
+                                            "player_scan_workers",4))
+
     self._dir = self._def_dir
     self.msg("Player: root dir:    %s" % self._root_dir)
     self.msg("Player: default dir: %s" % self._def_dir)
@@ -70,7 +113,10 @@ class Player(Base):
     self._api.player_resume     = self.player_resume
     self._api.player_toggle     = self.player_toggle
     self._api.player_select_dir = self.player_select_dir
+    self._api.player_get_dir    = self.player_get_dir
+    self._api._cache_api("player_get_dir","dir")
     self._api.player_play_dir   = self.player_play_dir
+    self._api.player_search     = self.player_search
     self._api._player_get_cover_file = self._player_get_cover_file
 
   # --- return persistent state of this class   -------------------------------
@@ -177,6 +223,14 @@ class Player(Base):
     else:
       return "{0:02d}:{1:02d}".format(m,s)
 
+  # --- duration of file   ---------------------------------------------------
+
+  def _get_duration(self,path):
+    """ return duration of file in seconds (0 if unknown) """
+
+    secs = self._meta.get(path)['duration']
+    return int(secs) if secs else 0
+
   # --- start playing   -------------------------------------------------------
 
   def player_play_file(self,file=None,last=True):
@@ -195,35 +249,52 @@ class Player(Base):
     if not self._file:
       raise ValueError("default file not set")
 
+    # this will push the information to all clients, even if the file
+    # is already playing (the backend then publishes the position)
+
+    total_secs = self._get_duration(self._file)
+    file_info = self._push_file_info(total_secs,last)
+    if self._backend.play(self._file,last):
+      self._api.update_state(section="player",key="last_file",
+                             value=os.path.basename(self._file),publish=False)
+    self._update_time_state(file_info)
+    return file_info
+
+  # --- publish file-info of current file   ----------------------------------
+
+  def _push_file_info(self,total_secs,last):
+    """ publish file-info of the current file and return it """
+
     if self._dirinfo:
       self._dirinfo['cur_file'] = self._file
+      self._api._invalidate("dir")
 
-    # this will push the information to all clients, even if the file
-    # is already playing.
-    # We might also need to push the elapsed time?!
-
-    total_secs = int(subprocess.check_output(["mp3info", "-p","%S",self._file]))
     file_info = {'name': os.path.basename(self._file),
                  'total': total_secs,
                  'total_pretty': self._pp_time(total_secs),
                  'last': last}
     self._api._push_event({'type': 'file_info', 'value': file_info })
-    if self._backend.play(self._file,last):
-      self._api.update_state(section="player",key="last_file",
-                             value=os.path.basename(self._file),publish=False)
+    return file_info
+
+  # --- update time-state   ---------------------------------------------------
+
+  def _update_time_state(self,file_info):
+    """ update state with total time of current file """
+
     self._api.update_state(section="player",key="time",
                            value=[0,file_info['total'],file_info['total_pretty']],
                            publish=False)
-    return file_info
 
   # --- stop playing   -------------------------------------------------------
 
   def player_stop(self):
     """ stop playing (play->stop, pause->stop)"""
 
-    if self._dirplay:
-      self._dirstop.set()         # this will also stop the backend
-      self._dirplay.join()
+    dirplay = self._dirplay
+    if dirplay:
+      self._dirstop.set()
+      self._backend.stop()        # eof-event also wakes up the thread
+      dirplay.join()
     else:
       self._backend.stop()        # backend will publish eof-event
 
@@ -248,6 +319,18 @@ class Player(Base):
 
     self._backend.toggle()
 
+  # --- return entries of current directory   --------------------------------
+
+  def player_get_dir(self):
+    """ return dir-info of the current directory (without side-effects,
+        unlike player_select_dir)
+    """
+
+    if self._init_thread:
+      self._init_thread.join()
+    with self._lock:
+      return self._dirinfo
+
   # --- select directory, return entries   ------------------------------------
 
   def player_select_dir(self,dir=None):
@@ -275,13 +358,9 @@ class Player(Base):
         self._lock.release()
         raise ValueError("invalid directory %s" % dir)
 
-    cache_valid = False
-    if dir == self._dir:
-      if self._dirinfo:
-        cache_valid = True
-    else:
-      # set new current directory
-      self._dir = dir
+    # set new current directory
+    same_dir  = dir == self._dir
+    self._dir = dir
 
     # publish event first (return dir relative to root_dir)
     cur_dir = self._dir[len(self._root_dir):]+os.path.sep
@@ -290,12 +369,17 @@ class Player(Base):
                            value=cur_dir,
                            publish=False)
 
-    # then query new directory info
-    if not cache_valid:
-      self._get_dirinfo(dir)
-      self._dirinfo['cur_dir'] = cur_dir
+    # then query new directory info (keep current file within directory)
+    keep_file = same_dir and self._file and os.path.exists(self._file)
+    dirinfo   = self._dircache.get(dir)
+    if not dirinfo:
+      self._get_dirinfo(dir,keep_file)
     else:
       self.msg("Player: using cached dir-info for %s" % dir)
+      self._dirinfo = dirinfo
+      if not keep_file:
+        self._set_cur_file(False)
+      self._api._invalidate("dir")
 
     self._lock.release()
     return self._dirinfo
@@ -317,96 +401,173 @@ class Player(Base):
 
     # copy file-list
     if not start:
-      files = copy.deepcopy(self._dirinfo['files'])
+      index = 0
     else:
       try:
         index = self._dirinfo['files'].index(start)
         self.msg("Player: starting play_dir with file %s (index %i)" %
                  (start,index))
-        files = copy.deepcopy(self._dirinfo['files'][index:])
       except ValueError:
         raise ValueError("file %s does not exist" % start)
+    files = copy.deepcopy(self._dirinfo['files'][index:])
+    if not files:
+      return
 
     # start player-thread, pass files as argument
     self._dirstop.clear()
-    self._dirplay = threading.Thread(target=self._play_dir,args=(files,))
+    self._dirplay = threading.Thread(target=self._play_dir,
+                                     args=(self._dir,files))
     self._dirplay.start()
 
   # --- play all files (helper)   --------------------------------------------
 
-  def _play_dir(self,files):
-    """ play all given files """
-
-    ev_queue = self._api._add_consumer("_play_dir")
-    do_exit = False
+  def _play_dir(self,dir,files):
+    """ play all given files: the backend gets the complete list upfront
+        and starts every file without a gap, this thread only follows
+        the play-events of the backend
+    """
 
+    ev_queue   = self._api._add_consumer("_play_dir",types=['play','eof'])
+    paths      = [os.path.join(dir,f) for f in files]
+    index      = 0
     index_last = len(files)-1
-    for index,fname in enumerate(files):
-      if do_exit:
+    stopped    = False
+
+    self.msg("Player: _play_dir: playing %d files" % len(files))
+    self.player_play_file(paths[0],last=index_last==0)
+    self._backend.enqueue(paths[1:])
+
+    while True:
+      # a naive implementation would just block on the queue, but
+      # then we could stop this thread only after an event occurs
+      try:
+        ev = ev_queue.get(timeout=1.0)
+      except queue.Empty:
+        ev = {'type': None}
+      if self._dirstop.is_set():
+        stopped = True
         break
-      self.msg("Player: _play_dir: playing next file %s" % fname)
-      self.player_play_file(fname,last=index==index_last)
-      while True:
-        # a naive implementation would just block on the queue, but
-        # then we could stop this thread only after an event occurs
-        if self._dirstop.wait(timeout=1.0):
-          do_exit = True
+      if not ev:
+        break
+      if ev['type'] == 'play':
+        if index < index_last and ev['value'] == files[index+1]:
+          index += 1
+          self.msg("Player: _play_dir: playing next file %s" % files[index])
+          self._next_file(paths[index],index==index_last)
+        elif ev['value'] != files[index]:
+          self.msg("Player: _play_dir: playback replaced by %s" % ev['value'])
           break
-        try:
-          ev = ev_queue.get(block=False)
-          ev_queue.task_done()
-          if ev:
-            if ev['type'] == 'eof' and ev['value']['name'] == fname:
-              self.msg("Player: processing eof for %s" % fname)
-              break                              # start next file
-          else:
-            do_exit = True
-            break
-        except queue.Empty:
-          pass
+      elif ev['type'] == 'eof' and ev['value']['last']:
+        self.msg("Player: processing eof for %s" % ev['value']['name'])
+        break
 
     # cleanup
     self.msg("Player: stopping _play_dir and cleaning up")
     self._api._del_consumer("_play_dir")
-    self._backend.stop()
+    if stopped:
+      self._backend.stop()
     self._dirplay = None
 
-  # --- return name of cover file (currently only cover.jpg)   ---------------
+  # --- backend started next file   ------------------------------------------
+
+  def _next_file(self,path,last):
+    """ update state after the backend started the next file """
+
+    self._file = path
+    file_info  = self._push_file_info(self._get_duration(path),last)
+    self._api.update_state(section="player",key="last_file",
+                           value=file_info['name'],publish=False)
+    self._update_time_state(file_info)
+
+  # --- search library   -----------------------------------------------------
+
+  def player_search(self,q,limit=20):
+    """ search all files below root_dir: every word of q must be the start
+        of a word of the filename, the tags or the name of the directory
+    """
+
+    result = []
+    for dir, name, meta in self._library.search(q,limit):
+      secs = int(meta['duration'] or 0)
+      info = {'dir': dir[len(self._root_dir):]+os.path.sep,
+              'file': name,
+              'total': secs,
+              'total_pretty': self._pp_time(secs)}
+      for key in ['title','artist','album']:
+        if key in meta:
+          info[key] = meta[key]
+      result.append(info)
+    return result
+
+  # --- return name of cover file   -----------------------------------------
 
   def _player_get_cover_file(self):
-    """ return name of cover file """
+    """ return name of cover file: either cover.jpg or a mp3-file
+        (the cover is then extracted from the ID3-tag)
+    """
 
     cover = os.path.join(self._dir,"cover.jpg")
     if os.path.exists(cover):
       return cover
+    elif self._file and os.path.dirname(self._file) == self._dir:
+      return self._file
+    elif self._dirinfo and self._dirinfo['files']:
+      return os.path.join(self._dir,self._dirinfo['files'][0])
     else:
       return None
 
   # --- create directory info for given dir   --------------------------------
 
-  def _get_dirinfo(self,dir,init=False):
-    """ create directory info """
+  def _get_dirinfo(self,dir,keep_file=False):
+    """ create directory info and add it to the cache """
 
-    self._dirinfo =  {'dirs':  [], 'files': [], 'dur': []}
+    start   = time.perf_counter()
+    mtime   = os.stat(dir).st_mtime_ns
+    cur_dir = dir[len(self._root_dir):]+os.path.sep
+    self._dirinfo =  {'dirs':  [], 'files': [], 'dur': [], 'cur_dir': cur_dir}
     self.msg("Player: collecting dir-info for %s" % dir)
 
     # first entry is parent directory
     if self._dir != self._root_dir:
       self._dirinfo['dirs'].append('..')
 
-    for f in os.listdir(dir):
-      if os.path.isfile(os.path.join(dir,f)):
-        if f.endswith(".mp3"):
-          self._dirinfo['files'].append(f)
-      else:
-        self._dirinfo['dirs'].append(f)
+    files = []                              # tuples (name,size,mtime)
+    with os.scandir(dir) as entries:
+      for entry in entries:
+        if entry.is_file():
+          if entry.name.endswith(".mp3"):
+            st = entry.stat()
+            files.append((entry.name,st.st_size,st.st_mtime_ns))
+        else:
+          self._dirinfo['dirs'].append(entry.name)
 
     # ... and sort results
-    self._dirinfo['files'].sort()
+    files.sort()
+    self._dirinfo['files'] = [f[0] for f in files]
     self._dirinfo['dirs'].sort()
 
-    # set current file
-    if self._file and init:
+    self._set_cur_file(keep_file)
+
+    # add time-info of cached files, new or changed files are probed
+    # in the background (duration is unknown until then)
+    missing = []
+    for index, meta in enumerate(self._meta.lookup_dir(dir,files)):
+      if meta:
+        secs = int(meta['duration'] or 0)
+        self._dirinfo['dur'].append((secs,self._pp_time(secs)))
+      else:
+        self._dirinfo['dur'].append((0,""))
+        missing.append((index,)+files[index])
+    self._start_scan(dir,cur_dir,missing,start)
+    self._dircache.put(dir,self._dirinfo,mtime)
+    self._api._invalidate("dir")
+
+  # --- set current file of current directory   ------------------------------
+
+  def _set_cur_file(self,keep_file):
+    """ keep current file or use first file of the directory """
+
+    if self._file and keep_file:
       self._dirinfo['cur_file'] = os.path.basename(self._file)
     else:
       if len(self._dirinfo['files']):
@@ -417,9 +578,94 @@ class Player(Base):
       self._api.update_state(section="player",key="last_file",
                              value= self._dirinfo['cur_file'],publish=False)
 
-    # add add time-info
-    for f in self._dirinfo['files']:
-      secs = int(subprocess.check_output(["mp3info",
-                                          "-p","%S",
-                                          os.path.join(dir,f)]))
-      self._dirinfo['dur'].append((secs,self._pp_time(secs)))
+  # --- directory changed   ---------------------------------------------------
+
+  def _dir_changed(self,dir):
+    """ cached dir-info of directory was invalidated (from any thread,
+        possibly with self._lock held): re-read the current directory
+        after a short delay
+    """
+
+    if dir != self._dir:
+      return
+    self._api._invalidate("dir")
+    if self._reload and self._reload.is_alive():
+      return                                # reload already pending
+    self._reload = threading.Timer(Player.RELOAD_DELAY,self._reload_dir,[dir])
+    self._reload.start()
+
+  # --- re-read changed current directory   ----------------------------------
+
+  def _reload_dir(self,dir):
+    """ re-read current directory and publish dir_changed """
+
+    if self._app.stop_event.is_set():
+      return
+    with self._lock:
+      if dir != self._dir or self._dircache.get(dir):
+        return                              # dir switched or already re-read
+      self.msg("Player: re-reading changed directory %s" % dir)
+      keep_file = (self._file and os.path.dirname(self._file) == dir and
+                   os.path.exists(self._file))
+      try:
+        self._get_dirinfo(dir,keep_file)
+      except OSError as ex:
+        self.msg("[WARNING] Player: cannot read %s: %s" % (dir,ex),True)
+        return
+      cur_dir = self._dirinfo['cur_dir']
+    self._api._push_event({'type': 'dir_changed', 'value': cur_dir})
+
+  # --- probe files of directory in the background   -------------------------
+
+  def _start_scan(self,dir,cur_dir,files,start):
+    """ probe files (tuples (index,name,size,mtime)) with the worker-pool.
+        A new scan supersedes a running scan, the incomplete dir-info of
+        that scan is removed from the cache.
+    """
+
+    prev = self._scan
+    if prev and prev.done < prev.total:
+      self._dircache.invalidate(prev.dir)
+    if not files:
+      self._scan = None
+      self._metrics.observe("webradio_dirinfo_scan_seconds",
+                            time.perf_counter()-start)
+      return
+
+    scan = PlayerDirScan(dir,cur_dir,self._dirinfo,len(files),start)
+    self._scan = scan
+    self.msg("Player: probing %d files of %s" % (len(files),dir))
+    size = max(1,min(Player.SCAN_CHUNK,-(-len(files)//self._scan_workers)))
+    for i in range(0,len(files),size):
+      self._pool.submit(self._scan_files,scan,files[i:i+size])
+
+  # --- probe some files of a directory (runs in the worker-pool)   ----------
+
+  def _scan_files(self,scan,files):
+    """ probe files (tuples (index,name,size,mtime)), save the metadata
+        and publish the durations
+    """
+
+    update = []
+    durs   = []
+    for index, name, size, mtime in files:
+      if scan is not self._scan:
+        break                               # superseded by another scan
+      meta = self._meta.probe(os.path.join(scan.dir,name))
+      update.append((name,size,mtime,meta))
+      secs = int(meta['duration'] or 0)
+      durs.append([index,secs,self._pp_time(secs)])
+    self._meta.update(scan.dir,update)
+    if scan is not self._scan:
+      return
+
+    for index, secs, pretty in durs:
+      scan.dirinfo['dur'][index] = (secs,pretty)
+    done = scan.add(len(durs))
+    self._api._invalidate("dir")
+    self._api._push_event({'type': 'dir_info_progress',
+                           'value': {'dir': scan.cur_dir, 'dur': durs,
+                                     'done': done, 'total': scan.total}})
+    if done == scan.total:
+      self._metrics.observe("webradio_dirinfo_scan_seconds",
+                            time.perf_counter()-scan.start)
@@ -63,6 +63,7 @@ class Radio(Base):
     self._api.radio_resume         = self.radio_resume
     self._api.radio_toggle         = self.radio_toggle
     self._api.radio_get_channels   = self.radio_get_channels
+    self._api._cache_api("radio_get_channels","channels")
     self._api.radio_get_channel    = self.radio_get_channel
     self._api.radio_play_channel   = self.radio_play_channel
     self._api.radio_play_next      = self.radio_play_next
@@ -112,6 +113,7 @@ class Radio(Base):
       self.msg("Radio: Loading channels failed")
       if self.debug:
         traceback.print_exc()
+    self._api._invalidate("channels")
 
   # --- get channel info   ----------------------------------------------------
 
@@ -142,22 +144,50 @@ class Radio(Base):
   def radio_play_channel(self,nr=0):
     """ switch to given channel """
 
-    channel = self.radio_get_channel(int(nr))
+    return self._play_channel(nr,0)
+
+  def _play_channel(self,nr,direction):
+    """ switch to given channel. direction is +1/-1 for next/prev and
+        is used to predict the next channel for the standby-decoder
+    """
+
+    if not self._channels:
+      self.msg("[WARNING] Radio: no channels available",True)
+      return None
+    channel = self.radio_get_channel(nr)
     nr      = channel['nr']
     self.msg("Radio: start playing channel %d (%s)" % (nr,channel['name']))
 
     # check if we have to do anything
+    last_channel = self._last_channel
     if self._backend.play(channel['url']):
       self._api.update_state(section="radio",key="channel_nr",
                              value=channel,publish=False)
       self._api._push_event({'type': 'radio_play_channel', 'value': channel})
       self._channel_nr   = nr
       self._last_channel = self._channel_nr
+      self._preload(nr,direction,last_channel)
     else:
       self.msg("Radio: already on channel %d" % nr)
       # theoretically we could also have lost our backend
     return channel
 
+  # --- preload likely next channel   -----------------------------------------
+
+  def _preload(self,nr,direction,last_channel):
+    """ preload neighbour in the current direction or the last channel """
+
+    if not self._channels:
+      return
+    if direction:
+      next_nr = (nr-1+direction) % len(self._channels) + 1
+    elif last_channel and last_channel != nr:
+      next_nr = last_channel
+    else:
+      next_nr = nr % len(self._channels) + 1
+    if next_nr != nr:
+      self._backend.preload(self._channels[next_nr-1]['url'])
+
   # --- switch to next channel   ----------------------------------------------
 
   def radio_play_next(self):
@@ -165,11 +195,11 @@ class Radio(Base):
 
     self.msg("Radio: switch to next channel")
     if self._channel_nr == 0:
-      return self.radio_play_channel(0)
+      return self._play_channel(0,1)
     elif self._channel_nr == len(self._channels):
-      return self.radio_play_channel(1)
+      return self._play_channel(1,1)
     else:
-      return self.radio_play_channel(1+self._channel_nr)
+      return self._play_channel(1+self._channel_nr,1)
 
   # --- switch to previous channel   ------------------------------------------
 
@@ -179,11 +209,11 @@ class Radio(Base):
 
     self.msg("Radio: switch to previous channel")
     if self._channel_nr == 0:
-      return self.radio_play_channel(0)
+      return self._play_channel(0,-1)
     if self._channel_nr == 1:
-      return self.radio_play_channel(len(self._channels))
+      return self._play_channel(len(self._channels),-1)
     else:
-      return self.radio_play_channel(self._channel_nr-1)
+      return self._play_channel(self._channel_nr-1,-1)
 
   # --- turn radio off   ------------------------------------------------------
 
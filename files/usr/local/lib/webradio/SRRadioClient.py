@@ -12,7 +12,7 @@
 #
 # ----------------------------------------------------------------------------
 
-import urllib, requests, threading, time, json
+import urllib.parse, requests, threading, time, json
 import sseclient
 import http.client as httplib
 
@@ -71,6 +71,37 @@ class RadioClient(Base):
 
     return data
 
+  # --- execute list of requests   ------------------------------------------
+
+  def exec_many(self,calls,close=False):
+    """ execute list of apis with a single request. Every call is
+        a tuple (api,params) or just the name of the api.
+    """
+
+    batch = []
+    for call in calls:
+      if isinstance(call,str):
+        batch.append({'api': call})
+      else:
+        batch.append({'api': call[0], 'args': call[1] or {}})
+    body = json.dumps(batch)
+
+    # send, get request and parse response
+    try:
+      self._request.request("POST","/api/batch",body,
+                            {'Content-Type': 'application/json'})
+      response = self._request.getresponse()
+      data = (response.status,response.reason,response.read())
+    except Exception as ex:
+      self.msg("RadioClient: exception: %s" % ex)
+      self._request = httplib.HTTPConnection(self._host,self._port)
+      data = (-1,"connect error",None)
+
+    if close:
+      self.close()
+
+    return data
+
   # --- return stop-event   --------------------------------------------------
 
   def get_stop_event(self):
@@ -80,10 +111,14 @@ class RadioClient(Base):
 
   # --- set up SSE and return generator   ------------------------------------
 
-  def get_events(self):
-    """ set up SSE client and return event-queue """
+  def get_events(self,types=None):
+    """ set up SSE client and return event-queue. If types is given,
+        only subscribe to the given event-types.
+    """
 
     url      = 'http://{0}:{1}/api/get_events'.format(self._host,self._port)
+    if types:
+      url += '?' + urllib.parse.urlencode({'types': ','.join(types)})
     headers  = {'Accept': 'text/event-stream'}
 
     try:
@@ -112,12 +147,12 @@ class RadioClient(Base):
 
   # --- process events   -----------------------------------------------------
 
-  def _process_events(self,callback):
+  def _process_events(self,callback,types):
     """ process events """
 
     try:
       while True and not self._stop.is_set():
-        events = self.get_events()
+        events = self.get_events(types)
         self.msg("RadioClient: events: %r" % (events,))
         if not events:
           time.sleep(3)
@@ -133,10 +168,11 @@ class RadioClient(Base):
 
   # --- start event processing   ---------------------------------------------
 
-  def start_event_processing(self,callback=None):
+  def start_event_processing(self,callback=None,types=None):
     """ create and start event-processing """
 
-    threading.Thread(target=self._process_events,args=(callback,)).start()
+    threading.Thread(target=self._process_events,
+                     args=(callback,types)).start()
     while not self._have_ev:
       # no events yet from server, so wait
       time.sleep(0.1)
@@ -5,6 +5,27 @@
 #
 # The class RadioEvents multiplexes events to multiple consumers.
 #
+# All events are appended to a single ring-buffer. Every consumer keeps
+# its own read-cursor into this buffer, so publishing an event does not
+# depend on the number of consumers. A consumer that falls behind the
+# buffer receives a 'lagged' marker and a fresh state-snapshot, and then
+# continues with the oldest event still in the buffer.
+# Every event is serialized only once: the buffer holds the event together
+# with its pre-encoded SSE-frame, which is shared by all SSE-clients.
+# Frames carry the id "<epoch>-<sequence-number>", so reconnecting clients
+# can pass the id of the last event they received and only get the events
+# they missed (as long as they are still in the buffer).
+#
+# High-frequency events are coalesced before they are published: for
+# 'coalesce_types' only the latest event within a time-window is published,
+# events of 'batch_types' are collected and published as a single event.
+#
+# Consumers can subscribe to a subset of event-types. Consumers with the
+# same subscription share a condition-variable which is only notified for
+# matching events, so filtered consumers are not woken up by other traffic.
+# A subscription of types prefixed with '-' (e.g. '-position') receives all
+# other types.
+#
 # Author: Bernhard Bablok
 # License: GPL3
 #
@@ -12,30 +33,112 @@
 #
 # -----------------------------------------------------------------------------
 
-import queue, threading, datetime, sys
+import queue, threading, datetime, sys, time, collections, json
 
 from webradio import Base
 from webradio import EventFormatter
 
+# --- read-cursor of a single consumer   --------------------------------------
+
+class EventConsumer(object):
+  """ read-cursor of a consumer into the shared event-buffer """
+
+  def __init__(self,events,id,cursor,types,cond):
+    """ initialization """
+
+    self.id       = id
+    self.cursor   = cursor                  # sequence-number of next event
+    self.dropped  = 0                       # events missed due to lagging
+    self.pending  = collections.deque()     # private (event,frame)-tuples
+    self.closed   = False
+    self.types    = types                   # subscribed types, None: all
+    self.cond     = cond                    # condition for wakeup
+    self._events  = events
+
+  # --- return next event (compatible with queue.Queue.get())   -------------
+
+  def get(self,block=True,timeout=None):
+    """ return next event, None if the consumer is closed """
+
+    return self._events._read(self,block,timeout)[0]
+
+  # --- return pre-encoded SSE-frame of next event   ------------------------
+
+  def get_frame(self,block=True,timeout=None):
+    """ return SSE-frame (bytes) of next event, None if the consumer is closed """
+
+    return self._events._read(self,block,timeout)[1]
+
+  # --- check if the consumer receives events of the given type   ----------
+
+  def wants(self,type):
+    """ return True if events of the given type pass the subscription """
+
+    return self._events._matches(self.types,type)
+
+  # --- compatibility with queue.Queue   ------------------------------------
+
+  def task_done(self):
+    """ no-op, kept for compatibility with queue.Queue """
+    pass
+
+# --- event multiplexer   -----------------------------------------------------
+
 class RadioEvents(Base):
   """ Multiplex events to consumers """
 
-  QUEUE_SIZE          = 20   # size of client event-queues
+  RING_SIZE           = 256  # default number of events kept in the buffer
   KEEP_ALIVE_INTERVAL = 15   # send keep-alive every x seconds
 
   def __init__(self,app):
     """ initialization """
 
+    self._app         = app
     self._api         = app.api
     self.debug        = app.debug
     self._stop_event  = app.stop_event
     self._input_queue = queue.Queue()
     self._lock        = threading.Lock()
+    self._cond        = threading.Condition(self._lock)
+    self._epoch       = "%x" % int(time.time())   # distinguishes restarts
+    self._seq         = 0                   # sequence-number of last event
+    self._evicted     = {}                  # type: last seq dropped from ring
+    self._filters     = {}                  # types: [condition,#consumers]
     self._consumers   = {}
+    self._position_consumers = 0            # consumers of position-events
+    self._track_lock  = threading.Lock()    # serializes _update_tracking()
     self._formatter   = EventFormatter()
+    self._held        = {}                  # type: [deadline,latest event]
+    self._batches     = {}                  # type: [deadline,[events]]
+    self._stats       = {'received': 0, 'published': 0, 'merged': {}}
+    self.read_config()
+    self._ring        = [None]*self._ring_size
     self.register_apis()
+    self._init_metrics()
     threading.Thread(target=self._process_events).start()
 
+  # --- read configuration   --------------------------------------------------
+
+  def read_config(self):
+    """ read configuration from config-file """
+
+    # section [EVENTS]
+    self._ring_size = int(self.get_value(self._app.parser,"EVENTS",
+                                         "history",RadioEvents.RING_SIZE))
+    self._window    = int(self.get_value(self._app.parser,"EVENTS",
+                                         "coalesce_window",250))/1000.0
+    self._coalesce_types = self._get_types("coalesce_types",
+                                           "vol_set,sample,position,state_delta")
+    self._batch_types    = self._get_types("batch_types","id3")
+
+  # --- read list of event-types from configuration   ------------------------
+
+  def _get_types(self,option,default):
+    """ return set of event-types configured for the given option """
+
+    value = self.get_value(self._app.parser,"EVENTS",option,default)
+    return set(t.strip() for t in value.split(",") if t.strip())
+
   # --- register APIs   ------------------------------------------------------
 
   def register_apis(self):
@@ -44,6 +147,55 @@ class RadioEvents(Base):
     self._api._push_event   = self.push_event
     self._api._add_consumer = self.add_consumer
     self._api._del_consumer = self.del_consumer
+    self._api.get_event_stats = self.get_event_stats
+
+  # --- declare metrics   ----------------------------------------------------
+
+  def _init_metrics(self):
+    """ declare metrics and add collector for consumer-metrics """
+
+    self._metrics = self._app.metrics
+    self._metrics.counter("webradio_events_received_total",
+                          "number of events pushed to the event-queue")
+    self._metrics.counter("webradio_events_published_total",
+                          "number of events published to the ring-buffer")
+    self._metrics.counter("webradio_events_merged_total",
+                          "number of events merged by coalescing")
+    self._metrics.counter("webradio_events_dispatched_total",
+                          "number of events delivered to consumers")
+    self._metrics.counter("webradio_events_dropped_total",
+                          "number of events missed by lagging consumers")
+    self._metrics.gauge("webradio_consumers","number of event-consumers")
+    self._metrics.gauge("webradio_consumer_depth",
+                        "number of events not yet read by a consumer")
+    self._metrics.gauge("webradio_consumer_dropped",
+                        "number of events missed by a consumer")
+    self._metrics.add_collector(self._collect_metrics)
+
+  # --- update consumer-metrics   --------------------------------------------
+
+  def _collect_metrics(self):
+    """ update gauges of current consumers (called for every scrape) """
+
+    with self._lock:
+      consumers = [(c.id,max(0,self._seq-c.cursor+1)+len(c.pending),c.dropped)
+                   for c in self._consumers.values()]
+    self._metrics.clear("webradio_consumer_depth")
+    self._metrics.clear("webradio_consumer_dropped")
+    self._metrics.set("webradio_consumers",len(consumers))
+    for id,depth,dropped in consumers:
+      self._metrics.set("webradio_consumer_depth",depth,consumer=id)
+      self._metrics.set("webradio_consumer_dropped",dropped,consumer=id)
+
+  # --- return event-statistics   --------------------------------------------
+
+  def get_event_stats(self):
+    """ return number of received, published and merged events """
+
+    with self._lock:
+      return {'received':  self._stats['received'],
+              'published': self._stats['published'],
+              'merged':    dict(self._stats['merged'])}
 
   # --- push an event to the input queue   -----------------------------------
 
@@ -54,79 +206,343 @@ class RadioEvents(Base):
 
   # --- add a consumer   -----------------------------------------------------
 
-  def add_consumer(self,id):
-    """ add a consumer to the list of consumers """
+  def add_consumer(self,id,last_id=None,types=None):
+    """ add a consumer to the list of consumers. If last_id is the id of
+        an event still in the buffer, the consumer starts with the next
+        event, otherwise with a snapshot of version and state.
+        If types is given, the consumer only receives events of these types.
+        Types prefixed with '-' are excluded, a list of only excluded types
+        receives all other types.
+    """
 
-    if id in self._consumers:
-      self.msg("RadioEvents: reusing consumer-queue with id %s" % id)
-      return self._consumers[id]
-    else:
-      self.msg("RadioEvents: adding consumer with id %s" % id)
-      with self._lock:
-        self._consumers[id] = queue.Queue(RadioEvents.QUEUE_SIZE)
-      try:
-        ev = {'type': 'version','value': self._api.get_version()}
-        ev['text'] = self._formatter.format(ev)
-        self._consumers[id].put_nowait(ev)
-        ev = {'type': 'state','value': self._api.get_state()}
-        ev['text'] = self._formatter.format(ev)
-        self._consumers[id].put_nowait(ev)
+    with self._lock:
+      if id in self._consumers:
+        self.msg("RadioEvents: reusing consumer with id %s" % id)
         return self._consumers[id]
-      except:
-        with self._lock:
-          del self._consumers[id]
-        return None
+      self.msg("RadioEvents: adding consumer with id %s (types: %r)" %
+               (id,types))
+      if types:
+        types = frozenset(types)
+        if not types in self._filters:
+          self._filters[types] = [threading.Condition(self._lock),0]
+        self._filters[types][1] += 1
+        cond = self._filters[types][0]
+      else:
+        types = None
+        cond  = self._cond
+      consumer = EventConsumer(self,id,self._seq+1,types,cond)
+      last_seq = self._parse_id(last_id)
+      if (last_seq is not None and
+          self._seq-self._ring_size <= last_seq <= self._seq):
+        self.msg("RadioEvents: replaying %d events for consumer %s" %
+                 (self._seq-last_seq,id))
+        consumer.cursor = last_seq+1
+      else:
+        consumer.pending.extend(self._get_snapshot(types))
+      self._consumers[id] = consumer
+      tracking = self._wants_position(consumer)
+      if tracking:
+        self._position_consumers += 1
+    if tracking:
+      self._update_tracking()
+    return consumer
 
   # --- remove a consumer   --------------------------------------------------
 
   def del_consumer(self,id):
     """ delete a consumer from the list of consumers """
 
-    if id in self._consumers:
-      self._consumers[id].put(None)
-      with self._lock:
-        del self._consumers[id]
+    tracking = False
+    with self._lock:
+      if id in self._consumers:
+        consumer = self._consumers.pop(id)
+        consumer.closed = True
+        consumer.cond.notify_all()
+        if consumer.types:
+          self._filters[consumer.types][1] -= 1
+          if not self._filters[consumer.types][1]:
+            del self._filters[consumer.types]
+        tracking = self._wants_position(consumer)
+        if tracking:
+          self._position_consumers -= 1
+    if tracking:
+      self._update_tracking()
+
+  # --- check if a consumer receives position-events   -----------------------
+
+  def _wants_position(self,consumer):
+    """ return True if the consumer receives position-events. Internal
+        consumers (id starting with '_') are not counted.
+    """
+
+    return (not consumer.id.startswith('_') and
+            self._matches(consumer.types,'position'))
+
+  # --- check if an event-type passes a subscription   -----------------------
+
+  def _matches(self,types,type):
+    """ return True if events of the given type pass the subscription """
+
+    if not types or type in types:
+      return True
+    elif '-'+type in types:
+      return False
+    else:
+      # only excluded types: all other types pass
+      return all(t.startswith('-') for t in types)
+
+  # --- start/stop position-events of the backend   --------------------------
+
+  def _update_tracking(self):
+    """ tell the backend if position-events are needed (called without
+        self._lock, since the backend holds its lock while pushing events)
+    """
+
+    track_position = getattr(self._api,'_track_position',None)
+    if track_position:
+      with self._track_lock:
+        track_position(self._position_consumers > 0)
+
+  # --- parse event-id   -----------------------------------------------------
+
+  def _parse_id(self,event_id):
+    """ return sequence-number of the given event-id or None """
+
+    if not event_id:
+      return None
+    try:
+      epoch, seq = event_id.split("-")
+      if epoch == self._epoch:
+        return int(seq)
+    except ValueError:
+      pass
+    return None
+
+  # --- create snapshot-events for a new consumer   --------------------------
+
+  def _get_snapshot(self,types=None,seq=None):
+    """ return list of (event,frame)-tuples for version and state """
+
+    if seq is None:
+      seq = self._seq
+    snapshot = []
+    if self._matches(types,'version'):
+      snapshot.append(self._encode(
+        {'type': 'version','value': self._api.get_version()},seq))
+    if self._matches(types,'state'):
+      version, state = self._api._get_state_snapshot()
+      snapshot.append(self._encode(
+        {'type': 'state','value': state,'version': version},seq))
+    return snapshot
+
+  # --- format and serialize event   -----------------------------------------
+
+  def _encode(self,event,seq):
+    """ add text to event and return tuple (event,SSE-frame) """
+
+    event['text'] = self._formatter.format(event)
+    frame = ("id: %s-%d\ndata: %s\n\n" %
+             (self._epoch,seq,json.dumps(event))).encode('utf-8')
+    return (event,frame)
+
+  # --- read next event for a consumer   -------------------------------------
+
+  def _read(self,consumer,block,timeout):
+    """ return next (event,frame)-tuple for the given consumer """
+
+    if timeout is not None:
+      deadline = time.monotonic() + timeout
+    with self._cond:
+      while True:
+        if consumer.pending:
+          return consumer.pending.popleft()
+        elif consumer.closed:
+          return (None,None)
+        elif consumer.cursor <= self._seq:
+          oldest = max(1,self._seq-self._ring_size+1)
+          if consumer.cursor < oldest and self._is_lagged(consumer):
+            # consumer is too slow: send marker, resync with full state and
+            # continue with the oldest event still in the buffer
+            self.msg("RadioEvents: consumer %s lagged by %d events" %
+                     (consumer.id,oldest-consumer.cursor))
+            consumer.dropped += oldest-consumer.cursor
+            self._metrics.inc("webradio_events_dropped_total",
+                              oldest-consumer.cursor)
+            consumer.pending.append(self._encode(
+              {'type': 'lagged', 'value': {'missed': oldest-consumer.cursor}},
+              oldest-1))
+            consumer.pending.extend(
+              self._get_snapshot(consumer.types or ['state'],oldest-1))
+            consumer.cursor = oldest
+            continue
+          consumer.cursor = max(consumer.cursor,oldest)
+          entry = self._ring[consumer.cursor % self._ring_size]
+          consumer.cursor += 1
+          if self._matches(consumer.types,entry[0]['type']):
+            self._metrics.inc("webradio_events_dispatched_total")
+            return entry
+        elif not block:
+          raise queue.Empty
+        elif timeout is None:
+          consumer.cond.wait()
+        else:
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            raise queue.Empty
+          consumer.cond.wait(remaining)
+
+  # --- check if consumer missed events   ------------------------------------
+
+  def _is_lagged(self,consumer):
+    """ check if events for the consumer were dropped from the ring-buffer
+        (called with lock held and consumer.cursor < oldest event)
+    """
+
+    if not consumer.types:
+      return True
+    for type,seq in self._evicted.items():
+      if seq >= consumer.cursor and self._matches(consumer.types,type):
+        return True
+    return False
+
+  # --- append event to the ring-buffer   ------------------------------------
+
+  def _publish(self,event):
+    """ append event to the ring-buffer and wake up waiting consumers """
+
+    # only this thread increments the sequence-number, so no lock is needed
+    entry = self._encode(event,self._seq+1)
+    with self._cond:
+      self._seq += 1
+      slot = self._seq % self._ring_size
+      if self._ring[slot]:
+        self._evicted[self._ring[slot][0]['type']] = self._seq-self._ring_size
+      self._ring[slot] = entry
+      self._cond.notify_all()
+      for types,(cond,_) in self._filters.items():
+        if self._matches(types,event['type']):
+          cond.notify_all()
+    self._stats['published'] += 1
+    self._metrics.inc("webradio_events_published_total",type=event['type'])
+    self._last_publish = time.monotonic()
+
+  # --- count merged events   ------------------------------------------------
+
+  def _count_merged(self,type,n=1):
+    """ update statistics of merged events """
+
+    with self._lock:
+      self._stats['merged'][type] = self._stats['merged'].get(type,0) + n
+    self._metrics.inc("webradio_events_merged_total",n,type=type)
+
+  # --- coalesce or publish event   ------------------------------------------
+
+  def _coalesce(self,event,now):
+    """ publish event or hold it back for coalescing """
+
+    type = event['type']
+    if not self._window:
+      self._publish(event)
+    elif type in self._coalesce_types:
+      if type in self._held:
+        # within window: latest value wins (patches are merged)
+        if self._held[type][1]:
+          self._count_merged(type)
+          event = self._merge(self._held[type][1],event)
+        self._held[type][1] = event
+      else:
+        # first event publishes immediately and opens the window
+        self._publish(event)
+        self._held[type] = [now+self._window,None]
+    elif type in self._batch_types:
+      if type in self._batches:
+        self._batches[type][1].append(event)
+      else:
+        self._batches[type] = [now+self._window,[event]]
+    else:
+      self._publish(event)
+
+  # --- merge two events of the same type   ---------------------------------
+
+  def _merge(self,old,new):
+    """ merge patch-style events (state_delta), otherwise return new event """
+
+    if (isinstance(old['value'],dict) and 'patch' in old['value'] and
+        isinstance(new['value'],dict) and 'patch' in new['value']):
+      value = dict(new['value'])
+      value['base']  = old['value']['base']
+      value['patch'] = old['value']['patch'] + new['value']['patch']
+      return {'type': new['type'], 'value': value}
+    else:
+      return new
+
+  # --- publish coalesced events with expired windows   ----------------------
+
+  def _flush(self,now,force=False):
+    """ publish held and batched events if their window expired """
+
+    for type in list(self._held.keys()):
+      deadline, event = self._held[type]
+      if deadline <= now or force:
+        if event:
+          self._publish(event)
+          self._held[type] = [now+self._window,None]
+        else:
+          del self._held[type]
+
+    for type in list(self._batches.keys()):
+      deadline, events = self._batches[type]
+      if deadline <= now or force:
+        del self._batches[type]
+        if len(events) == 1:
+          self._publish(events[0])
+        else:
+          self._count_merged(type,len(events)-1)
+          self._publish({'type': type, 'value': [e['value'] for e in events]})
+
+  # --- time until next window expires   -------------------------------------
+
+  def _get_timeout(self,now):
+    """ return timeout for the input-queue """
+
+    deadlines = ([h[0] for h in self._held.values()] +
+                 [b[0] for b in self._batches.values()])
+    if deadlines:
+      return max(0,min(1,min(deadlines)-now))
+    else:
+      return 1
 
   # --- multiplex events   ---------------------------------------------------
 
   def _process_events(self):
-    """ pull events from the input-queue and distribute to the consumer queues """
+    """ pull events from the input-queue and publish them to the ring-buffer """
 
     self.msg("RadioEvents: starting event-processing")
-    count = 0
+    self._last_publish = time.monotonic()
     while not self._stop_event.is_set():
       try:
-        event = self._input_queue.get(block=True,timeout=1)   # block 1s
+        event = self._input_queue.get(block=True,
+                                      timeout=self._get_timeout(time.monotonic()))
         self._input_queue.task_done()
         self.msg("RadioEvents: received event: %r" % (event,))
-        count = 0
+        self._stats['received'] += 1
+        self._metrics.inc("webradio_events_received_total",type=event['type'])
+        self._coalesce(event,time.monotonic())
       except queue.Empty:
-        count = (count+1) % RadioEvents.KEEP_ALIVE_INTERVAL
-        if count > 0:
-          continue
-        else:
-          #self.msg("RadioEvents: publishing keep-alive")
-          event = {'type': 'keep_alive', 'value':
-                   datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
-      event['text'] = self._formatter.format(event)
-      stale_consumers = []
-      for id, consumer in self._consumers.items():
-        try:
-          consumer.put_nowait(event)
-        except queue.Full:
-          stale_consumers.append(id)
-
-      # delete stale consumers
-      with self._lock:
-        for id in stale_consumers:
-          self.msg("RadioEvents: deleting stale queue with id %s" % id)
-          del self._consumers[id]
+        pass
+
+      now = time.monotonic()
+      self._flush(now)
+      if now - self._last_publish >= RadioEvents.KEEP_ALIVE_INTERVAL:
+        #self.msg("RadioEvents: publishing keep-alive")
+        self._publish({'type': 'keep_alive', 'value':
+                       datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+
+    self._flush(time.monotonic(),force=True)
 
     self.msg("RadioEvents: stopping event-processing")
-    for consumer in self._consumers.values():
-      try:
-        consumer.put_nowait(None)
-      except:
-        pass
+    with self._cond:
+      for consumer in self._consumers.values():
+        consumer.closed = True
+        consumer.cond.notify_all()
     self.msg("RadioEvents: event-processing finished")
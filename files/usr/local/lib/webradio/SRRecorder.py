@@ -15,7 +15,7 @@
 #
 # -----------------------------------------------------------------------------
 
-import threading, os, datetime, urllib.request
+import threading, os, datetime, time, urllib.request
 from threading import Thread
 
 from webradio import Base
@@ -38,6 +38,11 @@ class Recorder(Thread,Base):
 
     self.read_config()
     self.register_apis()
+    self._metrics = app.metrics
+    self._metrics.counter("webradio_recorder_bytes_total",
+                          "number of bytes recorded")
+    self._metrics.gauge("webradio_recorder_bytes_per_second",
+                        "current recording rate")
 
   # --- read configuration   --------------------------------------------------
 
@@ -118,10 +123,18 @@ class Recorder(Thread,Base):
                                        'duration': self._duration}})
       conn = urllib.request.urlopen(request)
       self._rec_start_dt = datetime.datetime.now()
+      last = time.monotonic()
       while(not self._rec_stop_event.is_set() and
             (datetime.datetime.now()-self._rec_start_dt).total_seconds() <
                                                            60*self._duration):
-        stream.write(conn.read(Recorder.RECORD_CHUNK))
+        data = conn.read(Recorder.RECORD_CHUNK)
+        stream.write(data)
+        now = time.monotonic()
+        self._metrics.inc("webradio_recorder_bytes_total",len(data))
+        self._metrics.set("webradio_recorder_bytes_per_second",
+                          len(data)/max(now-last,0.001))
+        last = now
+      self._metrics.set("webradio_recorder_bytes_per_second",0)
 
     duration = int((datetime.datetime.now()-self._rec_start_dt).total_seconds()/60)
     self.msg('Recorder: recording finished')
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Pi-Webradio: implementation of class StaticFiles
+#
+# The class StaticFiles keeps the static files of the web-gui in memory,
+# together with precompressed (gzip and optionally brotli) variants and
+# strong ETags. URLs created with asset_url() carry the ETag as version,
+# such URLs are served with "Cache-Control: immutable", all others must be
+# revalidated by the browser (which then usually gets a 304).
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# ----------------------------------------------------------------------------
+
+import os, gzip, hashlib, mimetypes, threading
+
+from webradio import Base
+
+# brotli is optional
+have_brotli = False
+try:
+  import brotli
+  have_brotli = True
+except:
+  pass
+
+# --- a single static file   -------------------------------------------------
+
+class StaticFile(object):
+  """ content, compressed variants and meta-data of a static file """
+
+  MIN_SIZE = 256                            # don't compress smaller files
+
+  # types that are already compressed
+  NO_COMPRESS = ['image/jpeg','image/png','image/gif','font/woff',
+                 'font/woff2','application/font-woff','application/font-woff2']
+
+  def __init__(self,path,use_brotli):
+    """ read file and create compressed variants """
+
+    with open(path,"rb") as f:
+      self.data = f.read()
+    self.mtime        = os.path.getmtime(path)
+    self.etag         = hashlib.sha1(self.data).hexdigest()[:16]
+    self.content_type = (mimetypes.guess_type(path)[0] or
+                         'application/octet-stream')
+    if self.content_type.startswith('text/'):
+      self.content_type += '; charset=utf-8'
+
+    # variants: encoding -> data
+    self.variants = {}
+    if (len(self.data) < StaticFile.MIN_SIZE or
+        self.content_type in StaticFile.NO_COMPRESS):
+      return
+    data = gzip.compress(self.data,9)
+    if len(data) < 0.9*len(self.data):
+      self.variants['gzip'] = data
+    if use_brotli:
+      data = brotli.compress(self.data)
+      if len(data) < 0.9*len(self.data):
+        self.variants['br'] = data
+
+# --- static files of the web-root   -----------------------------------------
+
+class StaticFiles(Base):
+  """ serve precompressed static files with ETags """
+
+  DIRS          = ['css','js','webfonts','images']
+  MAX_AGE       = 31536000                  # one year for versioned urls
+
+  def __init__(self,web_root,debug=False,precompress=True,use_brotli=True):
+    """ initialization """
+
+    self.debug       = debug
+    self._web_root   = os.path.realpath(web_root)
+    self._precompress= precompress
+    self._use_brotli = use_brotli and have_brotli
+    self._files      = {}                   # relative path -> StaticFile
+    self._lock       = threading.Lock()
+
+    if self._precompress:
+      self._load_all()
+
+  # --- load all files of the static directories   -------------------------
+
+  def _load_all(self):
+    """ read and compress all files of the static directories """
+
+    count = 0
+    size  = [0,0,0]
+    for dir in StaticFiles.DIRS:
+      for root, _, files in os.walk(os.path.join(self._web_root,dir)):
+        for f in files:
+          relpath = os.path.relpath(os.path.join(root,f),self._web_root)
+          entry   = self._load(relpath)
+          if entry:
+            count   += 1
+            size[0] += len(entry.data)
+            size[1] += len(entry.variants.get('gzip',entry.data))
+            size[2] += len(entry.variants.get('br',entry.data))
+    self.msg("StaticFiles: loaded %d files (%d bytes, gzip: %d, br: %d)" %
+             (count,*size))
+
+  # --- load a single file   -----------------------------------------------
+
+  def _load(self,relpath):
+    """ load file (relative to web-root) and add it to the cache """
+
+    path = os.path.realpath(os.path.join(self._web_root,relpath))
+    if (os.path.commonpath([self._web_root,path]) != self._web_root or
+        not os.path.isfile(path)):
+      return None
+    try:
+      entry = StaticFile(path,self._use_brotli)
+    except OSError:
+      return None
+    with self._lock:
+      self._files[os.path.relpath(path,self._web_root)] = entry
+    return entry
+
+  # --- return file-object   -----------------------------------------------
+
+  def get(self,relpath):
+    """ return StaticFile for given path or None """
+
+    relpath = os.path.normpath(relpath)
+    entry   = self._files.get(relpath)
+    if entry and not self._precompress:
+      # without precompression, check for changed files
+      try:
+        if os.path.getmtime(os.path.join(self._web_root,relpath)) != entry.mtime:
+          entry = None
+      except OSError:
+        entry = None
+    if not entry:
+      entry = self._load(relpath)
+    return entry
+
+  # --- return versioned url   ---------------------------------------------
+
+  def asset_url(self,relpath):
+    """ return url of file with its ETag as version (for templates) """
+
+    entry = self.get(relpath)
+    if entry:
+      return "/%s?v=%s" % (relpath,entry.etag)
+    else:
+      return "/" + relpath
+
+  # --- create response   --------------------------------------------------
+
+  def response(self,relpath,accept_encoding='',if_none_match=None,
+               version=None):
+    """ return tuple (status,headers,body) """
+
+    entry = self.get(relpath)
+    if not entry:
+      return (404,{'Content-Type': 'application/json'},
+              b'{"msg": "not found"}')
+
+    # select variant
+    encoding = None
+    accepted = [e.split(';')[0].strip() for e in accept_encoding.split(',')]
+    for enc in ['br','gzip']:
+      if enc in entry.variants and enc in accepted:
+        encoding = enc
+        break
+    etag = '"%s-%s"' % (entry.etag,encoding) if encoding else '"%s"' % entry.etag
+
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding'}
+    if version == entry.etag:
+      headers['Cache-Control'] = ('public, max-age=%d, immutable' %
+                                  StaticFiles.MAX_AGE)
+    else:
+      headers['Cache-Control'] = 'no-cache'
+
+    # check If-None-Match (all variants share the same content)
+    if if_none_match:
+      tags = [t.strip() for t in if_none_match.split(',')]
+      tags = [t[2:] if t.startswith('W/') else t for t in tags]
+      if '*' in tags or any([t.strip('"').startswith(entry.etag) for t in tags]):
+        return (304,headers,b'')
+
+    headers['Content-Type'] = entry.content_type
+    if encoding:
+      headers['Content-Encoding'] = encoding
+      return (200,headers,entry.variants[encoding])
+    else:
+      return (200,headers,entry.data)
@@ -181,10 +181,18 @@ class VoskController(Base):
               elif self._cmd_mode:
                 # ... and only if in command-mode
                 self._on_success()
-                yield self._wmap[phrase]
-                self._on_inactive()
-                if self._wmap[phrase][0] != "vol_mute_on":
+                api = self._wmap[phrase]
+                if api[0] == "vol_mute_on":
+                  yield api
+                  self._on_inactive()
+                elif api[0].startswith("_"):
+                  yield api
+                  self._on_inactive()
                   yield ["vol_mute_off"]
+                else:
+                  # execute command and unmute with a single request
+                  yield [api,["vol_mute_off"]]
+                  self._on_inactive()
               else:
                 self.msg("VoskController: not in command-mode, ignoring %s" %
                          phrase)
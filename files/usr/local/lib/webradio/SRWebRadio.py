@@ -13,7 +13,7 @@
 #
 # -----------------------------------------------------------------------------
 
-import os, sys, json, traceback, threading
+import os, sys, json, traceback, threading, copy
 import configparser
 
 from webradio import *
@@ -25,6 +25,12 @@ class WebRadio(Base):
 
   VERSION = "Simone"
 
+  # available playback-backends
+  BACKENDS = {
+    'mpg123': Mpg123,
+    'fake':   FakeBackend
+    }
+
   def __init__(self,options):
     """ initialization """
 
@@ -39,7 +45,8 @@ class WebRadio(Base):
     self._threads    = []                   # thread-store
     self.stop_event  = threading.Event()
 
-    # create API-object and register our own functions
+    # create metrics and API-object and register our own functions
+    self.metrics = Metrics(self)
     self.api = Api(self)
     self.register_apis()
 
@@ -52,7 +59,7 @@ class WebRadio(Base):
       self._objects = [self,self.radio,self.recorder]
     elif options.do_play:
       self._events  = RadioEvents(self)
-      self.backend  = Mpg123(self)
+      self.backend  = self._create_backend()
       self.radio    = Radio(self)
       self.player   = Player(self)
       self._objects = [self,self.radio,self.player,self.backend]
@@ -62,15 +69,21 @@ class WebRadio(Base):
       self._objects = [self,self.radio]
     else:
       self._events  = RadioEvents(self)
-      self._server  = WebServer(self)
-      self.backend  = Mpg123(self)
+      if self._server_mode == "asyncio":
+        self._server  = AsyncWebServer(self)
+      else:
+        self._server  = WebServer(self)
+      self.backend  = self._create_backend()
       self.radio    = Radio(self)
       self.player   = Player(self)
       self.recorder = Recorder(self)
       self._objects = [self,self.radio,self.player,
                        self.recorder,self.backend]
 
-    self._state = {'mode': 'radio'}
+    self._state         = {'mode': 'radio'}
+    self._state_lock    = threading.Lock()
+    self._state_version = 0                 # version of last published state
+    self._state_patch   = {}                # unpublished changes: path->op
     self._load_state()
     if self.backend:
       self.backend.create()
@@ -86,6 +99,26 @@ class WebRadio(Base):
     else:
       self.debug  = self.get_value(self.parser,"GLOBAL", "debug","0") == "1"
 
+    if getattr(options,'backend',None):
+      self._backend_name = options.backend
+    else:
+      self._backend_name = self.get_value(self.parser,"GLOBAL","backend",
+                                          "mpg123")
+
+    # section [WEB]
+    self._server_mode = self.get_value(self.parser,"WEB","server","threaded")
+
+  # --- create playback-backend   --------------------------------------------
+
+  def _create_backend(self):
+    """ create backend configured in [GLOBAL] """
+
+    if self._backend_name not in WebRadio.BACKENDS:
+      self.msg("[ERROR] WebRadio: unknown backend %s" % self._backend_name,
+               True)
+      sys.exit(3)
+    return WebRadio.BACKENDS[self._backend_name](self)
+
   # --- register APIs   ------------------------------------------------------
 
   def register_apis(self):
@@ -98,6 +131,8 @@ class WebRadio(Base):
     self.api.sys_halt         = self.sys_halt
     self.api.update_state     = self.update_state
     self.api.get_state        = self.get_state
+    self.api._cache_api("get_state","state")
+    self.api._get_state_snapshot = self._get_state_snapshot
 
   # --- return version   ---------------------------------------------------
 
@@ -110,9 +145,21 @@ class WebRadio(Base):
   # --- return state   -----------------------------------------------------
 
   def get_state(self):
-    """ return state """
+    """ return copy of state with the additional field version (the
+        version of the last published state_delta)
+    """
 
-    return self._state
+    version, state = self._get_state_snapshot()
+    state['version'] = version
+    return state
+
+  # --- return versioned copy of state   -----------------------------------
+
+  def _get_state_snapshot(self):
+    """ return tuple (version,state) """
+
+    with self._state_lock:
+      return (self._state_version,copy.deepcopy(self._state))
 
   # --- shutdown system   -----------------------------------------------------
 
@@ -177,28 +224,64 @@ class WebRadio(Base):
   # --- update (and distribute) state   ---------------------------------------
 
   def update_state(self,state=None,section=None,key=None,value=None,publish=True):
-    """ update state and publish as event """
-
-    if state:
-      # update on key-level
-      for s in state.keys():
-        if isinstance(s,dict):
-          for k in s.keys():
-            if s in self._state:
-              self._state[s][k] = state[s][k]
-            else:
-              self._state[s] = {k:state[s][k]}
+    """ update state and publish changes as state_delta-event.
+        Unpublished changes are collected and sent with the next
+        published update.
+    """
+
+    with self._state_lock:
+      if state:
+        # update on key-level
+        for s in state.keys():
+          if isinstance(s,dict):
+            for k in s.keys():
+              if s in self._state:
+                self._set_state(self._state[s],[s,k],state[s][k])
+              else:
+                self._set_state(self._state,[s],{k:state[s][k]})
+          else:
+            self._set_state(self._state,[s],state[s])
+      elif section and key:
+        if section in self._state:
+          self._set_state(self._state[section],[section,key],value)
         else:
-          self._state[s] = state[s]
-    elif section and key:
-      if section in self._state:
-        self._state[section][key] = value
-      else:
-        self._state[section] = {key:value}
-    if publish:
-      self.api._push_event({'type': 'state', 'value': self._state})
+          self._set_state(self._state,[section],{key:value})
+
+      if not publish or not self._state_patch:
+        return
+      event = {'type': 'state_delta',
+               'value': {'base':    self._state_version,
+                         'version': self._state_version+1,
+                         'patch':   list(self._state_patch.values())}}
+      self._state_version += 1
+      self._state_patch    = {}
+      self.api._invalidate("state")
+      self.api._push_event(event)
     return
 
+  # --- set single value of state and record change   -----------------------
+
+  def _set_state(self,parent,path,value):
+    """ set value in parent-dict and record a JSON-patch operation """
+
+    key = path[-1]
+    if key in parent:
+      if parent[key] == value:
+        return
+      op = 'replace'
+    else:
+      op = 'add'
+    parent[key] = value
+
+    # path as JSON-pointer (RFC 6901), later changes of a path replace
+    # earlier ones and move to the end of the patch
+    pointer = "".join(["/"+str(p).replace("~","~0").replace("/","~1")
+                       for p in path])
+    self._state_patch.pop(pointer,None)
+    self._state_patch[pointer] = {'op': op, 'path': pointer,
+                                  'value': copy.deepcopy(value)}
+    self.api._invalidate("state")
+
   # --- query state of objects and save   -------------------------------------
 
   def _save_state(self):
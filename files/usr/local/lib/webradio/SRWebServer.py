@@ -15,15 +15,19 @@
 import os, json, queue, traceback, uuid
 
 from flask import Flask, Response, render_template, request, make_response
-from flask import send_from_directory, send_file
 
 from werkzeug.serving import make_server, WSGIRequestHandler
 
 from webradio import Base
+from webradio import StaticFiles
+from webradio import Cover
+from webradio import RadioEvents
 
 class WebServer(Base):
   """ Serve GUI and process API-requests """
 
+  MAX_BATCH = 32                            # max. number of calls per batch
+
   # --- constructor   --------------------------------------------------------
 
   def __init__(self,app):
@@ -35,9 +39,20 @@ class WebServer(Base):
 
     self.stop_event    = app.stop_event
     self.read_config(app.options.pgm_dir)
+    self._static       = StaticFiles(self._web_root,self.debug,
+                                     self._precompress,self._brotli)
+    self._cover        = Cover(app)
+    self._setup()
+
+  # --- create web-application   ---------------------------------------------
+
+  def _setup(self):
+    """ create flask-application and set up routing """
+
     self._flask = Flask('pi-webradio',template_folder=self._web_root,
                         root_path=self._web_root)
     self._flask.debug = self.debug
+    self._flask.jinja_env.globals['asset_url'] = self._static.asset_url
     self._set_routes()
 
   # --- read configuration   --------------------------------------------------
@@ -53,6 +68,10 @@ class WebServer(Base):
       os.path.join(pgm_dir,"..","lib","webradio","web"))
     self._web_root  = self.get_value(self._app.parser,"WEB","web_root",
                                          default_web_root)
+    self._precompress = self.get_value(self._app.parser,"WEB",
+                                       "precompress","1") == "1"
+    self._brotli      = self.get_value(self._app.parser,"WEB",
+                                       "brotli","1") == "1"
 
   # --- set up routing   -----------------------------------------------------
 
@@ -70,7 +89,10 @@ class WebServer(Base):
                              'player_get_cover',self.get_cover)
     self._flask.add_url_rule('/api/update_state','update_state',
                              self.update_state,methods=['POST'])
+    self._flask.add_url_rule('/api/batch','batch',
+                             self.process_batch,methods=['POST'])
     self._flask.add_url_rule('/api/<path:api>','api',self.process_api)
+    self._flask.add_url_rule('/metrics','metrics',self.get_metrics)
 
   # --- return absolute path of web-files   ----------------------------------
 
@@ -80,53 +102,159 @@ class WebServer(Base):
 
   # --- static routes   ------------------------------------------------------
 
+  def _send_static(self,subdir,filepath):
+    """ send (precompressed) static file """
+
+    status, headers, body = self._static.response(
+      os.path.join(subdir,filepath),
+      request.headers.get('Accept-Encoding',''),
+      request.headers.get('If-None-Match'),
+      request.args.get('v'))
+    response = make_response((body,status))
+    response.headers.update(headers)
+    return response
+
   def css_pages(self,filepath):
-    return send_from_directory(self._get_path('css'),filepath)
+    return self._send_static('css',filepath)
 
   def webfonts(self,filepath):
-    return send_from_directory(self._get_path('webfonts'),filepath)
+    return self._send_static('webfonts',filepath)
   
   def images(self,filepath):
-    return send_from_directory(self._get_path('images'),filepath)
+    return self._send_static('images',filepath)
   
   def js_pages(self,filepath):
-    return send_from_directory(self._get_path('js'),filepath)
+    return self._send_static('js',filepath)
   
   # --- main page   ----------------------------------------------------------
 
   def main_page(self):
     return render_template("index.html")
 
-  # --- process API-call   -------------------------------------------------
+  # --- call API (independent of web-framework)   --------------------------
 
-  def process_api(self,api):
-    """ process api """
+  def _call_api(self,api,args):
+    """ execute api, return tuple (status,result) """
 
     if api.startswith("_"):
       # internal API, illegal request!
       self.msg("illegal api-call: %s" % api)
-      msg = '"illegal request /api/%s"' % api
-      response = make_response(('{"msg": ' + msg +'}',400))
-      response.content_type = 'application/json'
-      return response
+      return (400,{"msg": "illegal request /api/%s" % api})
+
+    self.msg("processing api-call: %s" % api)
+    try:
+      return (200,self._api._exec(api,**args))
+    except Exception as ex:
+      return self._map_exception(api,ex)
+
+  # --- map exception of an API-call to status and result   ----------------
+
+  def _map_exception(self,api,ex):
+    """ return tuple (status,result) for an exception raised by an api """
+
+    if isinstance(ex,NotImplementedError):
+      self.msg("illegal request: /api/%s" % api)
+      return (400,{"msg": "/api/%s not implemented" % api})
+    elif isinstance(ex,ValueError):
+      self.msg("invalid request: /api/%s: %s" % (api,ex))
+      return (400,{"msg": str(ex)})
     else:
-      self.msg("processing api-call: %s" % api)
+      self.msg("exception while calling: /api/%s" % api)
+      traceback.print_exception(type(ex),ex,ex.__traceback__)
+      return (500,{"msg": "internal server error"})
+
+  # --- execute API-call (independent of web-framework)   ------------------
+
+  def _exec_api(self,api,args,if_none_match=None):
+    """ execute api, return tuple (status,json-string,headers) """
+
+    if not args and not api.startswith("_"):
+      # read-only APIs are served from the response-cache
       try:
-        response = self._api._exec(api,**request.args)
-        return json.dumps(response)
-      except NotImplementedError as err:
-        self.msg("illegal request: /api/%s" % api)
-        msg = '"/api/%s not implemented"' % api
-        response = make_response(('{"msg": ' + msg +'}',400))
-        response.content_type = 'application/json'
-        return response
+        cached = self._api._exec_cached(api,if_none_match)
       except Exception as ex:
-        self.msg("exception while calling: /api/%s" % api)
-        traceback.print_exc()
-        msg = '"internal server error"'
-        response = make_response(('{"msg": ' + msg +'}',500))
-        response.content_type = 'application/json'
-        return response
+        status, result = self._map_exception(api,ex)
+        return (status,json.dumps(result),{})
+      if cached:
+        etag, body = cached
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        self.msg("processing api-call: %s (%s)" %
+                 (api,"cached" if body else "not modified"))
+        return (200,body,headers) if body else (304,'',headers)
+
+    status, result = self._call_api(api,args)
+    return (status,json.dumps(result),{})
+
+  # --- execute list of API-calls (independent of web-framework)   ---------
+
+  def _exec_batch(self,body):
+    """ execute list of api-calls in order, return tuple (status,json-string).
+        Every call is a dict {"api": name, "args": {...}}, the result is a
+        list of dicts {"api": name, "status": status, "result": result}.
+    """
+
+    try:
+      calls = json.loads(body)
+      if (not isinstance(calls,list) or len(calls) > WebServer.MAX_BATCH or
+          not all([isinstance(c,dict) and isinstance(c.get('api'),str) and
+                   isinstance(c.get('args',{}),dict) for c in calls])):
+        raise ValueError("invalid batch")
+    except ValueError:
+      return (400,json.dumps({"msg": "invalid request /api/batch"}))
+
+    results = []
+    for call in calls:
+      status, result = self._call_api(call['api'],call.get('args',{}))
+      results.append({"api": call['api'], "status": status, "result": result})
+    return (200,json.dumps(results))
+
+  # --- create error-response   --------------------------------------------
+
+  def _error_response(self,status,body):
+    """ create json error-response """
+
+    response = make_response((body,status))
+    response.content_type = 'application/json'
+    return response
+
+  # --- process API-call   -------------------------------------------------
+
+  def process_api(self,api):
+    """ process api """
+
+    status, body, headers = self._exec_api(api,request.args.to_dict(),
+                                           request.headers.get('If-None-Match'))
+    if status == 200 and not headers:
+      return body
+    elif status in [200,304]:
+      response = make_response((body,status))
+      response.headers.update(headers)
+      return response
+    else:
+      return self._error_response(status,body)
+
+  # --- process list of API-calls   ---------------------------------------
+
+  def process_batch(self):
+    """ process batch of apis """
+
+    status, body = self._exec_batch(request.get_data())
+    if status == 200:
+      return Response(body,mimetype='application/json')
+    else:
+      return self._error_response(status,body)
+
+  # --- update state (independent of web-framework)   ----------------------
+
+  def _update_state(self,state):
+    """ filter state sent from client, then update and redistribute """
+
+    # only a subset of the state is controlled by the client, so filter
+    # for valid values
+    for k in list(state.keys()):
+      if k not in ['webgui','mode']:
+        del state[k]
+    self._api.update_state(state=state)
 
   # --- publish state   ----------------------------------------------------
 
@@ -134,32 +262,47 @@ class WebServer(Base):
     """ update state and redistribute """
 
     try:
-      # only a subset of the state is controlled by the client, so filter
-      # for valid values
-      state = request.get_json(force=True)
-      for k in list(state.keys()):
-        if k not in ['webgui','mode']:
-          del state[k]
-      self._api.update_state(state=state)
+      self._update_state(request.get_json(force=True))
       return ""
     except:
       self.msg("WebRadio: exception while calling: /api/update_state")
       traceback.print_exc()
-      msg = '"internal server error"'
-      response = make_response(('{"msg": ' + msg +'}',500))
-      response.content_type = 'application/json'
+      return self._error_response(500,
+                                  json.dumps({"msg": "internal server error"}))
+
+  # --- return cover (independent of web-framework)   ----------------------
+
+  def _cover_response(self,size,if_none_match):
+    """ return tuple (status,headers,body) of cover or default image """
+
+    response = self._cover.response(self._api._player_get_cover_file(),
+                                    size,if_none_match)
+    if response:
       return response
+    else:
+      return self._static.response('images/default.png',
+                                   if_none_match=if_none_match)
 
   # --- return cover   -----------------------------------------------------
 
   def get_cover(self,dir="ignored"):
     """ return cover if available """
 
-    cover = self._api._player_get_cover_file()
-    if cover:
-      return send_file(cover)
-    else:
-      return send_from_directory(self._get_path('images'),'default.png')
+    status, headers, body = self._cover_response(
+      request.args.get('size'),request.headers.get('If-None-Match'))
+    response = make_response((body,status))
+    response.headers.update(headers)
+    return response
+
+  # --- add event-consumer for a SSE-client   -----------------------------
+
+  def _add_consumer(self,last_id,types):
+    """ add consumer for a client, return tuple (id,consumer) """
+
+    id = uuid.uuid4().hex
+    if types:
+      types = [t.strip() for t in types.split(',') if t.strip()]
+    return (id,self._api._add_consumer(id,last_id,types))
 
   # --- stream SSE (server sent events)   ----------------------------------
 
@@ -167,24 +310,44 @@ class WebServer(Base):
     """ stream SSE """
 
     try:
-      id = uuid.uuid4().hex
-      ev_queue = self._api._add_consumer(id)   # TODO: use session-id
+      # native EventSource sends a header, reconnecting-eventsource.js
+      # a query-parameter
+      id, ev_queue = self._add_consumer(
+        request.headers.get('Last-Event-ID',request.args.get('lastEventId')),
+        request.args.get('types'))
 
       def event_stream():
         while True:
-          ev = ev_queue.get()
-          ev_queue.task_done()
-          if ev:
-            sse = "data: %s\n\n" % json.dumps(ev)
+          # the frame is encoded once by RadioEvents and shared by all clients
+          try:
+            sse = ev_queue.get_frame(timeout=RadioEvents.KEEP_ALIVE_INTERVAL)
+          except queue.Empty:
+            # SSE-comment: filtered consumers don't receive keep-alive events,
+            # but writing detects broken connections
+            yield b": keep-alive\n\n"
+            continue
+          if sse:
             #self.msg("WebServer: serving event '%s'" % sse)
             yield sse
           else:
             break
 
-      return Response(event_stream(), mimetype='text/event-stream')
+      # the response is closed when the client disconnects or the stream
+      # ends, even if the generator never started
+      response = Response(event_stream(), mimetype='text/event-stream')
+      response.call_on_close(lambda: self._api._del_consumer(id))
+      return response
     except:
       traceback.print_exc()
 
+  # --- return metrics   ---------------------------------------------------
+
+  def get_metrics(self):
+    """ return metrics in text-format of Prometheus """
+
+    return Response(self._app.metrics.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
   # --- stop web-server   --------------------------------------------------
 
   def stop(self):
@@ -12,14 +12,24 @@
 # ----------------------------------------------------------------------------
 
 from . SRBase           import Base           as Base
+from . SRMetrics        import Metrics        as Metrics
 from . SRApi            import Api            as Api
 from . SREventFormatter import EventFormatter as EventFormatter
 from . SRRadioEvents    import RadioEvents    as RadioEvents
 from . SRRadio          import Radio          as Radio
+from . SRMp3Info        import Mp3Info        as Mp3Info
+from . SRMetaStore      import MetaStore      as MetaStore
+from . SRDirCache       import DirCache       as DirCache
+from . SRLibrary        import Library        as Library
 from . SRPlayer         import Player         as Player
 from . SRRecorder       import Recorder       as Recorder
+from . SRBackend        import Backend        as Backend
 from . SRMpg123         import Mpg123         as Mpg123
+from . SRFakeBackend    import FakeBackend    as FakeBackend
+from . SRCover          import Cover          as Cover
+from . SRStaticFiles    import StaticFiles    as StaticFiles
 from . SRWebServer      import WebServer      as WebServer
+from . SRAsyncWebServer import AsyncWebServer as AsyncWebServer
 from . SRWebRadio       import WebRadio       as WebRadio
 from . SRRadioClient    import RadioClient    as RadioClient
 from . SRKeyController  import KeyController  as KeyController
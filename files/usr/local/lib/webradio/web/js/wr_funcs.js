@@ -46,27 +46,32 @@ init_state();
 wr_file2index = {};
 
 /**
-  Timer-function for elapsed playing time
+   copy of the server-state, updated from state- and state_delta-events
+*/
+
+wr_server_state = {};
+wr_server_version = -1;
+
+/**
+  Display elapsed playing time
 
-  This is not exact due to multiple reasons, e.g. server playing the file
-  and client showing elapsed-time, elapsed time lost when toggling pause.
+  The server publishes the position of the backend with position-events,
+  so all clients show the same time (also after pause/resume).
 */
 wr_isPause = false;
-wr_update_play_time_id = null;
-function update_play_time(force=false) {
-  if (!wr_isPause || force) {
-    // update elapsed time and display
-    wr_state.player.time[0] += 1;
-    h = ~~(wr_state.player.time[0] / 3600);
-    m = ~~((wr_state.player.time[0]-h*3600) / 60);
-    s = Math.round(wr_state.player.time[0] -h*3600 - m*60);
-    if (h>0) {
-      elapsed = formatTime(h)+':'+formatTime(m)+':'+formatTime(s);
-    } else {
-      elapsed = formatTime(m)+':'+formatTime(s);
-    }
-    $("#wr_time_cur").text(elapsed);
-    elapsed_pc = 100*wr_state.player.time[0]/wr_state.player.time[1];
+function update_play_time() {
+  h = ~~(wr_state.player.time[0] / 3600);
+  m = ~~((wr_state.player.time[0]-h*3600) / 60);
+  s = Math.floor(wr_state.player.time[0] -h*3600 - m*60);
+  if (h>0) {
+    elapsed = formatTime(h)+':'+formatTime(m)+':'+formatTime(s);
+  } else {
+    elapsed = formatTime(m)+':'+formatTime(s);
+  }
+  $("#wr_time_cur").text(elapsed);
+  if (wr_state.player.time[1] > 0) {
+    elapsed_pc = Math.min(100,
+                          100*wr_state.player.time[0]/wr_state.player.time[1]);
     $("#wr_time_range").val(elapsed_pc);
     $("#wr_time_range").css("background-size",elapsed_pc+"% 100%");
   }
@@ -141,8 +146,8 @@ function on_open_tab_play(internal=false) {
 
 function on_open_tab_files() {
   if (!wr_state.player.last_dir) {
-    // get directory for server's current-directory
-    player_select_dir({'dir': '.'});
+    // show server's current-directory (cached, no need to select it)
+    player_show_dir();
     return;
   } else {
     scroll_to_current_file();
@@ -231,7 +236,12 @@ function get_events() {
     source.addEventListener('message', function(e) {
       data = JSON.parse(e.data);
       if (['icy_meta', 'icy_name','id3'].includes(data.type)) {
-        addInfo(data.text);
+        // batched events use one line per event
+        data.text.split("\n").forEach(addInfo);
+      } else if (data.type === 'state') {
+        wr_server_state = data.value;
+        wr_server_version = data.version;
+        handle_event_state(wr_server_state);
       } else {
         // window["handle_event_"+data.type]?.(data.value);
         if (window["handle_event_"+data.type]) {
@@ -269,6 +279,41 @@ function handle_event_state(data) {
   }
 }
 
+function handle_event_state_delta(delta) {
+  if (delta.version <= wr_server_version) {
+    return;                                      // already applied
+  } else if (delta.base > wr_server_version) {
+    // missed an update: query complete state
+    $.getJSON('/api/get_state',function(state) {
+      var version = state.version;
+      delete state.version;
+      if (version < wr_server_version) {
+        return;                                  // outdated response
+      }
+      wr_server_state = state;
+      wr_server_version = version;
+      handle_event_state(wr_server_state);
+    });
+    return;
+  }
+  // apply patch (only add/replace operations are used by the server)
+  $.each(delta.patch,function(index,op) {
+    var keys = op.path.split('/').slice(1).map(function(k) {
+      return k.replace(/~1/g,'/').replace(/~0/g,'~');
+    });
+    var obj = wr_server_state;
+    for (var i=0; i<keys.length-1; i++) {
+      if (typeof obj[keys[i]] !== 'object' || obj[keys[i]] === null) {
+        obj[keys[i]] = {};
+      }
+      obj = obj[keys[i]];
+    }
+    obj[keys[keys.length-1]] = op.value;
+  });
+  wr_server_version = delta.version;
+  handle_event_state(wr_server_state);
+}
+
 function handle_event_rec_start(data) {
   // toggle solid/regular btn
   $('#wr_rec_btn').removeClass('fas').addClass('far');
@@ -282,11 +327,7 @@ function handle_event_rec_stop(data) {
 }
 
 function handle_event_play(file) {
-
-  // start timer for update of elapsed-time
-  clearInterval(wr_update_play_time_id);
   wr_isPause = false;
-  wr_update_play_time_id = setInterval(update_play_time,1000);
 
   // enable pause-button
   $('#wr_pause_btn').removeClass('far').addClass('fas').prop("disabled", false);
@@ -301,7 +342,8 @@ function handle_event_play(file) {
     wr_state.player.last_index = wr_file2index[file];
     $('#f_'+wr_state.player.last_index).addClass('file_item_selected');
     cover_url = '/api/player_get_cover?dir='+encodeURIComponent(
-          wr_state.player.last_dir);
+          wr_state.player.last_dir)+
+          '&size='+Math.round(200*(window.devicePixelRatio || 1));
     $('#wr_play_logo').attr('src',cover_url);
   }
 }
@@ -312,10 +354,6 @@ function handle_event_pause(data) {
 }
 
 function handle_event_eof(data) {
-  if (wr_update_play_time_id) {
-    clearInterval(wr_update_play_time_id);
-    wr_update_play_time_id = null;
-  }
   $('#wr_infos').empty();
   $('#wr_pause_btn').removeClass('far').addClass('fas').prop("disabled", true);
   if (data.last) {
@@ -340,25 +378,41 @@ function handle_event_dir_select(data) {
   }
 }
 
-function handle_event_file_info(data) {
-  if (!wr_update_play_time_id) {
-    wr_state.player.time[0] = 0;
-    $("#wr_time_cur").text("00:00");
+function handle_event_dir_changed(data) {
+  // content of a directory changed: reload the list if it is shown
+  if (wr_dir_shown === data) {
+    $.getJSON('/api/player_get_dir',function(result) {
+      update_player_list(result);
+    });
   }
+}
+
+function handle_event_file_info(data) {
   wr_state.player.time[1] = data.total;
   $("#wr_time_tot").text(data.total_pretty);
 }
 
-function handle_event_sample(data) {
-  wr_isPause = data.pause;
-  wr_state.player.time[0] = ~~(data.elapsed*wr_state.player.time[1]);
-  if (wr_isPause) {
-    wr_state.player.time[0] -= 1;
-    update_play_time(true);
+function handle_event_dir_info_progress(data) {
+  if (wr_dir_progress.dir !== data.dir) {
+    wr_dir_progress = {'dir': data.dir, 'dur': {}};
   }
-  if (!wr_update_play_time_id) {
-    wr_update_play_time_id = setInterval(update_play_time,1000);
+  var shown = wr_dir_shown === data.dir;
+  $.each(data.dur,function(i,dur) {
+    wr_dir_progress.dur[dur[0]] = dur[2];
+    if (shown) {
+      $("#f_"+dur[0]+"_duration")
+        .html("<div class=\"ch_txt\">"+dur[2]+"</div>");
+    }
+  });
+}
+
+function handle_event_position(data) {
+  wr_isPause = data.pause;
+  wr_state.player.time[0] = data.elapsed;
+  if (data.total > 0) {
+    wr_state.player.time[1] = data.total;
   }
+  update_play_time();
 }
 
 /**
@@ -400,10 +454,18 @@ function update_channel_info(channel) {
 }
 
 /**
-  update dir/file list in player-tab
+  update dir/file list in player-tab. Durations of files not known yet
+  are published later with dir_info_progress-events (these might arrive
+  before the list).
 */
 
+var wr_dir_shown    = null;
+var wr_dir_progress = {'dir': null, 'dur': {}};
+
 function update_player_list(dirInfo) {
+  wr_dir_shown = dirInfo.cur_dir;
+  var progress = wr_dir_progress.dir === dirInfo.cur_dir ?
+    wr_dir_progress.dur : {};
   $(".dir_item:gt(0)").remove();              // only keep template
   $.each(dirInfo.dirs,function(index,dir) {
       var sep = "'";
@@ -437,7 +499,8 @@ function update_player_list(dirInfo) {
         .html("<div class=\"ch_txt\"></div>").text(file);
       item.children().eq(3).attr({"id": "f_"+index+"_duration",
             "onclick": "player_play_file({'file': "+sep+file+sep+"})"})
-        .html("<div class=\"ch_txt\">"+dirInfo.dur[index][1]+"</div>");
+        .html("<div class=\"ch_txt\">"+
+              (dirInfo.dur[index][1] || progress[index] || "")+"</div>");
       // highlight current file
       if (file == dirInfo.cur_file) {
         item.addClass('file_item_selected');
@@ -465,6 +528,22 @@ function radio_play_channel(data) {
   );
 };
 
+/**
+  Show the current directory of the server
+*/
+
+function player_show_dir() {
+  $("#msgarea").text("loading directory ...");
+  $.getJSON('/api/player_get_dir',
+    function(result) {
+      $("#msgarea").empty();
+      wr_state.player.last_dir = result.cur_dir;
+      update_player_list(result);
+      openTab('tab_files');
+    }
+  );
+};
+
 /**
   Switch to given directory (data should be {'dir': value})
 */
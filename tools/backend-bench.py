@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Headless benchmark of API-layer, event-bus and player-queueing using the
+# fake backend (no audio-hardware and no mpg123 needed).
+#
+# Usage: backend-bench.py [-c calls] [-k consumers] [-f files] [-d files]
+#                         [-s speed]
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# ----------------------------------------------------------------------------
+
+import sys, os, time, json, threading, tempfile, shutil, queue, configparser
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(sys.argv[0]),
+                             "../files/usr/local/lib"))
+sys.path.append("/usr/local/lib")
+
+import webradio
+
+# MPEG1 layer III, 128kbit/s, 44.1kHz: 417 bytes per frame
+MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+
+# --- minimal application-object   -------------------------------------------
+
+class Options(object):
+  pass
+
+class App(webradio.Base):
+  """ application with fake backend, radio and player (no webserver) """
+
+  def __init__(self,tmpdir,args):
+    self.debug      = False
+    self.stop_event = threading.Event()
+    self.options    = Options()
+    self.options.pgm_dir    = os.path.dirname(os.path.abspath(sys.argv[0]))
+    self.options.target_dir = None
+
+    channels = [{'name': "channel %d" % i, 'url': "http://localhost/%d" % i,
+                 'logo': "none.png"} for i in range(1,21)]
+    channel_file = os.path.join(tmpdir,"channels.json")
+    with open(channel_file,"w") as f:
+      json.dump(channels,f)
+
+    self.parser = configparser.RawConfigParser()
+    self.parser.read_dict({
+      'GLOBAL': {'channel_file': channel_file},
+      'FAKE':   {'speed': str(args.speed), 'connect_time': '0.3',
+                 'duration': '180', 'icy_interval': '30'},
+      'PLAYER': {'player_root_dir': tmpdir,
+                 'player_meta_db': os.path.join(tmpdir,"metadata.db")}
+      })
+
+    self.metrics = webradio.Metrics(self)
+    self.api     = webradio.Api(self)
+    self.api.get_version         = lambda: "bench"
+    self.api.update_state        = self.update_state
+    self.api._get_state_snapshot = lambda: (0,{})
+    self._events = webradio.RadioEvents(self)
+    self.backend = webradio.FakeBackend(self)
+    self.radio   = webradio.Radio(self)
+    self.player  = webradio.Player(self)
+    self.backend.create()
+
+  def update_state(self,section=None,key=None,value=None,publish=True):
+    """ state is not part of the benchmark """
+    pass
+
+  def cleanup(self):
+    self.backend.destroy()
+    self.stop_event.set()
+
+# --- print statistics   -----------------------------------------------------
+
+def print_stats(name,times):
+  """ print mean and percentiles of the given times """
+
+  times = sorted(times)
+  n     = len(times)
+  print("%-24s n=%5d  mean: %7.3f ms  p50: %7.3f ms  p95: %7.3f ms" %
+        (name,n,1000*sum(times)/n,1000*times[n//2],1000*times[int(0.95*n)]))
+
+# --- benchmark API-calls   --------------------------------------------------
+
+def bench_api(app,calls):
+  """ switch channels and change volume through the API-layer """
+
+  for api in ["radio_play_next","vol_up","radio_get_channels"]:
+    times = []
+    for i in range(calls):
+      start = time.perf_counter()
+      app.api._exec(api)
+      times.append(time.perf_counter()-start)
+    print_stats(api,times)
+  app.api.radio_off()                       # no icy_meta-events from now on
+
+# --- benchmark event-bus   --------------------------------------------------
+
+def bench_events(app,consumers,count):
+  """ push events and distribute them to consumers """
+
+  received = [0]*consumers
+  lagged   = [0]*consumers
+  finished = [0]*consumers                  # time of last event
+  def consume(nr,consumer):
+    while True:
+      try:
+        event = consumer.get(timeout=0.5)
+      except queue.Empty:
+        break                               # missed last event
+      finished[nr] = time.perf_counter()
+      if event['type'] == 'lagged':
+        lagged[nr] += 1
+      elif event['type'] == 'icy_meta':
+        received[nr] += 1
+        if event['value'] == 'last':
+          break
+
+  threads = []
+  for nr in range(consumers):
+    consumer = app.api._add_consumer("bench_%d" % nr,types=['icy_meta'])
+    threads.append(threading.Thread(target=consume,args=(nr,consumer)))
+    threads[-1].start()
+
+  start = time.perf_counter()
+  for i in range(count):
+    app.api._push_event({'type': 'icy_meta', 'value': "title %d" % i})
+  app.api._push_event({'type': 'icy_meta', 'value': 'last'})
+  for t in threads:
+    t.join()
+  secs = max(finished)-start
+  for nr in range(consumers):
+    app.api._del_consumer("bench_%d" % nr)
+  print("%-24s %d events, %d consumers: %.0f events/s, %d delivered, "
+        "%d lagged" % ("event-bus",count,consumers,count/secs,sum(received),
+                       sum(lagged)))
+
+# --- benchmark directory-playback   -----------------------------------------
+
+def bench_player(app,tmpdir,files,speed):
+  """ play a directory of files and measure the overhead """
+
+  album = os.path.join(tmpdir,"album")
+  os.mkdir(album)
+  for i in range(files):
+    with open(os.path.join(album,"%02d.mp3" % i),"wb") as f:
+      f.write(MP3_FRAME*38)
+
+  app.api.player_select_dir("/album")
+  consumer = app.api._add_consumer("bench_player",types=['eof'])
+  start = time.perf_counter()
+  app.api.player_play_dir()
+  while True:
+    try:
+      event = consumer.get(timeout=60)
+    except queue.Empty:
+      break
+    if event['value']['last']:
+      break
+  secs     = time.perf_counter()-start
+  expected = files*180/speed
+  app.api._del_consumer("bench_player")
+  print("%-24s %d files: %.2f s (playback: %.2f s, overhead: %.1f ms/file)" %
+        ("player_play_dir",files,secs,expected,1000*(secs-expected)/files))
+
+def bench_select_dir(app,tmpdir,files):
+  """ select a large directory and wait for all durations """
+
+  big = os.path.join(tmpdir,"big")
+  os.mkdir(big)
+  for i in range(files):
+    with open(os.path.join(big,"%04d.mp3" % i),"wb") as f:
+      f.write(MP3_FRAME*(38+i % 100))
+
+  for run in ["cold","warm"]:
+    consumer = app.api._add_consumer("bench_select",types=['dir_info_progress'])
+    start    = time.perf_counter()
+    dirinfo  = app.api.player_select_dir("/big")
+    listing  = time.perf_counter()-start
+    events   = 0
+    missing  = [d for d in dirinfo['dur'] if not d[1]]
+    while missing:
+      try:
+        event = consumer.get(timeout=10)
+      except queue.Empty:
+        break
+      events += 1
+      if event['value']['done'] == event['value']['total']:
+        break
+    secs = time.perf_counter()-start
+    app.api._del_consumer("bench_select")
+    print("%-24s %d files (%s): listing %.1f ms, durations %.1f ms (%d events)" %
+          ("player_select_dir",files,run,1000*listing,1000*secs,events))
+    app.api.player_select_dir("/")
+
+# --- main program   ---------------------------------------------------------
+
+if __name__ == '__main__':
+  parser = ArgumentParser(description='headless benchmark with fake backend')
+  parser.add_argument('-c', '--calls', type=int, default=200,
+                      help='number of calls per API')
+  parser.add_argument('-k', '--consumers', type=int, default=10,
+                      help='number of event-consumers')
+  parser.add_argument('-e', '--events', type=int, default=10000,
+                      help='number of events')
+  parser.add_argument('-f', '--files', type=int, default=10,
+                      help='number of files for player_play_dir')
+  parser.add_argument('-d', '--dirfiles', type=int, default=1000,
+                      help='number of files for player_select_dir')
+  parser.add_argument('-s', '--speed', type=float, default=1000,
+                      help='speed of fake backend')
+  args = parser.parse_args()
+
+  tmpdir = tempfile.mkdtemp()
+  app    = App(tmpdir,args)
+  try:
+    bench_api(app,args.calls)
+    bench_events(app,args.consumers,args.events)
+    bench_player(app,tmpdir,args.files,args.speed)
+    bench_select_dir(app,tmpdir,args.dirfiles)
+  finally:
+    app.cleanup()
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Benchmark of the library-index: crawl a generated library (or a directory)
+# cold, incrementally and after a change, and measure search-queries.
+#
+# Usage: library-bench.py [files [directory]]
+#
+# Without a directory, a library of small generated files (one frame with
+# an ID3v2-tag, organized as artist/album/track) is used.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# ----------------------------------------------------------------------------
+
+import sys, os, time, random, threading, tempfile, shutil, configparser
+
+sys.path.append(os.path.join(os.path.dirname(sys.argv[0]),
+                             "../files/usr/local/lib"))
+sys.path.append("/usr/local/lib")
+
+import webradio
+
+# MPEG1 layer III, 128kbit/s, 44.1kHz: 417 bytes per frame
+MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+
+WORDS = ("love night blue river summer dream fire heart rain moon sun road " +
+         "city light dance song wind star home time gold ocean black white " +
+         "wild young free sweet lost angel storm shadow silver garden").split()
+
+QUERIES = ["love", "ni", "blue river", "art 12", "summer dream fire", "xyz",
+           "s", "album 3", "angel sha"]
+
+# --- create library   -------------------------------------------------------
+
+def id3v2(tags):
+  """ return ID3v2.3-tag with the given text-frames """
+
+  data = b''
+  for frame_id, text in tags:
+    text  = b'\x00' + text.encode('latin-1')
+    data += frame_id + len(text).to_bytes(4,'big') + b'\x00\x00' + text
+  n = len(data)
+  return (b'ID3\x03\x00\x00' +
+          bytes([(n >> 21) & 0x7f,(n >> 14) & 0x7f,(n >> 7) & 0x7f,n & 0x7f]) +
+          data)
+
+def create_library(root,count):
+  """ create count files as artist/album/track.mp3 """
+
+  rnd = random.Random(42)
+  for i in range(count):
+    artist = "artist %d" % (i // 200)
+    album  = "album %d" % (i // 20 % 10)
+    title  = " ".join(rnd.sample(WORDS,3))
+    dir    = os.path.join(root,artist,album)
+    if i % 20 == 0:
+      os.makedirs(dir,exist_ok=True)
+    with open(os.path.join(dir,"%02d %s.mp3" % (i % 20,title)),"wb") as f:
+      f.write(id3v2([(b'TIT2',title),(b'TPE1',artist),(b'TALB',album)]))
+      f.write(MP3_FRAME)
+
+# --- minimal application-object   -------------------------------------------
+
+class App(object):
+  """ minimal application-object """
+
+  def __init__(self,db_file):
+    self.debug      = False
+    self.stop_event = threading.Event()
+    self.parser     = configparser.RawConfigParser()
+    self.parser.read_dict({'PLAYER': {'player_meta_db': db_file,
+                                      'player_index_interval': '0'}})
+    self.metrics    = webradio.Metrics(self)
+
+# --- run benchmark   --------------------------------------------------------
+
+def run_crawl(name,library):
+  """ crawl the library """
+
+  start = time.perf_counter()
+  library.crawl()
+  print("%-24s %8.1f ms" % (name,1000*(time.perf_counter()-start)))
+
+def run_search(library,q,n=20):
+  """ run query n times, print mean and number of results """
+
+  start = time.perf_counter()
+  for i in range(n):
+    result = library.search(q,20)
+  secs = (time.perf_counter()-start)/n
+  print("search %-17s %8.2f ms  (%d results)" % ("'%s'" % q,1000*secs,
+                                                  len(result)))
+
+# --- main program   ---------------------------------------------------------
+
+if __name__ == '__main__':
+  count  = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+  tmpdir = tempfile.mkdtemp()
+  try:
+    if len(sys.argv) > 2:
+      root = os.path.abspath(sys.argv[2])
+    else:
+      root  = os.path.join(tmpdir,"library")
+      start = time.perf_counter()
+      create_library(root,count)
+      print("%-24s %8.1f ms  (%d files)" %
+            ("create library",1000*(time.perf_counter()-start),count))
+
+    db_file = os.path.join(tmpdir,"metadata.db")
+    app     = App(db_file)
+    meta    = webradio.MetaStore(app)
+    library = webradio.Library(app,meta,root)
+
+    run_crawl("crawl (cold)",library)
+    run_crawl("crawl (unchanged)",library)
+    if len(sys.argv) <= 2:
+      shutil.copy(os.path.join(root,"artist 0","album 0",
+                               os.listdir(os.path.join(root,"artist 0",
+                                                       "album 0"))[0]),
+                  os.path.join(root,"artist 0","album 0","99 new song.mp3"))
+      shutil.rmtree(os.path.join(root,"artist 1"))
+      # change a file in place (the mtime of the directory is unchanged)
+      album = os.path.join(root,"artist 2","album 0")
+      with open(os.path.join(album,sorted(os.listdir(album))[0]),"wb") as f:
+        f.write(id3v2([(b'TIT2',"changed in place")]))
+        f.write(MP3_FRAME)
+      run_crawl("crawl (after change)",library)
+    print("%-24s %8d files, database: %.1f MB" %
+          ("index",meta.count_files(root),
+           sum([os.path.getsize(db_file+ext) for ext in ["","-wal"]
+                if os.path.exists(db_file+ext)])/1024/1024))
+
+    for q in QUERIES + (["new song","changed in place"]
+                        if len(sys.argv) <= 2 else []):
+      run_search(library,q)
+    meta.close()
+  finally:
+    shutil.rmtree(tmpdir)
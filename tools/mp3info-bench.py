@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Compare the duration-parser of class Mp3Info with the mp3info-program on
+# a generated corpus (CBR with ID3-tags, VBR with Xing- and VBRI-header).
+# Also measures reading a directory with an empty (cold) and a filled
+# (warm) MetaStore.
+#
+# Usage: mp3info-bench.py [files [directory]]
+#
+# Without a directory, a corpus of generated files is used.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# ----------------------------------------------------------------------------
+
+import sys, os, time, tempfile, shutil, subprocess, configparser
+
+sys.path.append(os.path.join(os.path.dirname(sys.argv[0]),
+                             "../files/usr/local/lib"))
+sys.path.append("/usr/local/lib")
+
+import webradio
+
+# --- create frames   --------------------------------------------------------
+
+def frame(br_idx,mpeg1=True,mono=False,payload=None,padding=0):
+  """ return layer III frame (44.1kHz or 22.05kHz) with the given bitrate """
+
+  version = 3 if mpeg1 else 2
+  header  = (0x7FF << 21 | version << 19 | 1 << 17 | 1 << 16 |
+             br_idx << 12 | 0 << 10 | padding << 9 | (3 if mono else 0) << 6)
+  info    = webradio.Mp3Info()._parse_header(header.to_bytes(4,'big'),0)
+  data    = header.to_bytes(4,'big') + (payload or b'')
+  return data + bytes(info[4]-len(data))
+
+def cbr_frames(f,br_idx,count,mpeg1=True,mono=False):
+  """ write count frames with padding like an encoder (exact bitrate) """
+
+  info  = webradio.Mp3Info()._parse_header(frame(br_idx,mpeg1,mono),0)
+  exact = info[2]*info[5]/8/info[3]         # bytes per frame (fractional)
+  plain = frame(br_idx,mpeg1,mono)
+  pad   = frame(br_idx,mpeg1,mono,padding=1)
+  total = 0.0
+  for i in range(count):
+    total += exact
+    if total-len(plain) >= 1:
+      f.write(pad)
+      total -= len(pad)
+    else:
+      f.write(plain)
+      total -= len(plain)
+
+def id3v2(size):
+  """ return ID3v2.3-tag with a padding of size bytes """
+
+  tag = b'TIT2' + (6).to_bytes(4,'big') + b'\x00\x00' + b'\x00Title'
+  tag = tag + bytes(size)
+  n   = len(tag)
+  return (b'ID3\x03\x00\x00' +
+          bytes([(n >> 21) & 0x7f,(n >> 14) & 0x7f,(n >> 7) & 0x7f,n & 0x7f]) +
+          tag)
+
+def id3v1():
+  """ return ID3v1-tag """
+
+  return b'TAG' + bytes(125)
+
+def create_cbr(path,secs):
+  """ CBR 128kbit/s with ID3v2- and ID3v1-tag """
+
+  with open(path,"wb") as f:
+    f.write(id3v2(2000))
+    cbr_frames(f,9,int(secs*38.28))
+    f.write(id3v1())
+  return int(secs*38.28)*1152/44100
+
+def create_xing(path,secs):
+  """ VBR (alternating bitrates) with Xing-header """
+
+  frames = int(secs*38.28)
+  xing   = bytes(32) + b'Xing' + (1).to_bytes(4,'big') + frames.to_bytes(4,'big')
+  with open(path,"wb") as f:
+    f.write(id3v2(100))
+    f.write(frame(9,payload=xing))
+    for i in range(frames):
+      f.write(frame(5 if i % 3 else 13))
+  return frames*1152/44100
+
+def create_vbri(path,secs):
+  """ VBR with VBRI-header """
+
+  frames = int(secs*38.28)
+  vbri   = (bytes(32) + b'VBRI' + bytes(10) + frames.to_bytes(4,'big'))
+  with open(path,"wb") as f:
+    f.write(frame(9,payload=vbri))
+    for i in range(frames):
+      f.write(frame(7 if i % 2 else 11))
+  return frames*1152/44100
+
+def create_mpeg2(path,secs):
+  """ MPEG2 mono CBR 64kbit/s (no tags) """
+
+  frames = int(secs*22050/576)
+  with open(path,"wb") as f:
+    cbr_frames(f,8,frames,mpeg1=False,mono=True)
+  return frames*576/22050
+
+CREATORS = [create_cbr,create_xing,create_vbri,create_mpeg2]
+
+def create_corpus(dir,count):
+  """ create count files, return dict path -> expected duration """
+
+  expected = {}
+  for i in range(count):
+    path = os.path.join(dir,"%04d.mp3" % i)
+    expected[path] = CREATORS[i % len(CREATORS)](path,60+i % 300)
+  return expected
+
+# --- run benchmark   --------------------------------------------------------
+
+def run(name,func,paths):
+  """ run func for all paths and return dict path -> duration """
+
+  start  = time.perf_counter()
+  result = {path: func(path) for path in paths}
+  secs   = time.perf_counter()-start
+  print("%-12s %5d files: %8.1f ms  (%.3f ms/file)" %
+        (name,len(paths),1000*secs,1000*secs/len(paths)))
+  return result
+
+def check(name,result,expected):
+  """ compare results with expected durations (in seconds) """
+
+  errors = [path for path in expected
+            if result[path] is None or abs(result[path]-expected[path]) > 1]
+  print("%-12s %5d of %d durations differ by more than 1s" %
+        (name,len(errors),len(expected)))
+
+# --- read directory with MetaStore   ----------------------------------------
+
+class App(object):
+  """ minimal application-object """
+
+  def __init__(self,db_file):
+    self.debug   = False
+    self.parser  = configparser.RawConfigParser()
+    self.parser.read_dict({'PLAYER': {'player_meta_db': db_file}})
+    self.metrics = webradio.Metrics(self)
+
+def run_store(name,store,paths):
+  """ read all directories of paths with scandir and the store """
+
+  start = time.perf_counter()
+  for dir in sorted(set(os.path.dirname(path) for path in paths)):
+    files = []
+    with os.scandir(dir) as entries:
+      for entry in entries:
+        if entry.name.endswith(".mp3"):
+          st = entry.stat()
+          files.append((entry.name,st.st_size,st.st_mtime_ns))
+    store.get_dir(dir,files)
+  secs = time.perf_counter()-start
+  print("%-12s %5d files: %8.1f ms  (%.3f ms/file)" %
+        (name,len(paths),1000*secs,1000*secs/len(paths)))
+
+# --- main program   ---------------------------------------------------------
+
+if __name__ == '__main__':
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+  if len(sys.argv) > 2:
+    tmpdir   = None
+    paths    = [os.path.join(sys.argv[2],f) for f in sorted(
+                  os.listdir(sys.argv[2])) if f.endswith(".mp3")][:count]
+    expected = None
+  else:
+    tmpdir   = tempfile.mkdtemp()
+    expected = create_corpus(tmpdir,count)
+    paths    = list(expected)
+
+  mp3info = webradio.Mp3Info()
+  try:
+    parsed = run("Mp3Info",mp3info.get_duration,paths)
+    if shutil.which("mp3info"):
+      spawned = run("mp3info",lambda path: int(subprocess.check_output(
+        ["mp3info","-p","%S",path])),paths)
+      if not expected:
+        expected = {path: float(secs) for path,secs in spawned.items()}
+    else:
+      print("%-12s skipped (not installed)" % "mp3info")
+    if expected:
+      check("Mp3Info",parsed,expected)
+
+    db_dir = tempfile.mkdtemp()
+    store  = webradio.MetaStore(App(os.path.join(db_dir,"metadata.db")))
+    run_store("cold store",store,paths)
+    run_store("warm store",store,paths)
+    store.close()
+    shutil.rmtree(db_dir)
+  finally:
+    if tmpdir:
+      shutil.rmtree(tmpdir)
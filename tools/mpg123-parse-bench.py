@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Replay mpg123-output (remote-mode) through the reader of class Mpg123 and
+# through the old text-mode parser and compare the throughput.
+#
+# Usage: mpg123-parse-bench.py [capture-file [repeat]]
+#
+# A capture can be created with e.g.
+#   (echo "LOAD http://stream-url"; sleep 60) | mpg123 -R > capture.txt
+# Without a capture-file, a synthetic capture (10 minutes of playback) is used.
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# ----------------------------------------------------------------------------
+
+import sys, os, io, re, time, queue, configparser
+
+sys.path.append(os.path.join(os.path.dirname(sys.argv[0]),
+                             "../files/usr/local/lib"))
+sys.path.append("/usr/local/lib")
+
+import webradio
+
+# --- synthetic capture   ----------------------------------------------------
+
+def create_capture(secs=600):
+  """ return mpg123-output for secs seconds of playback """
+
+  lines = ["@R MPG123 (ThOr) v10",
+           "@I ICY-NAME: Some Radio",
+           "@I ICY-URL: http://example.com",
+           "@S 1.0 3 44100 Joint-Stereo 0 417 2 0 0 0 128 0 1",
+           "@P 2"]
+  frames = int(secs*38.28)                  # frames per second at 44.1kHz
+  for i in range(frames):
+    lines.append("@F %d %d %.2f %.2f" % (i,frames-i,i/38.28,(frames-i)/38.28))
+    if i % 1000 == 0:
+      lines.append("@I ICY-META: StreamTitle='Artist %d - Title';" % i)
+  lines.append("@P 0")
+  return ("\n".join(lines)+"\n").encode('utf-8')
+
+# --- old parser (text-mode with startswith-chain)   -------------------------
+
+def legacy_parse(data,push_event):
+  """ parse like the old reader-thread """
+
+  stdout = io.TextIOWrapper(io.BytesIO(data),errors='replace')
+  regex  = re.compile(r".*ICY-META.*?'([^']*)';?.*\n")
+  while True:
+    line = stdout.readline()
+    if not line:
+      break
+    if line.startswith("@F"):
+      continue
+    if line.startswith("@I ICY-META"):
+      (line,_) = regex.subn(r'\1',line)
+      push_event({'type': 'icy_meta', 'value': line})
+    elif line.startswith("@I ICY-NAME"):
+      push_event({'type': 'icy_name', 'value': line[13:].rstrip("\n")})
+    elif line.startswith("@I ID3v2"):
+      tag = line[9:].rstrip("\n").split(":")
+      push_event({'type': 'id3', 'value': {'tag': tag[0], 'value': tag[1]}})
+    elif line.startswith("@P 0"):
+      push_event({'type': 'eof', 'value': None})
+    elif line.startswith("@P 1"):
+      push_event({'type': 'pause', 'value': None})
+    elif line.startswith("@P 2"):
+      push_event({'type': 'play', 'value': None})
+    elif line.startswith("@SAMPLE"):
+      sample = line.split()
+      push_event({'type': 'sample',
+                  'value': {'elapsed': int(sample[1])/int(sample[2])}})
+
+# --- new parser (reader-thread of class Mpg123)   ---------------------------
+
+class Process(object):
+  """ replaces the mpg123-process """
+
+  def __init__(self,data):
+    self.stdout = io.BytesIO(data)
+
+class App(object):
+  """ minimal application-object """
+
+  def __init__(self):
+    self.debug  = False
+    self.parser = configparser.RawConfigParser()
+    self.metrics = webradio.Metrics(self)
+    self.api     = webradio.Api(self)
+
+def create_player(push_event):
+  """ create Mpg123-object without a process """
+
+  app = App()
+  app.api._push_event = push_event
+  player = webradio.Mpg123(app)
+  player.track_position(True)               # as with a connected client
+  return player
+
+def mpg123_parse(player,data):
+  """ parse with the reader of class Mpg123 """
+
+  process = player._active
+  process._process   = Process(data)
+  process._cmd_queue = queue.Queue()
+  process._path      = "http://example.com"   # as if loaded
+  process._process_stdout()
+
+# --- run benchmark   --------------------------------------------------------
+
+def run(name,func,lines,repeat):
+  """ run func repeat times and print result """
+
+  start = time.perf_counter()
+  for i in range(repeat):
+    func()
+  secs = time.perf_counter()-start
+  print("%-28s %8.1f ms  %10.0f lines/s" %
+        (name,1000*secs/repeat,lines*repeat/secs))
+
+# --- main program   ---------------------------------------------------------
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    with open(sys.argv[1],"rb") as f:
+      data = f.read()
+  else:
+    data = create_capture()
+  repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+  silenced = b"".join([l for l in data.splitlines(True)
+                       if not l.startswith(b"@F")])
+  lines    = data.count(b"\n")
+  events   = []
+  print("capture: %d lines, %d @F-lines" %
+        (lines,lines-silenced.count(b"\n")))
+
+  player = create_player(events.append)
+  run("old parser",lambda: legacy_parse(data,events.append),lines,repeat)
+  run("Mpg123 reader",lambda: mpg123_parse(player,data),lines,repeat)
+  run("Mpg123 reader (SILENCE)",lambda: mpg123_parse(player,silenced),
+      lines,repeat)
+  listener = lambda *args: None
+  player.add_frame_listener(listener)
+  run("Mpg123 reader (listener)",lambda: mpg123_parse(player,data),
+      lines,repeat)
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Measure the number of bytes transferred for loading the web-gui: without
+# compression, with gzip/brotli and for a repeated visit (revalidation).
+#
+# Usage: static-bench.py [url]      (default: http://localhost:8026)
+#
+# Author: Bernhard Bablok
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-webradio
+#
+# ----------------------------------------------------------------------------
+
+import sys, re, time, urllib.request, urllib.error
+
+# --- fetch a single url   ---------------------------------------------------
+
+def fetch(url,encoding=None,etag=None):
+  """ return tuple (status,bytes,etag) """
+
+  req = urllib.request.Request(url)
+  if encoding:
+    req.add_header('Accept-Encoding',encoding)
+  if etag:
+    req.add_header('If-None-Match',etag)
+  try:
+    with urllib.request.urlopen(req) as resp:
+      return (resp.status,len(resp.read()),resp.headers.get('ETag'))
+  except urllib.error.HTTPError as err:
+    return (err.code,0,err.headers.get('ETag'))
+
+# --- load page and assets   -------------------------------------------------
+
+def load_page(base,assets,encoding=None,etags=None):
+  """ load all assets, return tuple (bytes,count 304,time) """
+
+  total   = 0
+  cached  = 0
+  start   = time.perf_counter()
+  for asset in assets:
+    status, size, etag = fetch(base+asset,encoding,
+                               etags.get(asset) if etags else None)
+    total += size
+    if status == 304:
+      cached += 1
+  return (total,cached,time.perf_counter()-start)
+
+# --- main program   ---------------------------------------------------------
+
+if __name__ == '__main__':
+  base = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8026"
+  base = base.rstrip('/')
+
+  with urllib.request.urlopen(base+"/") as resp:
+    page = resp.read().decode('utf-8')
+  assets = re.findall(r'(?:href|src)="(/(?:css|js|images|webfonts)/[^"]+)"',
+                      page)
+  print("main page: %d bytes, %d assets" % (len(page),len(assets)))
+
+  etags = {asset: fetch(base+asset,'br, gzip')[2] for asset in assets}
+  for name, encoding, tags in [("identity",None,None),
+                               ("gzip","gzip",None),
+                               ("br, gzip","br, gzip",None),
+                               ("repeat (304)","br, gzip",etags)]:
+    total, cached, secs = load_page(base,assets,encoding,tags)
+    print("%-14s %9d bytes  %3d x 304  %7.1f ms" %
+          (name,total,cached,1000*secs))